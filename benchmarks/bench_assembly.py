@@ -0,0 +1,89 @@
+"""
+Send a directory of STL parts with STLAssemblySender, which parses them on
+a process pool, and compare it with loading the parts one after the other.
+
+usage: python bench_assembly.py [-n REPEAT] [--parts N] [--triangles N]
+                                [--processes N]
+
+The parts are --parts tori of --triangles triangles each, written as binary
+STL files. Reported are the seconds until the first frame went out and
+until the whole assembly did.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+from pyV3D.handler import WS_WV_Wrapper
+from pyV3D.stl import STLSender, STLGeometryObject
+from pyV3D.assembly import STLAssemblySender, get_pool
+
+from bench_send import StubHandler
+from synthetic import torus, write_binary_stl
+
+
+class TimedHandler(StubHandler):
+    """Notes when the first frame was written."""
+
+    def __init__(self):
+        super(TimedHandler, self).__init__()
+        self.first = None
+
+    def write_binary(self, data):
+        if self.first is None:
+            self.first = time.time()
+        return super(TimedHandler, self).write_binary(data)
+
+
+class SerialSender(STLSender):
+    """Loads the parts of a directory one after the other."""
+
+    def geom_from_file(self, dirname):
+        for fname in sorted(os.listdir(dirname)):
+            geom = STLGeometryObject(os.path.join(dirname, fname))
+            geom.get_visualization_data(self.wv, angle=15.)
+            self.wv.graphics_primitives[-1].name = fname
+
+
+def run(klass, dirname):
+    wv = WS_WV_Wrapper()
+    handler = TimedHandler()
+    wv.open(handler)
+    start = time.time()
+    klass(wv).send(dirname, first=True)
+    return handler.first - start, time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--parts', type=int, default=200)
+    parser.add_argument('--triangles', type=int, default=20000)
+    parser.add_argument('--processes', type=int, default=None)
+    options = parser.parse_args(argv)
+
+    get_pool(options.processes)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for i in range(options.parts):
+            # parts of varying size, so some take longer than others
+            points, normals, tris = torus(options.triangles*(1 + i % 4)/2)
+            points = points + i
+            write_binary_stl(os.path.join(tmpdir, 'part_%04d.stl' % i),
+                             points, normals, tris)
+
+        print("%-10s %12s %12s" % ('send', 'first (s)', 'all (s)'))
+        for name, klass in (('serial', SerialSender),
+                            ('pool', STLAssemblySender)):
+            best = min(run(klass, tmpdir) for i in range(options.repeat))
+            print("%-10s %12.3f %12.3f" % (name, best[0], best[1]))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Compare adding faces one set_face_data call at a time against adding
+them all with one set_faces_batch call, as for CAD models with many small
+faces.
+
+usage: python bench_batch.py [-n REPEAT] [--min N] [--max N]
+                             [--edges MODE]
+
+Face counts go up by factors of ten from --min to --max. Every face is a
+small patch of 8 triangles. The times cover setting the faces and adding
+them to the context in prepare_for_sends.
+"""
+
+import sys
+import argparse
+
+import numpy as np
+
+from bench_gprims import make_context
+from bench_stl import best_of
+
+
+def make_faces(count):
+    """Return the points, 1 based triangles and offsets of count patches
+    of 3x3 points laid out side by side."""
+    x, y = np.meshgrid(np.arange(3), np.arange(3))
+    patch = np.column_stack((x.ravel(), y.ravel(), np.zeros(9)))
+    quads = [(0, 1, 4, 3), (1, 2, 5, 4), (3, 4, 7, 6), (4, 5, 8, 7)]
+    tris = np.array([[a, b, c, a, c, d] for a, b, c, d in quads]).ravel() + 1
+
+    shift = np.column_stack((3*np.arange(count), np.zeros((count, 2))))
+    points = (patch[None] + shift[:, None]).astype(np.float32).reshape(-1)
+    return (points, np.tile(tris, count).astype(np.int32),
+            9*np.arange(count+1), 8*np.arange(count+1))
+
+
+def each(count, faces, edges):
+    points, tris, point_offsets, tri_offsets = faces
+    wv = make_context()
+    for i in range(count):
+        wv.set_face_data(points[3*point_offsets[i]:3*point_offsets[i+1]],
+                         tris[3*tri_offsets[i]:3*tri_offsets[i+1]],
+                         name='face_%d' % i, edges=edges)
+    wv.prepare_for_sends()
+    wv.finish_sends()
+
+
+def batch(count, faces, edges):
+    points, tris, point_offsets, tri_offsets = faces
+    wv = make_context()
+    wv.set_faces_batch(points, tris, point_offsets, tri_offsets,
+                       ['face_%d' % i for i in range(count)], edges=edges)
+    wv.prepare_for_sends()
+    wv.finish_sends()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--min', type=float, default=1e2)
+    parser.add_argument('--max', type=float, default=1e5)
+    parser.add_argument('--edges', default='all',
+                        help="edge mode, 'all', 'unique' or 'feature'")
+    options = parser.parse_args(argv)
+
+    print("%8s %12s %12s %8s %14s" % ('faces', 'each (s)', 'batch (s)',
+                                      'speedup', 'batch/face (us)'))
+    count = int(options.min)
+    while count <= options.max:
+        faces = make_faces(count)
+        t_each, _ = best_of(options.repeat,
+                            lambda: each(count, faces, options.edges))
+        t_batch, _ = best_of(options.repeat,
+                             lambda: batch(count, faces, options.edges))
+        print("%8d %12.4f %12.4f %8.1f %14.1f" % (
+              count, t_each, t_batch, t_each/t_batch, 1e6*t_batch/count))
+        count *= 10
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+"""
+Measure the memory held by many wrappers of small scenes, and the time a
+send takes, e.g. for a server with many viewers of small parts.
+
+usage: python bench_buffers.py [-n COUNT] [--buffer-size N]
+
+COUNT wrappers each get and send a cube. The memory is the growth of the
+process's peak resident size, so run one measurement per process.
+"""
+
+import sys
+import time
+import argparse
+import resource
+
+from pyV3D.handler import WS_WV_Wrapper
+from pyV3D.cube import CubeSender, CubeGeometry
+
+
+def peak_mb():
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-n', '--count', type=int, default=500)
+    parser.add_argument('--buffer-size', type=int, default=None)
+    options = parser.parse_args(argv)
+
+    before = peak_mb()
+    wrappers = []
+    start = time.time()
+    for i in range(options.count):
+        wv = WS_WV_Wrapper(buffer_size=options.buffer_size)
+        CubeSender(wv).send(CubeGeometry(), first=True)
+        wrappers.append(wv)
+    elapsed = time.time() - start
+
+    print("%d wrappers: %.1f MB, %.3f ms per send" % (
+          options.count, peak_mb() - before, 1000*elapsed/options.count))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Compare the size of scenes in the pyv3d-bin-1.0 encoding and in the
+compact encoding of pyV3D.compact, and how long the rewriting takes.
+
+usage: python bench_compact.py [-n REPEAT] [--weld] [--edges MODE]
+                               [--mbps MBPS] [stl_file ...]
+
+With no files, the STL files bundled in pyV3D/test are used. The transfer
+times are what the scene takes over a link of --mbps megabits per second.
+"""
+
+import os
+import sys
+import argparse
+
+from pyV3D.handler import WS_WV_Wrapper
+from pyV3D.compact import compact_frames
+from pyV3D.stl import STLSender, STLGeometryObject
+
+from bench_stl import TEST_DIR, best_of
+
+
+def encode(fname, weld, edges):
+    wv = WS_WV_Wrapper()
+    STLSender(wv)
+    STLGeometryObject(fname, weld=weld, edges=edges).get_visualization_data(
+        wv, angle=15.)
+    wv.prepare_for_sends()
+    frames = wv._encode(-1)
+    wv.finish_sends()
+    return frames
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--weld', action='store_true',
+                        help='weld the STL vertices first')
+    parser.add_argument('--edges', default='all',
+                        help="edge mode, 'all', 'unique' or 'feature'")
+    parser.add_argument('--mbps', type=float, default=10.,
+                        help='link speed for the transfer times')
+    options = parser.parse_args(argv)
+
+    files = options.files or [os.path.join(TEST_DIR, f) for f in
+                              ('knot.stl', 'Star.stl', 'dancing_snowman.stl')]
+
+    print("%-24s %-10s %12s %8s %12s %14s" % (
+          'file', 'encoding', 'scene (MB)', 'ratio', 'rewrite (s)',
+          'transfer (s)'))
+    for fname in files:
+        frames = encode(fname, options.weld, options.edges)
+        nbytes = sum(len(frame) for frame in frames)
+        rows = [('bin-1.0', nbytes, None)]
+        for bits in (16, 8):
+            elapsed, compact = best_of(options.repeat,
+                                       lambda: compact_frames(frames, bits))
+            rows.append(('compact%d' % bits,
+                         sum(len(frame) for frame in compact), elapsed))
+
+        for encoding, size, elapsed in rows:
+            print("%-24s %-10s %12.3f %8.2f %12s %14.3f" % (
+                  os.path.basename(fname), encoding, size/1e6,
+                  float(nbytes)/size,
+                  '-' if elapsed is None else '%.4f' % elapsed,
+                  8*size/(options.mbps*1e6)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Compare the codecs of pyV3D.compress on the frames of STL scenes, in the
+pyv3d-bin-1.0 encoding and in the compact one.
+
+usage: python bench_compress.py [-n REPEAT] [--weld] [--levels L,L,...]
+                                [stl_file ...]
+
+With no files, the STL files bundled in pyV3D/test are used. Codecs whose
+packages are not installed are skipped. The speeds are in MB of
+uncompressed frames per second.
+"""
+
+import os
+import sys
+import argparse
+
+from pyV3D.compact import compact_frames
+from pyV3D.compress import Codec, CODECS
+
+from bench_stl import TEST_DIR, best_of
+from bench_compact import encode
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--weld', action='store_true',
+                        help='weld the STL vertices first')
+    parser.add_argument('--levels', default='1,6,9',
+                        help='comma separated compression levels')
+    options = parser.parse_args(argv)
+
+    files = options.files or [os.path.join(TEST_DIR, f) for f in
+                              ('knot.stl', 'dancing_snowman.stl')]
+    levels = [int(level) for level in options.levels.split(',')]
+
+    print("%-20s %-8s %-8s %6s %10s %8s %10s %10s" % (
+          'file', 'encoding', 'codec', 'level', 'sent (MB)', 'ratio',
+          'comp MB/s', 'decomp MB/s'))
+    for fname in files:
+        frames = encode(fname, options.weld, 'all')
+        for encoding, scene in (('bin-1.0', frames),
+                                ('compact', compact_frames(frames))):
+            nbytes = sum(len(frame) for frame in scene)
+            for name in sorted(CODECS):
+                for level in levels:
+                    try:
+                        codec = Codec(name, level)
+                    except ImportError:
+                        break
+                    t_comp, (sent, _) = best_of(
+                        options.repeat, lambda: codec.compress_frames(scene))
+                    t_decomp, _ = best_of(
+                        options.repeat,
+                        lambda: [codec.decompress(frame) for frame in sent])
+                    size = sum(len(frame) for frame in sent)
+                    print("%-20s %-8s %-8s %6d %10.3f %8.2f %10.1f %10.1f" % (
+                          os.path.basename(fname), encoding, name, level,
+                          size/1e6, float(nbytes)/size, nbytes/1e6/t_comp,
+                          nbytes/1e6/t_decomp))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Compare opening a model from its STL file with opening it from a scene
+container compiled from it beforehand.
+
+usage: python bench_container.py [-n REPEAT] [--triangles N] [--weld]
+
+A torus of --triangles triangles is written as a binary STL file and
+compiled into a container. Reported for each are the seconds until a
+viewer was written the first frame and the whole scene, and the peak RSS
+in MB, each in a process of its own so the page cache is the only thing
+the runs share. The compile time is reported once.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+
+from pyV3D.handler import WS_WV_Wrapper
+from pyV3D.stl import STLSender, STLGeometryObject
+from pyV3D.container import ContainerSender, compile_scene
+
+from bench_assembly import TimedHandler
+from bench_send import reset_peak_rss, peak_rss_mb
+from synthetic import torus, write_binary_stl
+
+
+class WeldingSender(STLSender):
+
+    def geom_from_file(self, fname):
+        STLGeometryObject(fname, weld=True).get_visualization_data(
+            self.wv, angle=15.)
+
+
+def run(args):
+    klass, fname = args
+    reset_peak_rss()
+    base = peak_rss_mb()
+    wv = WS_WV_Wrapper()
+    handler = TimedHandler()
+    wv.open(handler)
+    start = time.time()
+    klass(wv, obj=fname).send(fname, first=True)
+    return (handler.first - start, time.time() - start,
+            peak_rss_mb() - base)
+
+
+def best(klass, fname, repeat):
+    results = []
+    for i in range(repeat):
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            results.append(pool.map(run, [(klass, fname)])[0])
+        finally:
+            pool.close()
+            pool.join()
+    return min(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--triangles', type=int, default=1000000)
+    parser.add_argument('--weld', action='store_true')
+    options = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        stl = os.path.join(tmpdir, 'torus.stl')
+        write_binary_stl(stl, *torus(options.triangles))
+        start = time.time()
+        container = compile_scene(stl, weld=options.weld)
+        print("compiled %d MB of STL into %d MB in %.3f s" % (
+            os.path.getsize(stl)//1000000, os.path.getsize(container)//1000000,
+            time.time() - start))
+
+        print("%-10s %12s %12s %10s" % ('open', 'first (s)', 'all (s)',
+                                        'peak MB'))
+        sender = WeldingSender if options.weld else STLSender
+        for name, klass, fname in (('stl', sender, stl),
+                                   ('container', ContainerSender, container)):
+            first, total, peak = best(klass, fname, options.repeat)
+            print("%-10s %12.3f %12.3f %10.1f" % (name, first, total, peak))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Compare the edge modes of add_triangle: how many segments each one sends,
+the size of the encoded scene and the time to build the segments.
+
+usage: python bench_edges.py [-n REPEAT] [--weld] [--angle DEG]
+                             [stl_file ...]
+
+With no files, the STL files bundled in pyV3D/test are used.
+"""
+
+import os
+import sys
+import argparse
+
+from pyV3D.handler import WS_WV_Wrapper
+from pyV3D.mesh import EDGE_MODES, triangle_edges
+from pyV3D.stl import STLSender, STLGeometryObject
+
+from bench_stl import TEST_DIR, best_of
+
+
+def scene_size(fname, weld, edges, angle):
+    wv = WS_WV_Wrapper()
+    STLSender(wv)
+    STLGeometryObject(fname, weld=weld, edges=edges).get_visualization_data(
+        wv, angle=15.)
+    for prim in wv.graphics_primitives:
+        prim.feature_angle = angle
+    wv.prepare_for_sends()
+    nbytes = sum(len(frame) for frame in wv._encode(-1))
+    wv.finish_sends()
+    return wv.graphics_primitives, nbytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--weld', action='store_true',
+                        help='weld the STL vertices first')
+    parser.add_argument('--angle', type=float, default=30.,
+                        help='dihedral angle for feature edges')
+    options = parser.parse_args(argv)
+
+    files = options.files or [os.path.join(TEST_DIR, f) for f in
+                              ('knot.stl', 'Star.stl', 'dancing_snowman.stl')]
+
+    print("%-24s %-8s %10s %12s %12s" % ('file', 'edges', 'segments',
+                                         'scene (MB)', 'edges (s)'))
+    for fname in files:
+        for edges in EDGE_MODES:
+            prims, nbytes = scene_size(fname, options.weld, edges,
+                                       options.angle)
+            elapsed, segs = best_of(options.repeat, lambda: [
+                triangle_edges(p.tris, p.points, edges, options.angle, 1)
+                for p in prims])
+            print("%-24s %-8s %10d %12.2f %12.4f" % (
+                  os.path.basename(fname), edges,
+                  sum(len(s) for s in segs)//2, nbytes/1e6, elapsed))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Measure how adding, looking up and removing named GPrims scales with the
+number of GPrims in a context, as in assemblies with one GPrim per face.
+
+usage: python bench_gprims.py [--min N] [--max N]
+
+GPrim counts go up by factors of ten from --min to --max. Each GPrim is
+a single triangle, so the time is spent managing the GPrim table.
+"""
+
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from pyV3D import WV_Wrapper
+
+
+class Wrapper(WV_Wrapper):
+    pass
+
+
+def make_context():
+    wv = Wrapper()
+    eye = np.array([0.0, 0.0, 7.0], dtype=np.float32)
+    center = np.array([0.0, 0.0, 0.0], dtype=np.float32)
+    up = np.array([0.0, 1.0, 0.0], dtype=np.float32)
+    wv.createContext(1, 30.0, 1.0, 10.0, eye, center, up)
+    return wv
+
+
+def run(count):
+    wv = make_context()
+    points = np.array([0, 0, 0, 1, 0, 0, 0, 1, 0], dtype=np.float32)
+    tris = np.array([1, 2, 3], dtype=np.int32)
+    names = ['part_%06d_face' % i for i in range(count)]
+
+    start = time.time()
+    for name in names:
+        wv.add_triangle(points, tris, name=name)
+    t_add = time.time() - start
+
+    start = time.time()
+    for name in names:
+        wv._index_GPrim(name)
+    t_index = time.time() - start
+
+    # remove every other GPrim, send the deletions and purge them, which
+    # compacts the table
+    start = time.time()
+    for name in names[::2]:
+        wv.remove_GPrim(wv._index_GPrim(name))
+    wv.begin_sends()
+    wv.send_GPrim(wv, 0, lambda wsi, buf, ibuf: 0)
+    wv.finish_sends()
+    t_remove = time.time() - start
+
+    start = time.time()
+    for name in names[1::2]:
+        wv._index_GPrim(name)
+    t_after = time.time() - start
+
+    return t_add, t_index, t_remove, t_after
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--min', type=float, default=1e2)
+    parser.add_argument('--max', type=float, default=1e5)
+    options = parser.parse_args(argv)
+
+    print("%8s %12s %12s %12s %12s %14s" % ('gprims', 'add (s)',
+                                            'lookup (s)', 'remove (s)',
+                                            'lookup2 (s)', 'add/gprim (us)'))
+    count = int(options.min)
+    while count <= options.max:
+        t_add, t_index, t_remove, t_after = run(count)
+        print("%8d %12.4f %12.4f %12.4f %12.4f %14.1f" % (
+              count, t_add, t_index, t_remove, t_after, 1e6*t_add/count))
+        count *= 10
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Time the bounding box, focus and normalize kernels used on every send
+(get_bounding_box, get_focus and adjust_points from pyV3D) against the
+original pure Python versions.
+
+usage: python bench_kernels.py [-n REPEAT] [--min N] [--max N]
+                               [--max-legacy N]
+
+Point counts go up by factors of ten from --min to --max. The original
+versions take about a second per million points, so they are only timed
+up to --max-legacy points.
+"""
+
+import sys
+import argparse
+
+import numpy as np
+
+from pyV3D import get_bounding_box, get_focus, adjust_points
+
+from bench_stl import best_of
+
+
+def legacy_bounding_box(points):
+    x_min = x_max = points[0]
+    y_min = y_max = points[1]
+    z_min = z_max = points[2]
+
+    for index in xrange(points.shape[0]/3):
+        x = points[index*3]
+        y = points[index*3+1]
+        z = points[index*3+2]
+
+        x_min = min(x, x_min)
+        y_min = min(y, y_min)
+        z_min = min(z, z_min)
+
+        x_max = max(x, x_max)
+        y_max = max(y, y_max)
+        z_max = max(z, z_max)
+
+    return np.array([[x_max, y_max, z_max], [x_min, y_min, z_min]],
+                    dtype=np.float32)
+
+
+def legacy_adjust_points(focus, points):
+    x_center, y_center, z_center, max_coordinate = focus
+    offset = np.tile((x_center, y_center, z_center), points.shape[0]/3)
+    points = points - offset
+    points = points/max_coordinate
+
+    return points
+
+
+def random_points(rng, npts):
+    """Make float32 points a block at a time, without a float64 copy of
+    all of them."""
+    points = np.empty(3*npts, dtype=np.float32)
+    block = 3 << 20
+    for start in range(0, len(points), block):
+        chunk = points[start:start+block]
+        chunk[:] = rng.standard_normal(len(chunk))
+    return points
+
+
+def fmt(seconds):
+    return '%12.5f' % seconds if seconds is not None else '%12s' % '-'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--min', type=float, default=1e3)
+    parser.add_argument('--max', type=float, default=1e8)
+    parser.add_argument('--max-legacy', type=float, default=1e6)
+    options = parser.parse_args(argv)
+
+    print("%10s %12s %12s %12s %12s %12s %12s" % (
+          'points', 'bbox py (s)', 'bbox (s)', 'focus (s)', 'adjust py (s)',
+          'adjust (s)', 'in place (s)'))
+
+    rng = np.random.RandomState(0)
+    npts = int(options.min)
+    while npts <= options.max:
+        points = random_points(rng, npts)
+
+        t_bbox, bbox = best_of(options.repeat,
+                               lambda: get_bounding_box(points))
+        t_focus, focus = best_of(options.repeat,
+                                 lambda: get_focus(bbox.flatten()))
+        t_adjust, _ = best_of(options.repeat,
+                              lambda: adjust_points(focus, points))
+        # adjusting in place repeatedly only rescales the same array
+        t_inplace, _ = best_of(options.repeat,
+                               lambda: adjust_points(focus, points,
+                                                     inplace=True))
+
+        t_bbox_py = t_adjust_py = None
+        if npts <= options.max_legacy:
+            points = random_points(rng, npts)
+            t_bbox_py, old = best_of(options.repeat,
+                                     lambda: legacy_bounding_box(points))
+            if not np.array_equal(old, get_bounding_box(points)):
+                raise RuntimeError("bounding boxes differ for %d points" % npts)
+            t_adjust_py, old = best_of(options.repeat,
+                                       lambda: legacy_adjust_points(focus,
+                                                                    points))
+            if not np.array_equal(old, adjust_points(focus, points)):
+                raise RuntimeError("adjusted points differ for %d points" % npts)
+
+        print("%10d %s %s %s %s %s %s" % (npts, fmt(t_bbox_py), fmt(t_bbox),
+              fmt(t_focus), fmt(t_adjust_py), fmt(t_adjust), fmt(t_inplace)))
+
+        points = None
+        npts *= 10
+
+
+if __name__ == '__main__':
+    sys.exit(main())
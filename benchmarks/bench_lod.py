@@ -0,0 +1,86 @@
+"""
+Measure how soon a viewer of a large STL mesh gets something to draw, with
+and without levels of detail.
+
+usage: python bench_lod.py [--copies N] [--lod N] [--mbps MBPS] [stl_file]
+
+The mesh is the given STL file (knot.stl from pyV3D/test by default)
+repeated --copies times. The time to the first scene is from the start of
+the send until its frames are written, plus what they take over a link of
+--mbps megabits per second. With levels of detail the send is made twice,
+the second time with the levels from the LevelCache.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+from pyV3D.handler import WS_WV_Wrapper
+from pyV3D.stl import STLSender
+from pyV3D.cache import LevelCache
+
+from bench_stl import TEST_DIR
+from bench_send import StubHandler, make_mesh
+
+
+class TimingWrapper(WS_WV_Wrapper):
+    """Notes when each broadcast is made and how many bytes it has."""
+
+    def __init__(self):
+        super(TimingWrapper, self).__init__()
+        self.broadcasts = []
+
+    def broadcast(self, frames, handlers=None):
+        self.broadcasts.append((time.time(), sum(len(f) for f in frames)))
+        super(TimingWrapper, self).broadcast(frames, handlers)
+
+
+def run(fname, lod, cache):
+    wv = TimingWrapper()
+    wv.open(StubHandler())
+    sender = STLSender(wv, lod=lod, lod_cache=cache)
+    start = time.time()
+    sender.send(fname, first=True)
+    total = time.time() - start
+
+    # the first broadcast is the init frame and the first scene
+    when, nbytes = wv.broadcasts[0]
+    return when - start, nbytes, total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('file', nargs='?',
+                        default=os.path.join(TEST_DIR, 'knot.stl'))
+    parser.add_argument('--copies', type=int, default=40)
+    parser.add_argument('--lod', type=int, default=100000,
+                        help='triangles in the first level')
+    parser.add_argument('--mbps', type=float, default=100.,
+                        help='link speed for the transfer times')
+    options = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        bigname, ntri = make_mesh(options.file, options.copies, tmpdir)
+        cache = LevelCache()
+        print("%d triangles" % ntri)
+        print("%-16s %12s %16s %12s %10s" % ('mode', 'first (MB)',
+                                             'first scene (s)', '+ link (s)',
+                                             'total (s)'))
+        for mode, lod in (('full', None), ('lod', options.lod),
+                          ('lod, cached', options.lod)):
+            first_time, first_bytes, total = run(bigname, lod, cache)
+            link = 8*first_bytes/(options.mbps*1e6)
+            print("%-16s %12.2f %16.3f %12.3f %10.3f" % (
+                  mode, first_bytes/1e6, first_time, first_time + link,
+                  total))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Compare the memory a sent mesh takes with each ownership mode of the
+wrapper: copy, borrow and adopt.
+
+usage: python bench_ownership.py [--triangles N] [--edges EDGES]
+
+A welded torus of --triangles triangles is sent to a viewer, after which
+the caller drops its arrays. Reported, as multiples of the size of the
+mesh arrays, are the peak RSS during the send and what stays resident
+afterwards, without the frames kept for late joiners, and the MB
+memory_usage reports by category. Each mode runs in its own process.
+"""
+
+import gc
+import sys
+import ctypes
+import argparse
+import multiprocessing
+
+from pyV3D.handler import WS_WV_Wrapper
+from pyV3D.stl import STLSender
+
+from bench_send import StubHandler, reset_peak_rss, peak_rss_mb
+from synthetic import torus
+
+CATEGORIES = ('vertices', 'normals', 'indices', 'stripes', 'borrowed',
+              'source')
+
+
+def trim():
+    """Give freed heap memory back to the system, where glibc allows it,
+    so RSS shows what is still in use."""
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])/1024.
+
+
+def run_mode(args):
+    mode, ntri, edges = args
+    base = rss_mb()
+    points, normals, tris = torus(ntri)
+    mesh = (points.nbytes + normals.nbytes + tris.nbytes)/1e6
+    trim()
+
+    reset_peak_rss()
+    wv = WS_WV_Wrapper()
+    wv.ownership = mode
+    wv.open(StubHandler())
+    STLSender(wv)
+    wv.set_face_data(points=points, tris=tris, normals=normals,
+                     name='torus', edges=edges)
+    del points, normals, tris
+    wv.send(first=True)
+    wv.scene_frames = None
+    gc.collect()
+    trim()
+    peak = peak_rss_mb() - base
+    kept = rss_mb() - base
+
+    usage = dict((what, sum(nbytes[what] for nbytes in
+                            wv.memory_usage().values())/1e6)
+                 for what in CATEGORIES)
+    return mesh, peak, kept, usage
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--triangles', type=int, default=2000000)
+    parser.add_argument('--edges', default='all')
+    options = parser.parse_args(argv)
+
+    print("%-8s %8s %8s %8s  %s" % (
+        'mode', 'mesh MB', 'peak x', 'kept x',
+        ' '.join('%9s' % what for what in CATEGORIES)))
+    for mode in ('copy', 'borrow', 'adopt'):
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            mesh, peak, kept, usage = pool.map(
+                run_mode, [(mode, options.triangles, options.edges)])[0]
+        finally:
+            pool.close()
+            pool.join()
+        print("%-8s %8.1f %8.2f %8.2f  %s" % (
+            mode, mesh, peak/mesh, kept/mesh,
+            ' '.join('%9.1f' % usage[what] for what in CATEGORIES)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
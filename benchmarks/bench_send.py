@@ -0,0 +1,162 @@
+"""
+Send a large STL mesh through WS_WV_Wrapper to stub WebSocket
+connections and compare the current send path against the original one.
+The original path copied each encoder buffer into a string and then again
+into the WebSocket frame, and needed a wrapper of its own, loading and
+encoding the geometry again, for every viewer.
+
+usage: python bench_send.py [-n REPEAT] [--copies N] [--viewers N]
+                            [stl_file]
+
+The mesh is the given STL file (knot.stl from pyV3D/test by default)
+repeated --copies times. Each mode runs in its own process so the peak
+memory reported belongs to that mode alone.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import resource
+import multiprocessing
+
+import numpy as np
+
+from tornado.websocket import WebSocketProtocol13
+
+from pyV3D.handler import WS_WV_Wrapper, BINARY_PROTOCOL, write_binary_frame
+from pyV3D.stl import STLSender
+
+from bench_stl import (TEST_DIR, RecordingWrapper, STLGeometryObject,
+                       write_binary)
+
+
+class DiscardStream(object):
+    """An IOStream whose client reads everything instantly."""
+
+    def __init__(self):
+        self.nbytes = 0
+
+    def write(self, data):
+        self.nbytes += len(data)
+
+
+class StubHandler(object):
+
+    def __init__(self):
+        self.request = None
+        self.stream = DiscardStream()
+        self.ws_connection = WebSocketProtocol13(self)
+        self._protocol = BINARY_PROTOCOL
+
+    def write_binary(self, data):
+        return write_binary_frame(self.ws_connection, data)
+
+
+class LegacyWrapper(WS_WV_Wrapper):
+    """Sends the way pyV3D did before the callback handed out memoryviews:
+    one copy out of the encoder buffer, another to build the frame."""
+
+    def send_binary_data(self, wsi, buf, ibuf):
+        for handler in self.handlers[BINARY_PROTOCOL]:
+            handler.ws_connection.write_message(buf.tobytes(), binary=True)
+        return 0
+
+
+def make_mesh(fname, copies, tmpdir):
+    wv = RecordingWrapper()
+    STLGeometryObject(fname).get_visualization_data(wv)
+    points = np.concatenate([f['points'] for f in wv.faces])
+    normals = np.concatenate([f['normals'] for f in wv.faces])
+
+    xyz = points.reshape(-1, 3)
+    shift = 1.1*(xyz.max(axis=0) - xyz.min(axis=0))[0]
+    points = np.concatenate([(xyz + [i*shift, 0, 0]).astype(np.float32)
+                             for i in range(copies)]).reshape(-1)
+    normals = np.tile(normals, copies)
+
+    bigname = os.path.join(tmpdir, 'big.stl')
+    write_binary(bigname, points, normals)
+    return bigname, len(points)//9
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of this process where Linux allows it."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])/1024.
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+
+def run_mode(args):
+    legacy, fname, repeat, viewers = args
+
+    def send():
+        handlers = [StubHandler() for i in range(viewers)]
+        start = time.time()
+        if legacy:
+            for handler in handlers:
+                wv = LegacyWrapper()
+                wv.open(handler)
+                STLSender(wv).send(fname, first=True)
+        else:
+            wv = WS_WV_Wrapper()
+            for handler in handlers:
+                wv.open(handler)
+            STLSender(wv).send(fname, first=True)
+        return time.time() - start, sum(h.stream.nbytes for h in handlers)
+
+    send()  # warm up
+    reset_peak_rss()
+    before = peak_rss_mb()
+    best = None
+    for i in range(repeat):
+        elapsed, nbytes = send()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, nbytes, peak_rss_mb() - before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('file', nargs='?',
+                        default=os.path.join(TEST_DIR, 'knot.stl'))
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--copies', type=int, default=8)
+    parser.add_argument('--viewers', type=int, default=1)
+    options = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    fname, ntri = make_mesh(options.file, options.copies, tmpdir)
+    print("%d triangles, %d viewer(s)" % (ntri, options.viewers))
+
+    print("%-10s %12s %10s %10s %16s" % ('path', 'wire (MB)', 'send (s)',
+                                         'MB/s', 'peak RSS (MB)'))
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    for name, legacy in (('legacy', True), ('current', False)):
+        elapsed, nbytes, rss = pool.apply(run_mode,
+                                          ((legacy, fname, options.repeat,
+                                            options.viewers),))
+        mb = nbytes/1e6
+        print("%-10s %12.1f %10.4f %10.1f %16.1f" % (name, mb, elapsed,
+                                                     mb/elapsed, rss))
+    pool.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Measure what collecting pyV3D.stats costs a send, and show what they
+report for it.
+
+usage: python bench_stats.py [-n REPEAT] [--parts N] [stl_file]
+
+Two sends are timed with stats off, with stage totals only and with the
+per GPrim counts too: the given STL file (knot.stl from pyV3D/test by
+default), and an assembly of --parts tetrahedra, each a GPrim of its own,
+where the per GPrim work of the stats shows most.
+"""
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+from pyV3D.handler import WS_WV_Wrapper
+from pyV3D.sender import WV_Sender
+from pyV3D.stl import STLSender
+from pyV3D.stats import PipelineStats
+
+from bench_stl import TEST_DIR, best_of
+from bench_send import StubHandler
+
+
+class Parts(object):
+
+    def __init__(self, nparts):
+        self.nparts = nparts
+
+    def get_visualization_data(self, wv):
+        tet = np.array([0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1], dtype=np.float32)
+        tris = np.array([1, 3, 2, 1, 2, 4, 1, 4, 3, 2, 3, 4], dtype=np.int32)
+        for i in range(self.nparts):
+            wv.set_face_data(points=tet + np.float32(2*i), tris=tris,
+                             name='part_%d' % i)
+
+
+class PartsSender(WV_Sender):
+
+    def initialize(self, **kwargs):
+        eye = np.array([0.0, 0.0, 7.0], dtype=np.float32)
+        center = np.array([0.0, 0.0, 0.0], dtype=np.float32)
+        up = np.array([0.0, 1.0, 0.0], dtype=np.float32)
+        self.wv.createContext(1, 30.0, 1.0, 10.0, eye, center, up)
+
+    def geom_from_obj(self, obj):
+        obj.get_visualization_data(self.wv)
+
+
+def run(klass, obj, stats):
+    wv = WS_WV_Wrapper(stats=stats)
+    wv.open(StubHandler())
+    klass(wv).send(obj, first=True)
+    return wv
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('file', nargs='?',
+                        default=os.path.join(TEST_DIR, 'knot.stl'))
+    parser.add_argument('-n', '--repeat', type=int, default=5)
+    parser.add_argument('--parts', type=int, default=5000)
+    options = parser.parse_args(argv)
+
+    cases = [('stl', STLSender, options.file),
+             ('%d parts' % options.parts, PartsSender, Parts(options.parts))]
+    print("%-12s %10s %10s %10s" % ('send', 'off (s)', 'stages (s)',
+                                    'gprims (s)'))
+    for name, klass, obj in cases:
+        off, _ = best_of(options.repeat, lambda: run(klass, obj, None))
+        stages, _ = best_of(options.repeat, lambda: run(
+            klass, obj, PipelineStats(count_gprims=False)))
+        gprims, wv = best_of(options.repeat,
+                             lambda: run(klass, obj, PipelineStats()))
+        print("%-12s %10.4f %10.4f %10.4f" % (name, off, stages, gprims))
+    print('')
+    print(wv.stats)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
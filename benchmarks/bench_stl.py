@@ -0,0 +1,149 @@
+"""
+Compare the vectorized binary STL loader in pyV3D.stl against the original
+per-facet struct.unpack loop.
+
+usage: python bench_stl.py [-n REPEAT] [--mmap] [stl_file ...]
+
+With no files, the STL files bundled in pyV3D/test are used. ASCII files
+are converted to a temporary binary STL first so every file exercises the
+binary path.
+"""
+
+import os
+import sys
+import time
+import struct
+import tempfile
+import argparse
+
+import numpy as np
+
+from pyV3D.stl import STLGeometryObject, BINARY_FACET
+
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, 'src', 'pyV3D', 'test')
+
+
+class RecordingWrapper(object):
+    """Stands in for a WV_Wrapper and just keeps the face data."""
+
+    def __init__(self):
+        self.faces = []
+
+    def set_face_data(self, **kwargs):
+        self.faces.append(kwargs)
+
+
+def load_binary_struct(wv, stl):
+    """The original per-facet loader, kept here as the reference path."""
+    vertices = []
+    normals = []
+
+    header, ntri = struct.unpack("80sI", stl.read(84))
+    header = "".join([i for i in header if ord(i) < 128])
+
+    for i in xrange(0, ntri):
+        facet = struct.unpack("12fH", stl.read(50))
+
+        normal = [float(xyz) for xyz in facet[0:3]]
+        normals.extend(normal)
+        normals.extend(normal)
+        normals.extend(normal)
+
+        vertices.extend([float(xyz) for xyz in facet[3:12]])
+
+    wv.set_face_data(points=np.array(vertices, dtype=np.float32),
+                     tris=np.array(range(1, 3*ntri+1), dtype=np.int32),
+                     colors=None,
+                     normals=np.array(normals, dtype=np.float32),
+                     name=header)
+
+
+def is_binary(fname):
+    with open(fname, 'rb') as stl:
+        return not stl.read(80).lstrip().startswith('solid')
+
+
+def write_binary(fname, points, normals):
+    """Write a binary STL from unrolled points and per-vertex normals."""
+    ntri = len(points)//9
+    facets = np.zeros(ntri, dtype=BINARY_FACET)
+    facets['vertices'] = points.reshape(ntri, 3, 3)
+    facets['normal'] = normals.reshape(ntri, 3, 3)[:, 0, :]
+    with open(fname, 'wb') as stl:
+        stl.write(struct.pack("80sI", 'pyV3D benchmark', ntri))
+        facets.tofile(stl)
+
+
+def as_binary(fname, tmpdir):
+    if is_binary(fname):
+        return fname
+    wv = RecordingWrapper()
+    STLGeometryObject(fname).get_visualization_data(wv)
+    points = np.concatenate([f['points'] for f in wv.faces])
+    normals = np.concatenate([f['normals'] for f in wv.faces])
+    binname = os.path.join(tmpdir, os.path.basename(fname)[:-4]+'_bin.stl')
+    write_binary(binname, points, normals)
+    return binname
+
+
+def best_of(repeat, func):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def bench_file(fname, repeat, use_mmap):
+    def old():
+        wv = RecordingWrapper()
+        with open(fname, 'rb') as stl:
+            load_binary_struct(wv, stl)
+        return wv.faces[0]
+
+    def new():
+        wv = RecordingWrapper()
+        geom = STLGeometryObject(fname, use_mmap=use_mmap)
+        with open(fname, 'rb') as stl:
+            geom._load_binary(wv, stl)
+        return wv.faces[0]
+
+    t_old, f_old = best_of(repeat, old)
+    t_new, f_new = best_of(repeat, new)
+
+    for key in ('points', 'normals', 'tris'):
+        if not np.array_equal(f_old[key], f_new[key]):
+            raise RuntimeError("%s differs for %s" % (key, fname))
+
+    return len(f_new['tris'])//3, t_old, t_new
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--mmap', action='store_true',
+                        help='read binary files through mmap')
+    options = parser.parse_args(argv)
+
+    files = options.files or [os.path.join(TEST_DIR, f) for f in
+                              ('knot.stl', 'Star.stl', 'dancing_snowman.stl')]
+
+    tmpdir = tempfile.mkdtemp()
+    print("%-24s %10s %12s %12s %9s" % ('file', 'facets', 'struct (s)',
+                                         'numpy (s)', 'speedup'))
+    for fname in files:
+        ntri, t_old, t_new = bench_file(as_binary(fname, tmpdir),
+                                        options.repeat, options.mmap)
+        print("%-24s %10d %12.4f %12.4f %8.1fx" % (os.path.basename(fname),
+              ntri, t_old, t_new, t_old/max(t_new, 1e-9)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
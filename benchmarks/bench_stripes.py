@@ -0,0 +1,114 @@
+"""
+Compare how the triangles of large meshes are cut into stripes, in the
+order they are given and in Morton order.
+
+usage: python bench_stripes.py [-n REPEAT] [--sizes N,N,...] [--cache N]
+                               [--sample N]
+
+The meshes are welded tori with their triangles in the order they are made
+in, row by row, and shuffled, as in files written without regard to
+order. Reported for each are:
+
+  stripes      the number of stripes sent
+  dup          the vertices sent beyond the vertices of the mesh, as a
+               fraction of them
+  ACMR         the average cache miss ratio, vertices fetched a triangle,
+               of a FIFO vertex cache of --cache entries over the first
+               --sample triangles of every stripe
+  build (s)    add_triangle, where the stripes are made
+
+With a pyV3D older than stripe_order on the path, both orders give the cuts
+it made, after every 65535 indices.
+"""
+
+import sys
+import argparse
+from collections import deque
+
+import numpy as np
+
+from pyV3D.compact import read_frame, VERTICES, INDICES
+
+from bench_gprims import make_context
+from bench_stl import best_of
+from synthetic import torus
+
+
+class FrameSink(object):
+    """A send_GPrim callback that keeps the buffers."""
+
+    def __init__(self):
+        self.frames = []
+
+    def __call__(self, wsi, buf, ibuf):
+        self.frames.append(buf[:ibuf].tobytes())
+        return 0
+
+
+def build(points, normals, tris, order):
+    wv = make_context()
+    wv.stripe_order = order
+    wv.add_triangle(points, tris, normals=normals, name='torus')
+    return wv
+
+
+def stripes(wv):
+    """Return the (vertex count, indices) of the triangle stripes sent."""
+    sink = FrameSink()
+    wv.send_GPrim(wv, -1, sink)
+    result = []
+    for frame in sink.frames:
+        for msg, arrays in read_frame(frame):
+            if msg.opcode == 3 and msg.gtype == 2 and VERTICES in arrays:
+                result.append((len(arrays[VERTICES]), arrays[INDICES]))
+    return result
+
+
+def acmr(indices, size):
+    """Average cache miss ratio of a FIFO vertex cache of size entries."""
+    cache = deque()
+    cached = set()
+    misses = 0
+    for i in indices:
+        if i not in cached:
+            misses += 1
+            cache.append(i)
+            cached.add(i)
+            if len(cache) > size:
+                cached.discard(cache.popleft())
+    return 3.*misses/max(len(indices), 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--sizes', default='2e5,1e6,4e6',
+                        help="triangles, comma separated")
+    parser.add_argument('--cache', type=int, default=32)
+    parser.add_argument('--sample', type=int, default=20000)
+    options = parser.parse_args(argv)
+
+    print("%-10s %-9s %-7s %8s %8s %8s %10s" % (
+        'triangles', 'input', 'order', 'stripes', 'dup', 'ACMR', 'build (s)'))
+    rng = np.random.RandomState(0)
+    for size in options.sizes.split(','):
+        points, normals, tris = torus(int(float(size)))
+        nverts = len(points)//3
+        shuffled = tris.reshape(-1, 3)[rng.permutation(len(tris)//3)]
+        for name, given in (('rows', tris), ('shuffled', shuffled.ravel())):
+            for order in (None, 'morton'):
+                seconds, wv = best_of(options.repeat, lambda: build(
+                    points, normals, given, order))
+                sent = stripes(wv)
+                dup = float(sum(n for n, idx in sent))/nverts - 1
+                ratio = np.mean([acmr(idx[:3*options.sample], options.cache)
+                                 for n, idx in sent])
+                print("%-10d %-9s %-7s %8d %8.3f %8.3f %10.3f" % (
+                    len(tris)//3, name, order or 'given', len(sent), dup,
+                    ratio, seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
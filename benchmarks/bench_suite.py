@@ -0,0 +1,332 @@
+"""
+Time every hot path of pyV3D on synthetic meshes of growing size, and
+compare the results with those of another version.
+
+usage: python bench_suite.py [-n REPEAT] [--sizes N,N,...] [--cases C,C,...]
+                             [--save FILE] [--compare FILE]
+                             [--threshold FRACTION]
+
+The cases, each sized by its number of triangles:
+
+  stl_binary       load a binary STL file of a sphere, as STLSender does
+  stl_ascii        the same from an ASCII STL file
+  set_face_data    set_face_data for an assembly of 200 triangle parts
+  prepare          prepare_for_sends of a torus: edges, stripes and all
+  stripes          add_triangle of a torus with a known focus, mostly
+                   wv_makeStripes. Tori of up to 130000 triangles fit in
+                   one stripe, larger ones are cut at 65535 vertices.
+  send             send_GPrim of a prepared torus into a null sink
+  assembly         set_face_data, prepare_for_sends and send_GPrim of an
+                   assembly of 200 triangle parts
+
+Each case and size runs in its own process so the peak memory reported
+belongs to it alone. Peak RSS is how far it rose above the RSS after the
+input was made, allocations are the peak bytes traced by tracemalloc where
+the Python has it. Sizes up to 1e8 work given the memory, about 100 bytes
+a triangle for the STL cases.
+
+--save writes the results as JSON, --compare reads such a file and marks
+the cases that got slower, or took more memory, by more than --threshold
+and more than a millisecond or a MB. The exit status is 1 if any did.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from pyV3D.stl import STLGeometryObject
+
+from bench_stl import RecordingWrapper
+from bench_gprims import make_context
+from bench_send import reset_peak_rss, peak_rss_mb
+from synthetic import (sphere, torus, assembly, write_binary_stl,
+                       write_ascii_stl)
+
+PART_TRIANGLES = 200
+DEFAULT_SIZES = '1e3,1e5,1e6'
+
+
+class NullSink(object):
+    """A send_GPrim callback that drops the buffers."""
+
+    def __init__(self):
+        self.nbytes = 0
+
+    def __call__(self, wsi, buf, ibuf):
+        self.nbytes += ibuf
+        return 0
+
+
+# Each case makes its input for a size and returns (reset, run, info):
+# reset is called before every run, outside of the timing, and info has
+# what run handles, triangles, vertices and bytes.
+
+def case_stl(ntri, tmpdir, writer):
+    points, normals, tris = sphere(ntri)
+    fname = os.path.join(tmpdir, 'sphere.stl')
+    writer(fname, points, normals, tris)
+
+    def run():
+        STLGeometryObject(fname).get_visualization_data(RecordingWrapper())
+
+    return None, run, {'triangles': len(tris)//3,
+                       'bytes': os.path.getsize(fname)}
+
+
+def case_stl_binary(ntri, tmpdir):
+    return case_stl(ntri, tmpdir, write_binary_stl)
+
+
+def case_stl_ascii(ntri, tmpdir):
+    return case_stl(ntri, tmpdir, write_ascii_stl)
+
+
+def case_set_face_data(ntri, tmpdir):
+    parts = assembly(max(1, ntri//PART_TRIANGLES), PART_TRIANGLES)
+    wv = make_context()
+
+    def reset():
+        wv.clear()
+
+    def run():
+        for name, points, normals, tris in parts:
+            wv.set_face_data(points, tris, normals=normals, name=name)
+
+    return reset, run, _info(parts)
+
+
+def case_prepare(ntri, tmpdir):
+    points, normals, tris = torus(ntri)
+    wv = make_context()
+
+    def reset():
+        wv.clear()
+        wv.set_face_data(points, tris, normals=normals, name='torus')
+
+    def run():
+        wv.prepare_for_sends()
+        wv.finish_sends()
+
+    return reset, run, _info([('torus', points, normals, tris)])
+
+
+def case_stripes(ntri, tmpdir):
+    points, normals, tris = torus(ntri)
+    wv = make_context()
+    focus = np.array([0.0, 0.0, 0.0, 1.3], dtype=np.float32)
+
+    def reset():
+        wv.clear()
+
+    def run():
+        wv.add_triangle(points, tris, normals=normals, name='torus',
+                        focus=focus)
+
+    return reset, run, _info([('torus', points, normals, tris)])
+
+
+def case_send(ntri, tmpdir):
+    points, normals, tris = torus(ntri)
+    wv = make_context()
+    wv.set_face_data(points, tris, normals=normals, name='torus')
+    wv.prepare_for_sends()
+    wv.finish_sends()
+    info = _info([('torus', points, normals, tris)])
+
+    def run():
+        sink = NullSink()
+        wv.begin_sends()
+        wv.send_GPrim(wv, -1, sink)
+        wv.finish_sends()
+        info['bytes'] = sink.nbytes
+
+    return None, run, info
+
+
+def case_assembly(ntri, tmpdir):
+    parts = assembly(max(1, ntri//PART_TRIANGLES), PART_TRIANGLES)
+    info = _info(parts)
+
+    def run():
+        wv = make_context()
+        for name, points, normals, tris in parts:
+            wv.set_face_data(points, tris, normals=normals, name=name)
+        wv.prepare_for_sends()
+        sink = NullSink()
+        wv.send_GPrim(wv, -1, sink)
+        wv.finish_sends()
+        info['bytes'] = sink.nbytes
+
+    return None, run, info
+
+
+CASES = OrderedDict([
+    ('stl_binary', case_stl_binary),
+    ('stl_ascii', case_stl_ascii),
+    ('set_face_data', case_set_face_data),
+    ('prepare', case_prepare),
+    ('stripes', case_stripes),
+    ('send', case_send),
+    ('assembly', case_assembly),
+])
+
+
+def _info(parts):
+    return {'triangles': sum(len(p[3]) for p in parts)//3,
+            'vertices': sum(len(p[1]) for p in parts)//3,
+            'parts': len(parts)}
+
+
+def run_case(args):
+    name, size, repeat = args
+    tmpdir = tempfile.mkdtemp()
+    try:
+        reset, run, info = CASES[name](size, tmpdir)
+        reset = reset or (lambda: None)
+
+        reset_peak_rss()
+        before = peak_rss_mb()
+        best = None
+        for i in range(repeat):
+            reset()
+            start = time.time()
+            run()
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        peak = peak_rss_mb() - before
+
+        alloc = None
+        if tracemalloc is not None:
+            reset()
+            tracemalloc.start()
+            run()
+            alloc = tracemalloc.get_traced_memory()[1]/1e6
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    result = OrderedDict([('case', name), ('size', size), ('seconds', best),
+                          ('peak_rss_mb', peak), ('alloc_mb', alloc)])
+    result.update(sorted(info.items()))
+    return result
+
+
+def run_isolated(name, size, repeat):
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        return pool.map(run_case, [(name, size, repeat)])[0]
+    finally:
+        pool.close()
+        pool.join()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print how results compare to baseline and return the number of
+    regressions."""
+    old = dict(((r['case'], r['size']), r) for r in baseline['results'])
+    print("\ncompared with %s:" % (baseline['meta'].get('revision') or
+                                   'the baseline'))
+    print("%-14s %10s %8s %8s" % ('case', 'size', 'time', 'rss'))
+    regressions = 0
+    for r in results:
+        base = old.get((r['case'], r['size']))
+        if base is None:
+            continue
+        # a millisecond or a MB either way are noise
+        time_ratio = (max(r['seconds'], 1e-3) /
+                      max(base['seconds'], 1e-3))
+        rss_ratio = (max(r['peak_rss_mb'], 1.0) /
+                     max(base['peak_rss_mb'], 1.0))
+        worse = [what for what, ratio in (('time', time_ratio),
+                                          ('rss', rss_ratio))
+                 if ratio > 1 + threshold]
+        regressions += bool(worse)
+        print("%-14s %10d %7.2fx %7.2fx %s" % (
+            r['case'], r['size'], time_ratio, rss_ratio,
+            'REGRESSION (%s)' % ', '.join(worse) if worse else ''))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help="triangles, comma separated")
+    parser.add_argument('--cases', default=','.join(CASES),
+                        help="comma separated, of: %s" % ', '.join(CASES))
+    parser.add_argument('--save', metavar='FILE')
+    parser.add_argument('--compare', metavar='FILE')
+    parser.add_argument('--threshold', type=float, default=0.20)
+    options = parser.parse_args(argv)
+
+    sizes = [int(float(s)) for s in options.sizes.split(',')]
+    names = options.cases.split(',')
+    for name in names:
+        if name not in CASES:
+            parser.error("unknown case %r" % name)
+
+    print("%-14s %10s %10s %10s %10s %10s %10s" % (
+        'case', 'size', 'time (s)', 'Mtri/s', 'MB/s', 'rss (MB)',
+        'alloc (MB)'))
+    results = []
+    for name in names:
+        for size in sizes:
+            r = run_isolated(name, size, options.repeat)
+            results.append(r)
+            seconds = max(r['seconds'], 1e-9)
+            mbs = r.get('bytes')
+            print("%-14s %10d %10.4f %10.2f %10s %10.1f %10s" % (
+                name, size, r['seconds'], r['triangles']/seconds/1e6,
+                '%.1f' % (mbs/seconds/1e6) if mbs else '-',
+                r['peak_rss_mb'],
+                '-' if r['alloc_mb'] is None else '%.1f' % r['alloc_mb']))
+
+    meta = OrderedDict([
+        ('revision', git_revision()),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('machine', platform.machine()),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('repeat', options.repeat),
+    ])
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Measure how long adding a GPrim takes while another thread keeps sending
+the context, as when an optimizer pushes geometry while the server sends.
+
+usage: python bench_threads.py [-n COUNT] [--senders N] [--size N]
+
+One thread adds COUNT single triangle GPrims one at a time, while --senders
+threads send the context over and over. The context holds --size GPrims
+to begin with, so every send takes a while.
+"""
+
+import sys
+import time
+import argparse
+import threading
+
+import numpy as np
+
+from bench_gprims import make_context
+
+
+def run(count, senders, size):
+    wv = make_context()
+    points = np.array([0, 0, 0, 1, 0, 0, 0, 1, 0], dtype=np.float32)
+    tris = np.array([1, 2, 3], dtype=np.int32)
+    for i in range(size):
+        wv.add_triangle(points, tris, name='base_%d' % i)
+
+    done = threading.Event()
+    sends = [0]
+
+    def send():
+        while not done.is_set():
+            wv.begin_sends()
+            try:
+                wv.send_GPrim(wv, -1, lambda wsi, buf, ibuf: 0)
+            finally:
+                wv.finish_sends()
+            sends[0] += 1
+
+    threads = [threading.Thread(target=send) for i in range(senders)]
+    for thread in threads:
+        thread.start()
+
+    latencies = []
+    start = time.time()
+    for i in range(count):
+        t0 = time.time()
+        wv.add_triangle(points, tris, name='added_%d' % i)
+        latencies.append(time.time() - t0)
+    elapsed = time.time() - start
+
+    done.set()
+    for thread in threads:
+        thread.join()
+    return elapsed, np.array(latencies), sends[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-n', '--count', type=int, default=2000)
+    parser.add_argument('--senders', type=int, default=1)
+    parser.add_argument('--size', type=int, default=1000)
+    options = parser.parse_args(argv)
+
+    elapsed, latencies, sends = run(options.count, options.senders,
+                                    options.size)
+    ms = latencies*1000.
+    print("%d adds in %.3f s while %d sends were made" % (
+          options.count, elapsed, sends))
+    print("add latency (ms): median %.3f, 99%% %.3f, max %.3f" % (
+          np.median(ms), np.percentile(ms, 99), ms.max()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
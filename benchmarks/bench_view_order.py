@@ -0,0 +1,133 @@
+"""
+Measure how much sooner a viewer gets the parts in its view when GPrims are
+sent in view order, see pyV3D.spatial, and what ordering them costs.
+
+usage: python bench_view_order.py [-n REPEAT] [--parts N] [--triangles N]
+
+An assembly of --parts tori of --triangles triangles each, on a grid, is
+sent to a viewer looking closely at a corner of it, once in the order of
+the GPrim table and once in view order. Reported for each are the seconds
+from the end of loading the parts, and the MB, until the last GPrim in
+view was written, and until everything was. Then the seconds to build the
+BVH of the boxes of the parts, to test them against the view frustum with
+it and one by one, and for all of view_order.
+"""
+
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from pyV3D.handler import WS_WV_Wrapper
+from pyV3D.sender import WV_Sender
+from pyV3D.compact import read_frame
+from pyV3D.spatial import BVH, Camera, view_order, _classify
+
+from bench_stl import best_of
+from bench_send import StubHandler
+from synthetic import assembly
+
+CAMERA = {'eye': [-0.8, -0.8, 1.5], 'center': [-0.8, -0.8, 0.0],
+          'up': [0.0, 1.0, 0.0], 'near': 0.01, 'far': 10.0}
+
+
+class RecordingHandler(StubHandler):
+    """Keeps the time and the bytes written so far with each frame."""
+
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.frames = []
+        self.nbytes = 0
+
+    def write_binary(self, data):
+        self.nbytes += len(data)
+        self.frames.append((time.time(), self.nbytes, bytes(data)))
+        return super(RecordingHandler, self).write_binary(data)
+
+
+class PartsSender(WV_Sender):
+
+    def initialize(self, **kwargs):
+        eye = np.array([0.0, 0.0, 7.0], dtype=np.float32)
+        center = np.array([0.0, 0.0, 0.0], dtype=np.float32)
+        up = np.array([0.0, 1.0, 0.0], dtype=np.float32)
+        self.wv.createContext(1, 30.0, 1.0, 10.0, eye, center, up)
+
+    def geom_from_obj(self, parts):
+        for name, points, normals, tris in parts:
+            self.wv.set_face_data(points=points, tris=tris, normals=normals,
+                                  name=name)
+        self.loaded = time.time()
+
+
+def run(parts, order):
+    wv = WS_WV_Wrapper()
+    wv.send_order = order
+    wv.camera = Camera(**CAMERA)
+    handler = RecordingHandler()
+    wv.open(handler)
+    sender = PartsSender(wv)
+    sender.send(parts, first=True)
+    return sender.loaded, handler.frames, wv
+
+
+def until(start, frames, names):
+    """Return the seconds and bytes until all of names were written."""
+    names = set(names)
+    for t, nbytes, frame in frames:
+        for msg, arrays in read_frame(frame):
+            names.discard(msg.name.split(b'\0', 1)[0])
+        if not names:
+            return t - start, nbytes
+    raise RuntimeError("not all GPrims were sent")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--parts', type=int, default=10000)
+    parser.add_argument('--triangles', type=int, default=200)
+    options = parser.parse_args(argv)
+
+    parts = assembly(options.parts, options.triangles)
+    camera = Camera(**CAMERA)
+
+    start, frames, wv = run(parts, None)
+    wv.begin_sends()
+    try:
+        boxes, deleted = wv.gprim_boxes()
+    finally:
+        wv.finish_sends()
+    first, deferred = view_order(boxes, camera)
+    visible = [parts[i][0].encode() for i in first]
+    print("%d of %d parts in view" % (len(first), len(parts)))
+
+    print("%-8s %12s %12s %12s %12s" % ('order', 'view (s)', 'view (MB)',
+                                        'all (s)', 'all (MB)'))
+    for name, order in (('table', None), ('view', 'view')):
+        results = []
+        for i in range(options.repeat):
+            start, frames, wv = run(parts, order)
+            results.append(until(start, frames, visible) +
+                           (frames[-1][0] - start, frames[-1][1]))
+        t_view, b_view, t_all, b_all = min(results)
+        print("%-8s %12.3f %12.1f %12.3f %12.1f" % (
+            name, t_view, b_view/1e6, t_all, b_all/1e6))
+
+    planes = camera.planes()
+    t_build, bvh = best_of(options.repeat, lambda: BVH(boxes))
+    t_bvh, inside = best_of(options.repeat, lambda: bvh.frustum(planes))
+    t_brute, (out, full) = best_of(options.repeat, lambda: _classify(
+        boxes[:, :3], boxes[:, 3:], planes))
+    if not np.array_equal(inside, ~out):
+        raise RuntimeError("BVH and brute force disagree")
+    t_order, _ = best_of(options.repeat, lambda: view_order(boxes, camera))
+    print('')
+    print("BVH build %.4f s, frustum %.4f s (one by one %.4f s), "
+          "view_order %.4f s" % (t_build, t_bvh, t_brute, t_order))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Measure what welding STL vertices buys: vertex counts before and after,
+the size of the face data handed to set_face_data, and the load time.
+
+usage: python bench_weld.py [-n REPEAT] [--tolerance TOL] [--angle DEG]
+                            [stl_file ...]
+
+With no files, the STL files bundled in pyV3D/test are used.
+"""
+
+import os
+import sys
+import argparse
+
+from pyV3D.stl import STLGeometryObject
+
+from bench_stl import TEST_DIR, RecordingWrapper, best_of
+
+
+def load(fname, weld, tolerance, angle):
+    wv = RecordingWrapper()
+    geom = STLGeometryObject(fname, weld=weld, tolerance=tolerance)
+    geom.get_visualization_data(wv, angle=angle)
+    return wv.faces
+
+
+def payload(faces):
+    """Return (vertices, bytes) for a list of set_face_data arguments."""
+    nverts = sum(len(f['points'])//3 for f in faces)
+    nbytes = sum(f[key].nbytes for f in faces
+                 for key in ('points', 'normals', 'tris'))
+    return nverts, nbytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.0)
+    parser.add_argument('--angle', type=float, default=15.,
+                        help='crease angle in degrees, negative for smooth')
+    options = parser.parse_args(argv)
+
+    files = options.files or [os.path.join(TEST_DIR, f) for f in
+                              ('knot.stl', 'Star.stl', 'dancing_snowman.stl')]
+    angle = options.angle if options.angle >= 0 else None
+
+    print("%-24s %10s %10s %8s %12s %12s" % ('file', 'verts', 'welded',
+                                             'ratio', 'soup (s)',
+                                             'weld (s)'))
+    for fname in files:
+        t_soup, soup = best_of(options.repeat,
+                               lambda: load(fname, False, 0.0, angle))
+        t_weld, welded = best_of(options.repeat,
+                                 lambda: load(fname, True, options.tolerance,
+                                              angle))
+        nsoup, bsoup = payload(soup)
+        nweld, bweld = payload(welded)
+        print("%-24s %10d %10d %7.2fx %12.4f %12.4f" % (
+              os.path.basename(fname), nsoup, nweld,
+              float(bsoup)/max(bweld, 1), t_soup, t_weld))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
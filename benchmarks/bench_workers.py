@@ -0,0 +1,200 @@
+"""
+Measure how the number of viewers wvserver serves per second scales with
+its number of worker processes.
+
+usage: python bench_workers.py [--workers 1,2,4] [--clients N]
+                               [--concurrency N] [--seconds S] [--models N]
+                               [--copies N] [--compact] [stl_file]
+
+--models copies of a model of --copies copies of the given STL file
+(knot.stl from pyV3D/test by default) are served by `wvserver serve
+--workers N` for each N of --workers, with a scene cache directory of its
+own. Once each model was opened, so its scene is in the cache, --clients
+processes open viewers of random models for --seconds, --concurrency at a
+time each, read the whole scene and close them again. Each viewer that
+comes after the last one of a session is closed starts a new session, so
+the server does for it all that is done per session, from creating its
+sender to writing the frames, rewriting them for --compact viewers.
+Reported are the viewers served per second and the MB they were sent.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import signal
+import socket
+import tempfile
+import argparse
+import subprocess
+import multiprocessing
+
+from tornado import gen, websocket
+from tornado.httpclient import HTTPRequest
+from tornado.ioloop import IOLoop
+
+from pyV3D.handler import BINARY_PROTOCOL
+from pyV3D.compact import COMPACT_PROTOCOL
+
+from bench_stl import TEST_DIR
+from bench_send import make_mesh
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_server(view_dir, cache_dir, workers, port):
+    """Start wvserver serve in a process group of its own and wait until
+    it accepts connections."""
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'pyV3D.wvserver', '--log-level', 'warning',
+         'serve', view_dir, '--address', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--cache-dir', cache_dir],
+        preexec_fn=os.setsid)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return server
+        except socket.error:
+            time.sleep(0.1)
+    stop_server(server)
+    raise RuntimeError("wvserver did not start")
+
+
+def stop_server(server):
+    os.killpg(server.pid, signal.SIGTERM)
+    server.wait()
+
+
+@gen.coroutine
+def view(port, model, protocol, nframes=None):
+    """Open a viewer of model and return the frames and bytes it got: the
+    first nframes, or all until none came for a second.
+    """
+    request = HTTPRequest('ws://127.0.0.1:%d/ws?fname=%s' % (port, model),
+                          headers={'Sec-WebSocket-Protocol': protocol})
+    conn = yield websocket.websocket_connect(request)
+    count = nbytes = 0
+    try:
+        while nframes is None or count < nframes:
+            message = conn.read_message()
+            if nframes is None:
+                try:
+                    message = yield gen.with_timeout(
+                        IOLoop.current().time() + 1, message)
+                except gen.TimeoutError:
+                    break
+            else:
+                message = yield message
+            if message is None:
+                raise RuntimeError("viewer of %s was closed" % model)
+            count += 1
+            nbytes += len(message)
+    finally:
+        conn.close()
+    raise gen.Return((count, nbytes))
+
+
+def client(args):
+    """Open viewers until the deadline, return how many and their bytes."""
+    port, frames, protocol, concurrency, deadline = args
+    models = sorted(frames)
+    totals = [0, 0]
+
+    @gen.coroutine
+    def viewers():
+        while time.time() < deadline:
+            model = random.choice(models)
+            count, nbytes = yield view(port, model, protocol, frames[model])
+            totals[0] += 1
+            totals[1] += nbytes
+
+    @gen.coroutine
+    def run():
+        yield [viewers() for i in range(concurrency)]
+
+    # a loop of its own, the one of the parent can't be shared
+    loop = IOLoop()
+    loop.make_current()
+    loop.run_sync(run)
+    loop.close()
+    return totals
+
+
+def measure(view_dir, models, workers, options):
+    protocol = COMPACT_PROTOCOL if options.compact else BINARY_PROTOCOL
+    cache_dir = tempfile.mkdtemp()
+    port = free_port()
+    server = start_server(view_dir, cache_dir, workers, port)
+    try:
+        # the first viewers fill the cache, the next ones get what all
+        # later viewers get
+        frames = {}
+        loop = IOLoop.current()
+        for model in models:
+            loop.run_sync(lambda: view(port, model, protocol))
+            frames[model] = loop.run_sync(
+                lambda: view(port, model, protocol))[0]
+
+        pool = multiprocessing.Pool(options.clients)
+        try:
+            start = time.time()
+            args = (port, frames, protocol, options.concurrency,
+                    start + options.seconds)
+            results = pool.map(client, [args]*options.clients)
+            elapsed = time.time() - start
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        stop_server(server)
+        shutil.rmtree(cache_dir)
+
+    viewers = sum(r[0] for r in results)
+    nbytes = sum(r[1] for r in results)
+    return viewers/elapsed, nbytes/elapsed/1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('file', nargs='?',
+                        default=os.path.join(TEST_DIR, 'knot.stl'))
+    parser.add_argument('--workers', default='1,2,4',
+                        help="comma separated worker counts")
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10.)
+    parser.add_argument('--models', type=int, default=4)
+    parser.add_argument('--copies', type=int, default=4)
+    parser.add_argument('--compact', action='store_true',
+                        help="open viewers of the compact protocol")
+    options = parser.parse_args(argv)
+
+    view_dir = tempfile.mkdtemp()
+    try:
+        fname, ntri = make_mesh(options.file, options.copies, view_dir)
+        models = []
+        for i in range(options.models):
+            models.append('model%d.stl' % i)
+            shutil.copy(fname, os.path.join(view_dir, models[-1]))
+
+        print("%d models of %d triangles, %d CPUs" % (
+            len(models), ntri, multiprocessing.cpu_count()))
+        print("%-8s %12s %12s" % ('workers', 'viewers/s', 'MB/s'))
+        for workers in [int(n) for n in options.workers.split(',')]:
+            rate, mb = measure(view_dir, models, workers, options)
+            print("%-8d %12.1f %12.1f" % (workers, rate, mb))
+    finally:
+        shutil.rmtree(view_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
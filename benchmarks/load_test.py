@@ -0,0 +1,129 @@
+"""
+Measure how long viewers of a small cube model wait for their first frame
+while a large STL model is being loaded and encoded for another viewer.
+
+usage: python load_test.py [--copies N] [--cubes N] [--concurrency N]
+                           [--inline] [stl_file]
+
+The server runs in a process of its own. One client opens the large model,
+then --cubes clients open cube models, --concurrency of them at a time,
+each one a different cube so every one of them is encoded. With --inline
+the server loads and encodes on its IOLoop, the way pyV3D used to, instead
+of on WSHandler.executor.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from concurrent.futures import Future
+from tornado import gen, web, websocket
+from tornado.httpclient import HTTPRequest
+from tornado.ioloop import IOLoop
+
+from pyV3D.handler import WSHandler, BINARY_PROTOCOL
+from pyV3D.cube import CubeSender
+from pyV3D.stl import STLSender
+
+from bench_stl import TEST_DIR
+from bench_send import make_mesh
+
+
+class InlineExecutor(object):
+    """Runs everything right away on the calling thread, i.e. the IOLoop."""
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+
+def serve(view_dir, inline, ready):
+    if inline:
+        WSHandler.executor = InlineExecutor()
+    WSHandler.protocols = {BINARY_PROTOCOL: [STLSender, CubeSender]}
+    app = web.Application([(r'/ws', WSHandler, dict(view_dir=view_dir))])
+    server = app.listen(0, '127.0.0.1')
+    port = list(server._sockets.values())[0].getsockname()[1]
+    ready.put(port)
+    IOLoop.current().start()
+
+
+@gen.coroutine
+def first_frame(port, query):
+    """Open a viewer and return the seconds until its first frame."""
+    request = HTTPRequest('ws://127.0.0.1:%d/ws?%s' % (port, query),
+                          headers={'Sec-WebSocket-Protocol': BINARY_PROTOCOL})
+    start = time.time()
+    conn = yield websocket.websocket_connect(request)
+    yield conn.read_message()
+    elapsed = time.time() - start
+    conn.close()
+    raise gen.Return(elapsed)
+
+
+@gen.coroutine
+def run(port, fname, cubes, concurrency):
+    big = first_frame(port, 'fname=%s' % fname)
+    yield gen.sleep(0.05)  # let the large model start loading
+
+    latencies = []
+    for start in range(0, cubes, concurrency):
+        batch = [first_frame(port, 'obj=cube%d' % i)
+                 for i in range(start, min(start+concurrency, cubes))]
+        latencies.extend((yield batch))
+    big_latency = yield big
+    raise gen.Return((big_latency, latencies))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('file', nargs='?',
+                        default=os.path.join(TEST_DIR, 'knot.stl'))
+    parser.add_argument('--copies', type=int, default=16)
+    parser.add_argument('--cubes', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--inline', action='store_true',
+                        help='load and encode on the IOLoop')
+    options = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fname, ntri = make_mesh(options.file, options.copies, tmpdir)
+
+        ready = multiprocessing.Queue()
+        server = multiprocessing.Process(target=serve,
+                                         args=(tmpdir, options.inline, ready))
+        server.start()
+        try:
+            port = ready.get(timeout=30)
+            big, latencies = IOLoop.current().run_sync(
+                lambda: run(port, os.path.basename(fname), options.cubes,
+                            options.concurrency))
+        finally:
+            server.terminate()
+            server.join()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    ms = np.array(latencies)*1000.
+    print("%d triangle model loaded in %.3f s (%s)" % (
+          ntri, big, 'inline' if options.inline else 'executor'))
+    print("%d cube viewers, first frame (ms): p50 %.1f  p90 %.1f  p99 %.1f"
+          "  max %.1f" % (len(ms), np.percentile(ms, 50),
+                          np.percentile(ms, 90), np.percentile(ms, 99),
+                          ms.max()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
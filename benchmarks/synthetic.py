@@ -0,0 +1,108 @@
+"""
+Synthetic meshes of any size for the benchmarks: tessellated spheres and
+tori, assemblies of many small parts, and writers of binary and ASCII STL
+files of them.
+
+Meshes are (points, normals, tris) like set_face_data takes them: flat
+float32 points and normals, one normal per point, and int32 tris counting
+from 1.
+"""
+
+import numpy as np
+
+from bench_stl import write_binary
+
+
+def sphere(ntri, radius=1.0):
+    """A latitude-longitude sphere of about ntri triangles."""
+    nv = max(2, int(round(np.sqrt(ntri/4.))))   # bands of latitude
+    nu = 2*nv                                   # meridians
+    theta = np.pi*np.arange(1, nv)/nv
+    phi = 2*np.pi*np.arange(nu)/nu
+    t, p = np.meshgrid(theta, phi, indexing='ij')
+    rings = np.column_stack([(np.sin(t)*np.cos(p)).ravel(),
+                             (np.sin(t)*np.sin(p)).ravel(),
+                             np.cos(t).ravel()])
+    unit = np.vstack([[0, 0, 1], rings, [0, 0, -1]])
+
+    # vertex 0 is the north pole, then the rings, then the south pole
+    k = np.arange(nu)
+    k1 = (k + 1) % nu
+    south = len(unit) - 1
+    tris = [np.column_stack([np.zeros(nu, int), 1 + k, 1 + k1])]
+    for r in range(nv - 2):
+        a, b = 1 + r*nu + k, 1 + r*nu + k1
+        c, d = a + nu, b + nu
+        tris.append(np.column_stack([a, c, d]))
+        tris.append(np.column_stack([a, d, b]))
+    last = 1 + (nv - 2)*nu
+    tris.append(np.column_stack([last + k, np.full(nu, south), last + k1]))
+
+    return _mesh(radius*unit, unit, np.vstack(tris))
+
+
+def torus(ntri, major=1.0, minor=0.3):
+    """A torus of about ntri triangles, with half as many vertices."""
+    nv = max(3, int(round(np.sqrt(ntri/8.))))   # around the tube
+    nu = 4*nv                                   # around the axis
+    u = 2*np.pi*np.arange(nu)/nu
+    v = 2*np.pi*np.arange(nv)/nv
+    uu, vv = np.meshgrid(u, v, indexing='ij')
+    normals = np.column_stack([(np.cos(uu)*np.cos(vv)).ravel(),
+                               (np.sin(uu)*np.cos(vv)).ravel(),
+                               np.sin(vv).ravel()])
+    center = np.column_stack([np.cos(uu).ravel(), np.sin(uu).ravel(),
+                              np.zeros(nu*nv)])
+    points = major*center + minor*normals
+
+    i, j = np.meshgrid(np.arange(nu), np.arange(nv), indexing='ij')
+    a = (i*nv + j).ravel()
+    b = (i*nv + (j + 1) % nv).ravel()
+    c = (((i + 1) % nu)*nv + j).ravel()
+    d = (((i + 1) % nu)*nv + (j + 1) % nv).ravel()
+    tris = np.vstack([np.column_stack([a, c, d]), np.column_stack([a, d, b])])
+    return _mesh(points, normals, tris)
+
+
+def assembly(nparts, part_tris=200):
+    """Return nparts small tori on a grid, as a list of (name, points,
+    normals, tris).
+    """
+    points, normals, tris = torus(part_tris, 0.4, 0.1)
+    side = int(np.ceil(nparts**(1/3.)))
+    parts = []
+    for n in range(nparts):
+        offset = np.array([n % side, (n//side) % side, n//(side*side)],
+                          dtype=np.float32)
+        parts.append(('part_%06d' % n,
+                      (points.reshape(-1, 3) + offset).reshape(-1),
+                      normals, tris))
+    return parts
+
+
+def unroll(points, normals, tris):
+    """Return the points and normals of every corner, as read from STL."""
+    corners = tris - 1
+    return (points.reshape(-1, 3)[corners].reshape(-1),
+            normals.reshape(-1, 3)[corners].reshape(-1))
+
+
+def write_binary_stl(fname, points, normals, tris):
+    write_binary(fname, *unroll(points, normals, tris))
+
+
+def write_ascii_stl(fname, points, normals, tris, name='synthetic'):
+    xyz = points.reshape(-1, 3)[tris.reshape(-1, 3) - 1]
+    # one facet normal, from the corner normals
+    normal = normals.reshape(-1, 3)[tris.reshape(-1, 3) - 1].mean(axis=1)
+    rows = np.hstack([normal, xyz.reshape(-1, 9)])
+    facet = ('facet normal %e %e %e\n outer loop\n' +
+             '  vertex %e %e %e\n'*3 + ' endloop\nendfacet')
+    np.savetxt(fname, rows, fmt=facet, header='solid %s' % name,
+               footer='endsolid %s' % name, comments='')
+
+
+def _mesh(points, normals, tris):
+    return (np.ascontiguousarray(points, dtype=np.float32).reshape(-1),
+            np.ascontiguousarray(normals, dtype=np.float32).reshape(-1),
+            (np.ascontiguousarray(tris).reshape(-1) + 1).astype(np.int32))
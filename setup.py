@@ -46,7 +46,9 @@ if sys.argv[1] == "develop":
     srcs[0] = "{}{}".format(srcs[0][:-2], ".pyx")
     
 config = Configuration(name="pyV3D")
-config.add_extension("_pyV3D", sources=srcs)
+# wv.c synchronizes threads with pthreads, or Windows primitives
+libraries = [] if sys.platform == 'win32' else ['pthread']
+config.add_extension("_pyV3D", sources=srcs, libraries=libraries)
 kwds.update(config.todict())
 
 if USE_CYTHON:
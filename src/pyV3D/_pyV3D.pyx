@@ -18,12 +18,19 @@
 #     http://www.cython.org/release/Cython-0.12/Cython/Includes/python.pxd
 
 from libc.stdio cimport printf, fprintf, fopen, fclose, FILE
+from libc.stdlib cimport malloc, free
 from cpython cimport PyBytes_AsString
+from cpython.buffer cimport PyBuffer_FillInfo
 
 cimport numpy as np
 import numpy as np
 import struct
 import os
+import threading
+
+from pyV3D.mesh import triangle_edges, batch_triangle_edges, morton_order
+from pyV3D.lod import level_name
+from pyV3D.stats import timed
 
 # Attributes.
 WV_ON          =  1
@@ -43,6 +50,7 @@ WV_LINDICES =  32
 WV_PCOLOR   =  64
 WV_LCOLOR   = 128
 WV_BCOLOR   = 256
+WV_DELETE   = 512
 
 # GPTypes.
 WV_POINT    = 0
@@ -77,6 +85,7 @@ cdef extern from "wv.h":
     ctypedef struct wvGPrim:
         int            gtype
         int            updateFlg
+        int            borrowed
         int            nStripe
         int            attrs
         int            nVerts
@@ -91,6 +100,7 @@ cdef extern from "wv.h":
         float          fColor[3]
         float          bColor[3]
         float          normal[3]
+        float          box[6]
         char           *name
         float          *vertices
         float          *normals
@@ -114,6 +124,8 @@ cdef extern from "wv.h":
         int     mGPrim
         int     cleanAll
         wvGPrim *gPrims
+        int     mHash
+        int     *nameHash
         
     ctypedef struct wvData:
         int    dataType
@@ -126,28 +138,52 @@ cdef extern from "wv.h":
                                 float *center, float *up)
 
     int wv_setData(int type, int len, void *data, 
-                   int VBOtype, wvData *dstruct)
+                   int VBOtype, wvData *dstruct) nogil
+
+    int wv_borrowData(int len, void *data, int VBOtype, wvData *dstruct) nogil
                    
     int wv_addGPrim(wvContext *cntxt, char *name, int gtype, int attrs, 
-                    int nItems, wvData *items)
+                    int nItems, wvData *items) nogil
                     
     void wv_printGPrim(wvContext *cntxt, int index)
 
-    int wv_indexGPrim(wvContext *cntxt, char *name)
+    int wv_indexGPrim(wvContext *cntxt, char *name) nogil
+
+    int wv_modGPrim(wvContext *cntxt, int index, int nItems,
+                    wvData *items) nogil
 
     ctypedef int (*cy_callback) (void *wsi, unsigned char *buf,
-                                 int ibuf, void *f) 
+                                 int ibuf, void *f) nogil
+
+    int wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf,
+                     int bufLen, int flag, cy_callback callback1,
+                     void* callback2) nogil
+
+    int wv_sendGPrimList(void *wsi, wvContext *cntxt, unsigned char *buf,
+                         int bufLen, int flag, int nList, const int *list,
+                         cy_callback callback1, void* callback2) nogil
+
+    size_t wv_sendSize(wvContext *cntxt, int flag, int *largest) nogil
+
+    void wv_removeGPrim(wvContext *cntxt, int index) nogil
 
-    int wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
-                      cy_callback callback1, void* callback2)
+    int wv_nameGPrim(wvContext *cntxt, int index, char *name, int len) nogil
 
-    void wv_removeGPrim(wvContext *cntxt, int index)
+    int wv_setLineWidth(wvContext *cntxt, int index, float width) nogil
+
+    void wv_beginData(wvContext *cntxt) nogil
+
+    void wv_endData(wvContext *cntxt) nogil
     
-    void wv_removeAll(wvContext *cntxt)
+    void wv_removeAll(wvContext *cntxt) nogil
     
-    void wv_prepareForSends(wvContext *cntxt)
+    void wv_prepareForSends(wvContext *cntxt) nogil
     
-    void wv_finishSends(wvContext *cntxt)
+    void wv_finishSends(wvContext *cntxt) nogil
+
+    void wv_releaseStripes(wvContext *cntxt) nogil
+
+    int wv_restoreStripes(wvContext *cntxt, int flag) nogil
     
     void wv_destroyContext(wvContext **context)
 
@@ -162,26 +198,99 @@ cdef extern from "wv.h":
 
     float * wv_getFocus(float *bbox, float *focus)
 
-    void wv_setBias(wvContext *cntxt, int bias)
+    void wv_setBias(wvContext *cntxt, int bias) nogil
 
-    int wv_checkConnectivities(int nPoints, int nTriangles, int * pointIndices, int bias)
+    int wv_checkConnectivities(int nPoints, int nTriangles, int * pointIndices, int bias) nogil
     
 
 import sys
 
 
-    
-cdef int callback(void *wsi, unsigned char *buf, int ibuf, void *f):
+
+cdef class _BufferView:
+    '''Exposes a block of C memory through the buffer protocol, read only
+    and without copying it.'''
+
+    cdef unsigned char *data
+    cdef Py_ssize_t size
+
+    def __getbuffer__(self, Py_buffer *view, int flags):
+        PyBuffer_FillInfo(view, self, <void*>self.data, self.size, 1, flags)
+
+    def __releasebuffer__(self, Py_buffer *view):
+        pass
+
+
+cdef int callback(void *wsi, unsigned char *buf, int ibuf, void *f) with gil:
     '''This Cython function wraps the python return function, and
     passes it a buffer of binary data and a pointer to the WV_Wrapper.
+    The encoder runs without the GIL, so it is taken again here.
+
+    The data is passed as a memoryview over the wrapper's buffer rather
+    than as a copy. The encoder reuses the buffer as soon as the python
+    function returns, so anything that needs the data afterwards must
+    copy it first, e.g. with buf.tobytes().
     '''
     cdef int status
-    cdef bytes py_buf = buf[:ibuf]  #TODO: see about getting rid of this copy 
+    cdef _BufferView chunk = _BufferView()
 
-    status = (<object>f)(<object>wsi, py_buf, ibuf)
+    chunk.data = buf
+    chunk.size = ibuf
+    status = (<object>f)(<object>wsi, memoryview(chunk), ibuf)
     return status     
 
    
+class BufferPool(object):
+    '''Send buffers shared by all WV_Wrappers. A send takes a buffer for as
+    long as it runs and gives it back, so idle wrappers hold none. Sizes
+    are rounded up to a power of two of at least min_size, and up to
+    max_bytes of returned buffers are kept for reuse.
+    '''
+
+    def __init__(self, max_bytes=64*1024*1024, min_size=64*1024):
+        self.max_bytes = max_bytes
+        self.min_size = min_size
+        self._free = {}  # map of size to list of buffers
+        self._bytes = 0  # in _free
+        self._lock = threading.Lock()
+
+    def size_for(self, nbytes):
+        size = self.min_size
+        while size < nbytes:
+            size *= 2
+        return size
+
+    def take(self, nbytes):
+        '''Return a bytearray of at least nbytes.'''
+        size = self.size_for(nbytes)
+        with self._lock:
+            free = self._free.get(size)
+            if free:
+                self._bytes -= size
+                return free.pop()
+        return bytearray(size)
+
+    def give(self, buf):
+        '''Return a buffer from take to the pool.'''
+        with self._lock:
+            if self._bytes + len(buf) <= self.max_bytes:
+                self._free.setdefault(len(buf), []).append(buf)
+                self._bytes += len(buf)
+
+    def clear(self):
+        with self._lock:
+            self._free = {}
+            self._bytes = 0
+
+    @property
+    def free_bytes(self):
+        return self._bytes
+
+
+# the pool of WV_Wrapper.buffer_pool unless it is set otherwise
+send_buffers = BufferPool()
+
+
 cdef float* _get_focus(bbox, float focus[4]):
     import warnings
     warnings.warn("pyV3D._get_focus is deprecated", DeprecationWarning) 
@@ -265,7 +374,9 @@ class Triangle(GraphicsPrimitive):
                         orientation=True,
                         points_visible=False,
                         lines_visible=False,
-                        focus=None):
+                        focus=None,
+                        edges='all',
+                        feature_angle=30.0):
         
         super(Triangle, self).__init__(
                                         points,
@@ -282,14 +393,23 @@ class Triangle(GraphicsPrimitive):
                                         
         self.tris=tris
         self.normals=normals
+        self.edges=edges
+        self.feature_angle=feature_angle
 
     def add_primitive_to_context(self, wv_wrapper):
+        points, bbox, focus = self.points, self.bbox.flatten(), self.focus
+        if wv_wrapper.ownership == 'adopt' or hasattr(self, 'scaled'):
+            if focus is None:
+                focus = get_focus(bbox)
+            points = _adopt_points(self, focus)
+            bbox = focus = None
         wv_wrapper.add_triangle(
-                                self.points, self.tris, self.colors,
-                                self.normals, self.name, self.bbox.flatten(),
+                                points, self.tris, self.colors,
+                                self.normals, self.name, bbox,
                                 self.visible, self.transparency, self.shading,
                                 self.orientation, self.points_visible, self.lines_visible,
-                                focus=self.focus)
+                                focus=focus, edges=self.edges,
+                                feature_angle=self.feature_angle)
 
 class Line(GraphicsPrimitive):
     def __init__( self, points=None,
@@ -323,14 +443,242 @@ class Line(GraphicsPrimitive):
                                 self.visible, self.transparency, self.shading,
                                 self.orientation, self.points_visible, self.lines_visible,
                                 self.focus)
+
+class PrimitiveBatch(GraphicsPrimitive):
+    '''Many GPrims of one kind kept as concatenated arrays, so that they
+    are added to the context in one go. point_offsets says where the
+    points of each GPrim start, names has the name of each one. They
+    share the attributes.
+    '''
+    def __init__(self, points=None,
+                       point_offsets=None,
+                       names=(),
+                       colors=None,
+                       bounding_box=None,
+                       is_visible=True,
+                       is_transparent=False,
+                       has_shading=False,
+                       has_orientation=False,
+                       points_visible=False,
+                       lines_visible=False,
+                       focus=None):
+
+        super(PrimitiveBatch, self).__init__(
+                                    points,
+                                    colors,
+                                    None,
+                                    bounding_box,
+                                    is_visible,
+                                    is_transparent,
+                                    has_shading,
+                                    has_orientation,
+                                    points_visible,
+                                    lines_visible,
+                                    focus)
+
+        self.point_offsets=point_offsets
+        self.names=list(names)
+        # GPrims of the batch removed since, see WV_Wrapper.remove_GPrim
+        self.removed=set()
+
+class TriangleBatch(PrimitiveBatch):
+    def __init__( self, points=None,
+                        tris=None,
+                        point_offsets=None,
+                        tri_offsets=None,
+                        names=(),
+                        colors=None,
+                        normals=None,
+                        bbox=None,
+                        visible=True,
+                        transparency=False,
+                        shading=False,
+                        orientation=True,
+                        points_visible=False,
+                        lines_visible=False,
+                        focus=None,
+                        edges='all',
+                        feature_angle=30.0):
+
+        super(TriangleBatch, self).__init__(
+                                        points,
+                                        point_offsets,
+                                        names,
+                                        colors,
+                                        bbox,
+                                        visible,
+                                        transparency,
+                                        shading,
+                                        orientation,
+                                        points_visible,
+                                        lines_visible,
+                                        focus)
+
+        self.tris=tris
+        self.tri_offsets=tri_offsets
+        self.normals=normals
+        self.edges=edges
+        self.feature_angle=feature_angle
+
+    def add_primitive_to_context(self, wv_wrapper):
+        wv_wrapper.add_triangles(
+                                self.points, self.tris, self.point_offsets,
+                                self.tri_offsets, self.names, self.colors,
+                                self.normals, self.bbox.flatten(),
+                                self.visible, self.transparency, self.shading,
+                                self.orientation, self.points_visible, self.lines_visible,
+                                focus=self.focus, edges=self.edges,
+                                feature_angle=self.feature_angle,
+                                skip=self.removed)
+
+class LineBatch(PrimitiveBatch):
+    def add_primitive_to_context(self, wv_wrapper):
+        wv_wrapper.add_lines(
+                                self.points, self.point_offsets, self.names,
+                                self.colors, self.bbox.flatten(),
+                                self.visible, self.transparency, self.shading,
+                                self.orientation, self.points_visible, self.lines_visible,
+                                self.focus, skip=self.removed)
+
+def _offsets(offsets, total, count, what):
+    '''Return CSR style offsets as an intp array after checking that they
+    split total items into count runs.'''
+    offsets = np.ascontiguousarray(offsets, dtype=np.intp).reshape(-1)
+    if len(offsets) != count+1 or offsets[0] != 0 or offsets[-1] != total \
+       or (offsets[1:] < offsets[:-1]).any():
+        raise ValueError("%s must be %d offsets going up from 0 to %d" %
+                         (what, count+1, total))
+    return offsets
+
+def _batch_colors(colors, npoints, nprim):
+    '''Return how colors of a batch are given: 2 per vertex, 1 per GPrim
+    or 0 one for all.'''
+    ncolor = len(colors)/3
+    if ncolor == npoints:
+        return 2
+    if ncolor == nprim:
+        return 1
+    if ncolor == 1:
+        return 0
+    raise ValueError("need one color, one per GPrim or one per point, "
+                     "not %d" % ncolor)
+
+def _changed_arrays(old, new):
+    '''Return the names of the arrays that differ between two versions of
+    a primitive, or None if they differ in anything a GPrim modification
+    can't express.
+    '''
+    if old is new:
+        return []
+    if type(old) is not type(new):
+        return None
+    for attr in ('visible', 'transparency', 'shading', 'orientation',
+                 'points_visible', 'lines_visible', 'edges', 'feature_angle'):
+        if getattr(old, attr, None) != getattr(new, attr, None):
+            return None
+    if len(old.points) != len(new.points):
+        return None
+    if isinstance(new, Triangle) and not np.array_equal(old.tris, new.tris):
+        return None
+
+    # points a context adopted are scaled, compare them scaled alike
+    points = new.points
+    scaled = getattr(old, 'scaled', None)
+    if scaled is not None and getattr(new, 'scaled', None) is None:
+        points = adjust_points(scaled, points)
+
+    changed = []
+    if not np.array_equal(old.points, points):
+        # which edges are drawn can depend on where the points are
+        if getattr(new, 'edges', 'all') != 'all':
+            return None
+        changed.append('points')
+
+    for name in ('normals', 'colors'):
+        a = getattr(old, name, None)
+        b = getattr(new, name, None)
+        if a is None and b is None:
+            continue
+        if a is None or b is None or len(a) != len(b):
+            return None
+        if not np.array_equal(a, b):
+            # single colors are not per vertex and can't be modified,
+            # line colors don't map onto the segment vertices
+            if len(b) == 3 or isinstance(new, Line):
+                return None
+            changed.append(name)
+
+    # modified vertices drop any per vertex data that is not replaced too
+    if 'points' in changed:
+        for name in ('normals', 'colors'):
+            b = getattr(new, name, None)
+            if b is None or len(b) == 3 or name in changed:
+                continue
+            if isinstance(new, Line):
+                return None
+            changed.append(name)
+
+    return changed
+
+
+def _adopt_points(prim, focus):
+    '''Scale the points of a primitive in place to focus for a context that
+    adopts its arrays, and return them. Points that were scaled to another
+    focus before are scaled back first, read-only ones are replaced by a
+    scaled copy.
+    '''
+    points = prim.points
+    scaled = getattr(prim, 'scaled', None)
+    if scaled is not None and np.array_equal(scaled, focus):
+        return points
+    if not points.flags.writeable:
+        points = adjust_points(focus, points)
+    else:
+        if scaled is not None:
+            xyz = points.reshape(-1, 3)
+            xyz *= scaled[3]
+            xyz += scaled[:3]
+        adjust_points(focus, points, inplace=True)
+    prim.points = points
+    prim.scaled = np.array(focus, dtype=np.float32)
+    return points
+
+
+def _line_vertices(points):
+    '''Return the segment end points that add_line sends for a polyline.'''
+    xyz = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+    return np.ascontiguousarray(np.hstack((xyz[:-1], xyz[1:]))).reshape(-1)
+
+
 class ConnectivitiesError(Exception):
     pass
 
+class _DataAccess(object):
+    '''The context manager returned by WV_Wrapper.data_access.'''
+
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+
+    def __enter__(self):
+        self.wrapper._begin_data()
+        return self.wrapper
+
+    def __exit__(self, *args):
+        self.wrapper._end_data()
+
+
 # raise an exception for return values < 0
 def _check(int ret, name='?', errclass=RuntimeError):
     if ret < 0:
         raise errclass("ERROR: return value of %d from function '%s'" % (ret, name))
     return ret
+
+cdef int _set_data(bint borrow, int type, int len, void *data, int VBOtype,
+                   wvData *dstruct):
+    '''wv_borrowData if borrow is set, else wv_setData.'''
+    if borrow:
+        return wv_borrowData(len, data, VBOtype, dstruct)
+    return wv_setData(type, len, data, VBOtype, dstruct)
     
 cdef class WV_Wrapper:
 
@@ -338,15 +686,34 @@ cdef class WV_Wrapper:
     
     def __cinit__(self):
         self.context = NULL
-        self.buffer = BUFLEN*b'\0'
+        self._data_local = threading.local()  # data_access depth per thread
     
     def __dealloc__(self):
         """Frees the memory for the wvContext object"""
         if self.context != NULL:
             wv_destroyContext(&self.context)
     
-    def __init__(self):
+    def __init__(self, buffer_size=None):
         self.graphics_primitives=[]
+        self.bounding_box = None  # of the last full send
+        self.focus = None
+        # the most bytes sent in one buffer
+        self.buffer_size = BUFLEN if buffer_size is None else buffer_size
+        self.buffer_pool = send_buffers
+        # meshes from set_face_levels that are not at their finest yet
+        self.face_levels = []
+        # a pyV3D.stats.PipelineStats to collect timings in, if any
+        self.stats = None
+        # how add_triangle orders the triangles of meshes that are cut into
+        # stripes: 'morton', or None to keep them as they are given
+        self.stripe_order = 'morton'
+        # who holds the arrays of faces: 'copy', 'borrow' or 'adopt', see
+        # memory_usage
+        self.ownership = 'copy'
+        # the arrays wv borrowed, by GPrim name, and those of removed GPrims
+        # that wv did not free yet
+        self._held = {}
+        self._retired = []
 
     #@cython.boundscheck(False)
     #@cython.wraparound(False)        
@@ -389,18 +756,65 @@ cdef class WV_Wrapper:
             
         self.context = wv_createContext(cbias, cfov, czNear, czFar, 
                                         &eye[0], &center[0], &up[0])
+
+        # everything that shapes the encoded output, e.g. for cache keys
+        self.context_params = (cbias, cfov, czNear, czFar, tuple(eye), 
+                               tuple(center), tuple(up))
         
     def get_bufflen(self):
-        return BUFLEN
+        return self.buffer_size
+
+    def flush_size(self):
+        '''Return how many bytes a send may put in one buffer before passing
+        it on. Smaller scenes get a buffer just large enough for them, and
+        no buffer is smaller than the largest message. Subclasses may adapt
+        it, e.g. to the speed of their viewers.
+        '''
+        return self.buffer_size
                 
+    def _buffer_length(self, total, largest):
+        '''Return the size of the buffer to encode a send of total bytes
+        in, whose largest message is largest bytes. A message that does not
+        fit in it fails the send.
+        '''
+        return max(min(total, self.flush_size()), largest + 4)
+
     def clear(self):
         '''Remove all GPrim data.'''
-        wv_removeAll(self.context)
+        cdef wvContext* cntxt = self.context
+        with nogil:
+            wv_removeAll(cntxt)
         self.graphics_primitives=[]
+        self._held = {}
+        self._retired = []
+
+    def data_access(self):
+        '''Return a context manager that keeps sends from starting while
+        its block runs, so that GPrim indices, e.g. from _index_GPrim, stay
+        valid for remove_GPrim. Other threads may still add, modify and
+        remove GPrims meanwhile. Blocks may be nested, but a thread must not
+        send from within one.
+        '''
+        return _DataAccess(self)
+
+    def _begin_data(self):
+        cdef wvContext* cntxt = self.context
+        depth = getattr(self._data_local, 'depth', 0)
+        if depth == 0:
+            with nogil:
+                wv_beginData(cntxt)
+        self._data_local.depth = depth + 1
+
+    def _end_data(self):
+        cdef wvContext* cntxt = self.context
+        self._data_local.depth -= 1
+        if self._data_local.depth == 0:
+            with nogil:
+                wv_endData(cntxt)
 
     #@cython.boundscheck(False)
     #@cython.wraparound(False)        
-    def send_GPrim(self, wsi, int flag, wv_SendBinaryData):
+    def send_GPrim(self, wsi, int flag, wv_SendBinaryData, order=None):
         '''sends the appropriate message(s) to an individual client (browser)
         should be called by the server for every current client instance
         
@@ -415,11 +829,85 @@ cdef class WV_Wrapper:
               -1 - send the first suite of gPrims
                 
          wv_sendBinaryData(wsi, buf, len): function
-             callback function to send the packets
+             callback function to send the packets. buf is a memoryview
+             that is only valid until the callback returns.
+
+         order: int sequence
+             If given, only the GPrims with these indices are sent, in
+             this order. Several sends between the same begin_sends and
+             finish_sends may split the GPrims between them, e.g. to send
+             what the viewer looks at first, see pyV3D.spatial.
         '''
-        cdef unsigned char* cbuf = self.buffer
-        _check(wv_sendGPrim(<void*>wsi, self.context, cbuf, flag, 
-                     callback, <void *>wv_SendBinaryData), "wv_sendGPrim")
+        cdef unsigned char* cbuf
+        cdef wvContext* cntxt = self.context
+        cdef void* cwsi = <void*>wsi
+        cdef void* cfunc
+        cdef int status, length, largest, nlist = 0
+        cdef const int *clist = NULL
+        cdef int[::1] indices
+        cdef size_t total
+
+        if order is not None:
+            indices = np.ascontiguousarray(order, dtype=np.int32)
+            nlist = indices.shape[0]
+            if nlist:
+                clist = &indices[0]
+
+        # stripes that were released after an earlier send
+        with nogil:
+            status = wv_restoreStripes(cntxt, flag)
+        _check(status, "wv_restoreStripes")
+
+        with nogil:
+            total = wv_sendSize(cntxt, flag, &largest)
+        length = self._buffer_length(total, largest)
+
+        stats = self.stats
+        if stats is not None:
+            wv_SendBinaryData = stats.callback(wv_SendBinaryData)
+            stats.add_buffer(length)
+        cfunc = <void*>wv_SendBinaryData
+
+        buf = self.buffer_pool.take(length)
+        cbuf = buf
+        try:
+            with timed(stats, 'encode'):
+                # the GIL is only needed again when a buffer is full, in
+                # callback
+                with nogil:
+                    if order is None:
+                        status = wv_sendGPrim(cwsi, cntxt, cbuf, length, flag,
+                                              callback, cfunc)
+                    else:
+                        status = wv_sendGPrimList(cwsi, cntxt, cbuf, length,
+                                                  flag, nlist, clist,
+                                                  callback, cfunc)
+        finally:
+            self.buffer_pool.give(buf)
+        _check(status, "wv_sendGPrim")
+
+    def gprim_boxes(self):
+        '''Return the bounding boxes of the GPrims in the coordinates they
+        are sent in, in the order of their indices, as an (n, 6) float32
+        array of the maxima and then the minima, and a bool array that is
+        True for GPrims that are being deleted. Call it between
+        begin_sends, or prepare_for_sends, and finish_sends.
+        '''
+        cdef wvContext* cntxt = self.context
+        cdef int i, j
+        cdef float[:, ::1] cboxes
+        cdef signed char[::1] cdeleted
+
+        n = cntxt.nGPrim if cntxt.gPrims != NULL else 0
+        boxes = np.empty((n, 6), dtype=np.float32)
+        deleted = np.zeros(n, dtype=np.bool_)
+        cboxes = boxes
+        cdeleted = deleted.view(np.int8)
+        for i in range(n):
+            for j in range(6):
+                cboxes[i, j] = cntxt.gPrims[i].box[j]
+            cdeleted[i] = (cntxt.gPrims[i].updateFlg & WV_DELETE) != 0
+        return boxes, deleted
                      
     #@cython.boundscheck(False)
     #@cython.wraparound(False)        
@@ -429,22 +917,47 @@ cdef class WV_Wrapper:
         index: int
             index number for the gPrim to remove
         '''
-        
-        wv_removeGPrim(self.context, index)
-        self.graphics_primitives.remove(index)
+        cdef wvContext* cntxt = self.context
+        cdef char cname[256]
+        cdef char *pname = cname
+        cdef int length
+
+        with self.data_access():
+            with nogil:
+                length = wv_nameGPrim(cntxt, index, cname, 256)
+            if length < 0:
+                return
+            if length >= 256:
+                name = b'\0'*(length+1)
+                pname = name
+                with nogil:
+                    wv_nameGPrim(cntxt, index, pname, length+1)
+            name = pname[:length]
+
+            with nogil:
+                wv_removeGPrim(cntxt, index)
+            self._retire(name)
+        self.graphics_primitives = [prim for prim in self.graphics_primitives
+                                    if prim.name != name]
+        for prim in self.graphics_primitives:
+            if isinstance(prim, PrimitiveBatch) and name in prim.names:
+                prim.removed.add(name)
          
         
     def prepare_for_sends(self):
-        bounding_boxes = np.array([], dtype=np.float32)
+        bounding_boxes = []
         
         for primitive in self.graphics_primitives:
-            if not primitive.bbox:
+            if primitive.bbox is None:
                 primitive.bbox = get_bounding_box(primitive.points)
                     
-            bounding_boxes = np.append(bounding_boxes, primitive.bbox)
+            bounding_boxes.append(np.asarray(primitive.bbox, 
+                                             dtype=np.float32).reshape(-1))
 
-        bounding_box = get_bounding_box(bounding_boxes.flatten())
+        bounding_box = get_bounding_box(np.concatenate(bounding_boxes))
         focus = get_focus(bounding_box.flatten())
+        self.bounding_box = bounding_box
+        self.focus = focus
 
         for primitive in self.graphics_primitives:
             primitive.bbox = bounding_box
@@ -463,17 +976,303 @@ cdef class WV_Wrapper:
                 #point=primitive.points[index*3:index*3+3]
                 #primitive.points[index*3:index*3+3] =  adjust_point(focus, point)
 
-            primitive.add_primitive_to_context(self)
+            self._register(primitive)
         #self.focus_vertices()
-        '''The server needs to call this before sending GPrim info.'''
 
-        wv_prepareForSends(self.context)
+        self.begin_sends()
+
+    def begin_sends(self):
+        '''The server needs to call this before sending GPrim info. Waits
+        for GPrim changes being made in other threads to finish.'''
+        cdef wvContext* cntxt = self.context
+
+        with nogil:
+            wv_prepareForSends(cntxt)
+
+    def update_primitives(self, old_primitives):
+        '''Bring the context up to date after self.graphics_primitives has
+        been refilled, instead of clearing it and adding everything again.
+
+        old_primitives: list
+            The graphics primitives that are currently in the context.
+
+        Primitives are matched by name. GPrims whose vertices, normals or
+        colors changed are modified in place, vanished ones are removed and
+        new ones are added, so that a send with flag 0 only carries what
+        changed. Points are scaled with the focus of the last full send.
+
+        Returns the number of GPrims that changed, or -1 if the new
+        primitives can't be expressed as updates, e.g. because their
+        connectivity or attributes changed, or because batches of
+        primitives are involved. The context is left alone in that case
+        and a full send is needed.
+        '''
+        cdef wvContext* cntxt = self.context
+        cdef int index
+
+        if self.focus is None:
+            return -1
+
+        for prim in self.graphics_primitives + list(old_primitives):
+            if isinstance(prim, PrimitiveBatch):
+                return -1
+
+        old = dict((prim.name, prim) for prim in old_primitives)
+        new = set(prim.name for prim in self.graphics_primitives)
+        if len(new) != len(self.graphics_primitives):
+            return -1
+
+        # work out everything before touching the context
+        plan = []
+        for prim in self.graphics_primitives:
+            prev = old.get(prim.name)
+            if prev is None:
+                plan.append((prim, None))
+                continue
+            changed = _changed_arrays(prev, prim)
+            if changed is None:
+                return -1
+            if changed:
+                plan.append((prim, changed))
+            elif getattr(prev, 'scaled', None) is not None:
+                # keep the adopted points, not a second copy of them
+                prim.points, prim.scaled = prev.points, prev.scaled
+
+        removed = [name for name in old if name not in new]
+
+        # indices of GPrims stay put until the next send
+        with self.data_access():
+            for prim, changed in plan:
+                prim.bbox = self.bounding_box
+                self._register(prim, changed)
+
+            for name in removed:
+                index = self._index_GPrim(name)
+                with nogil:
+                    wv_removeGPrim(cntxt, index)
+                self._retire(name)
+
+        # unchanged primitives need the same bbox for later comparisons
+        for prim in self.graphics_primitives:
+            prim.bbox = self.bounding_box
+
+        return len(plan) + len(removed)
+
+    def _register(self, prim, changed=None):
+        '''Add prim to the context, or replace the changed arrays of its
+        GPrim, timing it in stats.'''
+        stats = self.stats
+        with timed(stats, 'register'):
+            if changed is None:
+                prim.add_primitive_to_context(self)
+            else:
+                self._mod_primitive(prim, changed)
+        if stats is not None:
+            self._count_gprims(prim)
+
+    def _count_gprims(self, prim):
+        '''Count the GPrims of prim, the bytes of its arrays and the
+        stripes wv cut each GPrim into in stats.'''
+        cdef wvContext* cntxt = self.context
+        cdef int index
+
+        if isinstance(prim, PrimitiveBatch):
+            names = [name for name in prim.names if name not in prim.removed]
+        else:
+            names = [prim.name]
+        nbytes = sum(array.nbytes for array in
+                     (getattr(prim, attr, None) for attr in
+                      ('points', 'tris', 'normals', 'colors'))
+                     if isinstance(array, np.ndarray))
+        self.stats.add('register', nbytes=nbytes, chunks=len(names), calls=0)
+        if not self.stats.count_gprims:
+            return
+        with self.data_access():
+            for name in names:
+                index = self._index_GPrim(name)
+                self.stats.add_gprim(name,
+                                     stripes=cntxt.gPrims[index].nStripe)
+
+    def _index_GPrim(self, name):
+        cdef char *gpname = name
+        cdef wvContext* cntxt = self.context
+        cdef int index
+        with nogil:
+            index = wv_indexGPrim(cntxt, gpname)
+        return _check(index, "wv_indexGPrim")
+
+    def _mod_primitive(self, prim, changed):
+        '''Replace the changed arrays of an existing GPrim.'''
+        cdef wvData items[3]
+        cdef int nitems = 0
+        cdef int index, status
+        cdef wvContext* cntxt = self.context
+        cdef np.ndarray[np.float32_t, ndim=1, mode="c"] verts
+        cdef np.ndarray[np.float32_t, ndim=1, mode="c"] normals
+        cdef np.ndarray[np.float32_t, ndim=1, mode="c"] colors
+        cdef bint borrow
+
+        # lines are always copied, see add_triangle
+        borrow = self.ownership != 'copy' and not isinstance(prim, Line)
+        held = {}
+
+        if 'points' in changed:
+            if isinstance(prim, Line):
+                verts = _line_vertices(prim.points)
+            elif self.ownership == 'adopt' or hasattr(prim, 'scaled'):
+                verts = _adopt_points(prim, self.focus)
+            else:
+                verts = np.ascontiguousarray(adjust_points(self.focus, 
+                                                           prim.points), 
+                                             dtype=np.float32)
+            _check(_set_data(borrow, WV_REAL32, len(verts)/3, &verts[0], 
+                             WV_VERTICES, &items[nitems]), "wv_setData")
+            held[WV_VERTICES] = verts
+            nitems += 1
+
+        if 'normals' in changed:
+            normals = prim.normals
+            _check(_set_data(borrow, WV_REAL32, len(normals)/3, &normals[0], 
+                             WV_NORMALS, &items[nitems]), "wv_setData")
+            held[WV_NORMALS] = normals
+            nitems += 1
+
+        if 'colors' in changed:
+            colors = prim.colors
+            _check(wv_setData(WV_REAL32, len(colors)/3, &colors[0], 
+                              WV_COLORS, &items[nitems]), "wv_setData")
+            nitems += 1
+
+        # a send may not move the GPrim between looking it up and changing it
+        with self.data_access():
+            index = self._index_GPrim(prim.name)
+            with nogil:
+                status = wv_modGPrim(cntxt, index, nitems, items)
+        _check(status, "wv_modGPrim")
+        if borrow:
+            # the replaced arrays are no longer used
+            self._held.setdefault(prim.name, {}).update(held)
         
         
     def finish_sends(self):
         '''The server needs to call this before sending GPrim info.'''
+        cdef wvContext* cntxt = self.context
         
-        wv_finishSends(self.context)
+        # what was encoded is made again if it is needed again
+        if self.ownership != 'copy':
+            with nogil:
+                wv_releaseStripes(cntxt)
+        with nogil:
+            wv_finishSends(cntxt)
+
+        if self._retired:
+            self._retired = [(name, held) for name, held in self._retired
+                             if wv_indexGPrim(cntxt, name) >= 0]
+
+    def _retire(self, name):
+        '''Keep the arrays wv borrowed for a removed GPrim until wv frees
+        it, after the next send.'''
+        held = self._held.pop(name, None)
+        if held is not None:
+            self._retired.append((name, held))
+
+    def memory_usage(self):
+        '''Return the bytes the data of each GPrim takes, as a dict that
+        maps GPrim names to dicts of bytes by category:
+
+          vertices, normals, colors
+              the arrays of the whole GPrim
+          indices
+              its triangle, line and point indices
+          stripes
+              what is made from them to send: 16 bit indices, and copies
+              of the vertices, normals and colors of meshes that are cut
+              into several stripes
+          borrowed
+              how much of the above are arrays wv uses in place
+          source
+              arrays the graphics primitive keeps that wv does not use,
+              e.g. the unscaled points it was given. Primitives of batches
+              share theirs and count none.
+
+        Where that data lives depends on ownership. With 'copy', wv copies
+        every array it is given and the primitives keep the originals. With
+        'borrow', wv uses the scaled points, triangles, normals and edges
+        of faces in place and holds on to them. With 'adopt' the points of
+        faces are also scaled in place, so a face is kept once, but the
+        arrays given to set_face_data then belong to the wrapper and must
+        not be used again. Unless ownership is 'copy', stripes are freed
+        as soon as they are sent, and made again for the next full send.
+        Lines are always copied.
+        '''
+        cdef wvContext* cntxt = self.context
+        cdef wvGPrim *gp
+        cdef wvStripe *stripe
+        cdef int i, j
+        cdef size_t nverts, nstripe
+
+        sources = {}
+        for prim in self.graphics_primitives:
+            if isinstance(prim, PrimitiveBatch):
+                continue
+            held = self._held.get(prim.name, {}).values()
+            sources[prim.name] = sum(
+                array.nbytes for array in
+                (getattr(prim, attr, None) for attr in
+                 ('points', 'tris', 'normals', 'colors'))
+                if isinstance(array, np.ndarray) and
+                not any(array is h for h in held))
+
+        usage = {}
+        with self.data_access():
+            for i in range(cntxt.nGPrim):
+                gp = &cntxt.gPrims[i]
+                if gp.updateFlg & WV_DELETE:
+                    continue
+                nverts = gp.nVerts
+                nbytes = {
+                    'vertices': 12*nverts if gp.vertices != NULL else 0,
+                    'normals': 12*nverts if gp.normals != NULL else 0,
+                    'colors': 3*nverts if gp.colors != NULL else 0,
+                    'indices': 4*(gp.nIndex*(gp.indices != NULL) +
+                                  gp.nlIndex*(gp.lIndices != NULL) +
+                                  gp.npIndex*(gp.pIndices != NULL)),
+                }
+                borrowed = 0
+                for vbo, what in ((WV_VERTICES, 'vertices'),
+                                  (WV_NORMALS, 'normals')):
+                    if gp.borrowed & vbo:
+                        borrowed += nbytes[what]
+                for vbo, count in ((WV_INDICES, gp.nIndex),
+                                   (WV_LINDICES, gp.nlIndex),
+                                   (WV_PINDICES, gp.npIndex)):
+                    if gp.borrowed & vbo:
+                        borrowed += 4*count
+
+                stripes = 0
+                for j in range(gp.nStripe):
+                    stripe = &gp.stripes[j]
+                    nverts = stripe.nsVerts
+                    if stripe.gIndices != NULL:
+                        stripes += 4*nverts
+                    if stripe.sIndice2 != NULL:
+                        stripes += 2*stripe.nsIndices
+                    if stripe.lIndice2 != NULL:
+                        stripes += 2*stripe.nlIndices
+                    if stripe.pIndice2 != NULL:
+                        stripes += 2*stripe.npIndices
+                    # a single stripe shares the arrays of the GPrim
+                    if gp.nStripe != 1:
+                        stripes += (12*nverts*(stripe.vertices != NULL) +
+                                    12*nverts*(stripe.normals != NULL) +
+                                    3*nverts*(stripe.colors != NULL))
+                nbytes['stripes'] = stripes
+                nbytes['borrowed'] = borrowed
+
+                name = gp.name
+                nbytes['source'] = sources.get(name, 0)
+                usage[name] = nbytes
+        return usage
 
     def set_face_data(self,  np.ndarray[np.float32_t, mode="c"] points not None,
                              np.ndarray[int, mode="c"] tris not None,
@@ -486,7 +1285,9 @@ cdef class WV_Wrapper:
                              shading=False,
                              orientation=True,
                              points_visible=False,
-                             lines_visible=False):
+                             lines_visible=False,
+                             edges='all',
+                             feature_angle=30.0):
         
         self.graphics_primitives.append(
                             Triangle(
@@ -501,9 +1302,53 @@ cdef class WV_Wrapper:
                                 shading=shading,
                                 orientation=orientation,
                                 points_visible=points_visible,
-                                lines_visible=lines_visible)
+                                lines_visible=lines_visible,
+                                edges=edges,
+                                feature_angle=feature_angle)
                         )
 
+    def set_face_levels(self, levels, name='', **kwargs):
+        '''Like set_face_data, for a mesh given at several levels of detail
+        as (points, normals, tris) tuples, coarsest first and the mesh
+        itself last, e.g. from pyV3D.lod.build_levels. Only the coarsest
+        level is set now, refine replaces it with the finer ones. All
+        levels but the finest get their own GPrim name, see
+        pyV3D.lod.level_name. Other arguments go to set_face_data.
+        '''
+        entry = (name, list(levels), kwargs)
+        self._set_face_level(entry)
+        if entry[1]:
+            self.face_levels.append(entry)
+
+    def _set_face_level(self, entry):
+        '''Set the next level of a set_face_levels entry and drop it.'''
+        name, levels, kwargs = entry
+        points, normals, tris = levels.pop(0)
+        self.set_face_data(points, tris, normals=normals,
+                           name=level_name(name, len(levels)), **kwargs)
+
+    def refine(self):
+        '''Replace every mesh from set_face_levels that is not at its
+        finest with its next level, as update_primitives does. A mesh
+        can't change its connectivity through a GPrim modification, so the
+        GPrim of the old level is removed and that of the new one added.
+
+        Returns what update_primitives does, i.e. a send with flag 0 brings
+        viewers up to date unless it is -1, or 0 if there was nothing left
+        to refine.
+        '''
+        if not self.face_levels:
+            return 0
+        old = self.graphics_primitives
+        replaced = set(level_name(name, len(levels))
+                       for name, levels, _ in self.face_levels)
+        self.graphics_primitives = [prim for prim in old
+                                    if prim.name not in replaced]
+        for entry in self.face_levels:
+            self._set_face_level(entry)
+        self.face_levels = [entry for entry in self.face_levels if entry[1]]
+        return self.update_primitives(old)
+
     def set_edge_data(self,  np.ndarray[np.float32_t, mode="c"] points not None,
                              np.ndarray[np.float32_t, mode="c"] colors=None,
                              name='',
@@ -529,6 +1374,81 @@ cdef class WV_Wrapper:
                                 lines_visible)
                         )
 
+    def set_faces_batch(self, np.ndarray[np.float32_t, mode="c"] points not None,
+                              np.ndarray[int, mode="c"] tris not None,
+                              point_offsets,
+                              tri_offsets,
+                              names,
+                              np.ndarray[np.float32_t, mode="c"] colors=None,
+                              np.ndarray[np.float32_t, mode="c"] normals=None,
+                              bbox=None,
+                              visible=True,
+                              transparency=False,
+                              shading=False,
+                              orientation=True,
+                              points_visible=False,
+                              lines_visible=False,
+                              edges='all',
+                              feature_angle=30.0):
+        '''Like set_face_data for many faces at once. The arrays of all
+        faces are concatenated, see add_triangles, and kept as a single
+        primitive.'''
+        self.graphics_primitives.append(
+                            TriangleBatch(
+                                points=points,
+                                tris=tris,
+                                point_offsets=_offsets(point_offsets,
+                                                       len(points)/3,
+                                                       len(names),
+                                                       'point_offsets'),
+                                tri_offsets=_offsets(tri_offsets,
+                                                     len(tris)/3,
+                                                     len(names),
+                                                     'tri_offsets'),
+                                names=names,
+                                colors=colors,
+                                normals=normals,
+                                bbox=bbox,
+                                visible=visible,
+                                transparency=transparency,
+                                shading=shading,
+                                orientation=orientation,
+                                points_visible=points_visible,
+                                lines_visible=lines_visible,
+                                edges=edges,
+                                feature_angle=feature_angle)
+                        )
+
+    def set_edges_batch(self, np.ndarray[np.float32_t, mode="c"] points not None,
+                              point_offsets,
+                              names,
+                              np.ndarray[np.float32_t, mode="c"] colors=None,
+                              bbox=None,
+                              visible=True,
+                              transparency=False,
+                              shading=False,
+                              orientation=False,
+                              points_visible=False,
+                              lines_visible=False):
+        '''Like set_edge_data for many edges at once. The points of all
+        edges are concatenated, see add_lines, and kept as a single
+        primitive.'''
+        self.graphics_primitives.append(
+                            LineBatch(
+                                points,
+                                _offsets(point_offsets, len(points)/3,
+                                         len(names), 'point_offsets'),
+                                names,
+                                colors,
+                                bbox,
+                                visible,
+                                transparency,
+                                shading,
+                                orientation,
+                                points_visible,
+                                lines_visible)
+                        )
+
     def add_triangle(self,  np.ndarray[np.float32_t, mode="c"] points not None,
                              np.ndarray[int, mode="c"] tris not None,
                              np.ndarray[np.float32_t, mode="c"] colors=None,
@@ -541,7 +1461,9 @@ cdef class WV_Wrapper:
                              orientation=True,
                              points_visible=False,
                              lines_visible=False,
-                             focus=None):
+                             focus=None,
+                             edges='all',
+                             feature_angle=30.0):
         """
         Set up VBO data for a face.
         
@@ -580,14 +1502,33 @@ cdef class WV_Wrapper:
 
             lines_visible: bool
                 Set to true to turn on display of edges
+
+            edges: string
+                Which triangle sides to send as edges: 'all' of them,
+                every 'unique' edge once, or only 'feature' edges, i.e.
+                boundaries and edges sharper than feature_angle degrees.
+
+            feature_angle: float
+                Dihedral angle in degrees for 'feature' edges.
+
+        With ownership 'borrow' or 'adopt' the GPrim uses points, tris and
+        normals in place, see memory_usage, and with 'adopt' the points are
+        scaled where they are.
         """
-        cdef int attr
+        cdef int attr, igprim, nitems
+        cdef int gtype = WV_TRIANGLE
         cdef char *gpname
+        cdef wvContext* cntxt
         cdef wvData items[6]
         cdef np.ndarray[np.int32_t, ndim=1, mode="c"] segs
         cdef np.ndarray[np.float32_t, ndim=1, mode="c"] color
         cdef int bias
+        cdef bint borrow
 
+        if self.ownership not in ('copy', 'borrow', 'adopt'):
+            raise ValueError("ownership is 'copy', 'borrow' or 'adopt', "
+                             "not %r" % (self.ownership,))
+        borrow = self.ownership != 'copy'
         bias = self.context.bias
         
 
@@ -608,19 +1549,29 @@ cdef class WV_Wrapper:
             errclass=ConnectivitiesError
             )
 
-        if focus != None:
-            points = adjust_points(focus, points)
-            
-        elif bbox != None:
-            points = adjust_points(get_focus(bbox), points)
+        if focus is None and bbox is not None:
+            focus = get_focus(bbox)
+        if focus is not None:
+            points = adjust_points(focus, points,
+                                   inplace=(self.ownership == 'adopt' and
+                                            points.flags.writeable))
+
+        # wv cuts meshes of more vertices than 16 bit indices reach into
+        # stripes of triangles that come one after the other. Triangles in
+        # Morton order make stripes that share few vertices, if the
+        # triangles share vertices at all.
+        if (self.stripe_order == 'morton' and num_points > 65535 and
+                num_points < 3*ntris):
+            tris = morton_order(points, tris, bias)
 
         # vertices 
-        _check(wv_setData(WV_REAL32, len(points)/3, &points[0], WV_VERTICES, &items[0]),
+        _check(_set_data(borrow, WV_REAL32, len(points)/3, &points[0], WV_VERTICES, &items[0]),
                "wv_setData")
 
         # triangles
-        _check(wv_setData(WV_INT32, 3*ntris, &tris[0], WV_INDICES, &items[1]),
+        _check(_set_data(borrow, WV_INT32, 3*ntris, &tris[0], WV_INDICES, &items[1]),
                "wv_setData")
+        held = {WV_VERTICES: points, WV_INDICES: tris}
 
         # triangle colors
         if colors is None:
@@ -630,37 +1581,43 @@ cdef class WV_Wrapper:
 
         # normals
         if normals is not None:
-            _check(wv_setData(WV_REAL32, len(points)/3, &normals[0], WV_NORMALS, &items[3]),
+            _check(_set_data(borrow, WV_REAL32, len(points)/3, &normals[0], WV_NORMALS, &items[3]),
                    "wv_setData")
+            held[WV_NORMALS] = normals
             it_col = 4
         else:
             it_col = 3
             
 
         # triangle sides (segments)
-        segs = np.empty(6*ntris, dtype=np.int32, order='C')
-        nseg = 0
-        for itri in range(ntris):
-            for k in range(3):
-                segs[2*nseg] = tris[3*itri+(k+1)%3]
-                segs[2*nseg+1] = tris[3*itri+(k+2)%3]
-                nseg+=1
-
-        _check(wv_setData(WV_INT32, 2*nseg, &segs[0], WV_LINDICES, &items[it_col]),
-            "wv_setData")
+        segs = triangle_edges(tris, points, edges, feature_angle, bias)
+        nitems = 5
+        if len(segs):
+            _check(_set_data(borrow, WV_INT32, len(segs), &segs[0], WV_LINDICES, &items[it_col]),
+                "wv_setData")
+            held[WV_LINDICES] = segs
 
-        # segment colors
-        color = np.array([0.0, 0.0, 0.0], dtype=np.float32, order='C')
+            # segment colors
+            color = np.array([0.0, 0.0, 0.0], dtype=np.float32, order='C')
 
-        _check(wv_setData(WV_REAL32, 1, &color[0], WV_LCOLOR, &items[it_col+1]), "wv_setData")
+            _check(wv_setData(WV_REAL32, 1, &color[0], WV_LCOLOR, &items[it_col+1]), "wv_setData")
+        else:
+            nitems = it_col
 
         # make graphic primitive 
         gpname = name
-        igprim = _check(wv_addGPrim(self.context, gpname, WV_TRIANGLE, attr, 5, items),
-            "wv_addGPrim")
-        # make line width 1 
-        if self.context.gPrims != NULL:
-            self.context.gPrims[igprim].lWidth = 1.0
+        # stripes and normals are built in here, let other threads run
+        cntxt = self.context
+        with self.data_access():
+            with nogil:
+                igprim = wv_addGPrim(cntxt, gpname, gtype, attr, nitems,
+                                     items)
+                # make line width 1 
+                if igprim >= 0:
+                    wv_setLineWidth(cntxt, igprim, 1.0)
+        _check(igprim, "wv_addGPrim for %s" % name)
+        if borrow:
+            self._held[name] = held
 
 
     def add_line(self,  
@@ -709,7 +1666,9 @@ cdef class WV_Wrapper:
                 Set to true to turn on display of edges
        """
         cdef char *gpname
-        cdef int head, attr
+        cdef int head, attr, igprim
+        cdef int gtype = WV_LINE
+        cdef wvContext* cntxt
         cdef wvData items[5]
         cdef np.ndarray[np.float32_t, ndim=1, mode="c"] xyzs
 
@@ -733,10 +1692,10 @@ cdef class WV_Wrapper:
             xyzs[6*nseg+4] = points[3*nseg+4]
             xyzs[6*nseg+5] = points[3*nseg+5]
 
-        if focus != None:
+        if focus is not None:
             points = adjust_points(focus, points)
             
-        elif bbox != None:
+        elif bbox is not None:
             points = adjust_points(get_focus(bbox), points)
 
         # vertices 
@@ -753,17 +1712,400 @@ cdef class WV_Wrapper:
         gpname = name
 
         # make graphic primitive 
-        igprim = _check(wv_addGPrim(self.context, gpname, WV_LINE, attr, 2, items),
-            "wv_addGPrim")
-        # make line width 1.5 
-        if self.context.gPrims != NULL:
-            self.context.gPrims[igprim].lWidth = 1.5
+        cntxt = self.context
+        with self.data_access():
+            with nogil:
+                igprim = wv_addGPrim(cntxt, gpname, gtype, attr, 2, items)
+                # make line width 1.5 
+                if igprim >= 0:
+                    wv_setLineWidth(cntxt, igprim, 1.5)
+        _check(igprim, "wv_addGPrim for %s" % name)
 
         # this core dumps on windows and doesn't work properly elsewhere, so
         # leave it out for now
         #if head != 0:
         #    wv_addArrowHeads(self.context, igprim, 0.05, 1, &head)
-     
+
+    def add_triangles(self, np.ndarray[np.float32_t, mode="c"] points not None,
+                            np.ndarray[int, mode="c"] tris not None,
+                            point_offsets,
+                            tri_offsets,
+                            names,
+                            np.ndarray[np.float32_t, mode="c"] colors=None,
+                            np.ndarray[np.float32_t, mode="c"] normals=None,
+                            bbox=None,
+                            visible=True,
+                            transparency=False,
+                            shading=False,
+                            orientation=True,
+                            points_visible=False,
+                            lines_visible=False,
+                            focus=None,
+                            edges='all',
+                            feature_angle=30.0,
+                            skip=()):
+        """
+        Set up VBO data for many faces, each one the GPrim add_triangle
+        would make for it. All faces are checked before any is added, and
+        then added in one loop without the GIL.
+
+            points: float32 Numpy ndarray (1xN*3)
+                The points of all faces one after the other.
+
+            tris: int Numpy ndarray (1xM*3)
+                The triangles of all faces one after the other. The
+                indices of each face count within its own points.
+
+            point_offsets, tri_offsets: int sequences
+                Where the points and triangles of each face start, with
+                the numbers of points and triangles as last entries.
+
+            names: sequence of strings
+                Names of the graphics primitives, one per face.
+
+            colors: float32 Numpy ndarray
+                Optional. A single color [r,g,b], one per face or one per
+                point.
+
+            normals: float32 Numpy ndarray (1xN*3)
+                Optional. A normal for every point.
+
+            skip: set
+                Names of faces to leave out.
+
+        The other arguments are as for add_triangle and apply to every
+        face.
+        """
+        cdef int attr, status, step, npts, ntri, nseg, it_col, nitems, cmode
+        cdef int bias = self.context.bias
+        cdef int gtype = WV_TRIANGLE
+        cdef int real32 = WV_REAL32
+        cdef int int32 = WV_INT32
+        cdef int vbo_vertices = WV_VERTICES
+        cdef int vbo_indices = WV_INDICES
+        cdef int vbo_colors = WV_COLORS
+        cdef int vbo_normals = WV_NORMALS
+        cdef int vbo_lindices = WV_LINDICES
+        cdef int vbo_lcolor = WV_LCOLOR
+        cdef Py_ssize_t i, nface = len(names)
+        cdef wvContext* cntxt = self.context
+        cdef wvData items[6]
+        cdef np.ndarray[np.intp_t, ndim=1, mode="c"] poff
+        cdef np.ndarray[np.intp_t, ndim=1, mode="c"] toff
+        cdef np.ndarray[np.intp_t, ndim=1, mode="c"] soff
+        cdef np.ndarray[np.int32_t, ndim=1, mode="c"] segs
+        cdef np.ndarray[np.uint8_t, ndim=1, mode="c"] keep
+        cdef np.ndarray[np.float32_t, ndim=1, mode="c"] black
+        cdef float *cpoints
+        cdef float *ccolors
+        cdef float *cnormals = NULL
+        cdef int *ctris
+        cdef int *csegs = NULL
+        cdef float *cblack
+        cdef np.intp_t *cpoff
+        cdef np.intp_t *ctoff
+        cdef np.intp_t *csoff
+        cdef unsigned char *ckeep
+        cdef char **cnames
+
+        if nface == 0:
+            return
+
+        poff = _offsets(point_offsets, len(points)/3, nface, 'point_offsets')
+        toff = _offsets(tri_offsets, len(tris)/3, nface, 'tri_offsets')
+        for what, offsets in (('points', poff), ('triangles', toff)):
+            empty = np.nonzero(offsets[1:] == offsets[:-1])[0]
+            if len(empty):
+                raise ValueError("GPrim %r has no %s" % (names[empty[0]], what))
+        if normals is not None and len(normals) != len(points):
+            raise ValueError("need a normal for every point")
+
+        names = list(names)
+        if len(set(names)) != nface:
+            raise RuntimeError("GPrim names of a batch must be unique")
+        keep = np.ones(nface, dtype=np.uint8)
+        if skip:
+            keep[[i for i, name in enumerate(names) if name in skip]] = 0
+
+        attr = make_attr(visible=visible, 
+                         transparency=transparency, 
+                         shading=shading, 
+                         orientation=orientation,
+                         points_visible=points_visible, 
+                         lines_visible=lines_visible)
+
+        cnames = <char**>malloc(nface*sizeof(char*))
+        if cnames == NULL:
+            raise MemoryError()
+        try:
+            for i in range(nface):
+                cnames[i] = names[i]
+
+            # check everything before adding anything
+            ctris = &tris[0]
+            cpoff = &poff[0]
+            ctoff = &toff[0]
+            ckeep = &keep[0]
+            status = 0
+            with nogil:
+                for i in range(nface):
+                    if not ckeep[i]:
+                        continue
+                    status = wv_checkConnectivities(cpoff[i+1]-cpoff[i],
+                                                    ctoff[i+1]-ctoff[i],
+                                                    &ctris[3*ctoff[i]], bias)
+                    if status < 0:
+                        step = 0
+                        break
+                    if cnames[i][0] == 0:
+                        status = -3
+                    elif wv_indexGPrim(cntxt, cnames[i]) >= 0:
+                        status = -2
+                    if status < 0:
+                        step = 1
+                        break
+            if status < 0:
+                if step == 0:
+                    _check(status, "wv_checkConnectivities for %s" % names[i],
+                           ConnectivitiesError)
+                _check(status, "wv_addGPrim for %s" % names[i])
+
+            if focus is not None:
+                points = adjust_points(focus, points)
+
+            elif bbox is not None:
+                points = adjust_points(get_focus(bbox), points)
+            cpoints = &points[0]
+
+            if colors is None:
+                colors = np.array([1.0, 0.0, 0.0], dtype=np.float32, order='C')
+            cmode = _batch_colors(colors, len(points)/3, nface)
+            ccolors = &colors[0]
+
+            if normals is not None:
+                cnormals = &normals[0]
+
+            # triangle sides (segments)
+            segs, soff = batch_triangle_edges(tris, points, poff, toff,
+                                              edges, feature_angle, bias)
+            if len(segs):
+                csegs = <int*>&segs[0]
+            csoff = &soff[0]
+            black = np.array([0.0, 0.0, 0.0], dtype=np.float32, order='C')
+            cblack = &black[0]
+
+            with self.data_access():
+                with nogil:
+                    for i in range(nface):
+                        if not ckeep[i]:
+                            continue
+                        npts = cpoff[i+1] - cpoff[i]
+                        ntri = ctoff[i+1] - ctoff[i]
+                        nseg = csoff[i+1] - csoff[i]
+
+                        step = 2
+                        status = wv_setData(real32, npts, &cpoints[3*cpoff[i]],
+                                            vbo_vertices, &items[0])
+                        if status < 0:
+                            break
+                        status = wv_setData(int32, 3*ntri, &ctris[3*ctoff[i]],
+                                            vbo_indices, &items[1])
+                        if status < 0:
+                            break
+                        if cmode == 2:
+                            status = wv_setData(real32, npts, &ccolors[3*cpoff[i]],
+                                                vbo_colors, &items[2])
+                        else:
+                            status = wv_setData(real32, 1, &ccolors[3*i*cmode],
+                                                vbo_colors, &items[2])
+                        if status < 0:
+                            break
+                        it_col = 3
+                        if cnormals != NULL:
+                            status = wv_setData(real32, npts,
+                                                &cnormals[3*cpoff[i]],
+                                                vbo_normals, &items[3])
+                            if status < 0:
+                                break
+                            it_col = 4
+
+                        # like add_triangle, which sends 5 items either way
+                        nitems = it_col
+                        if nseg > 0:
+                            status = wv_setData(int32, nseg, &csegs[csoff[i]],
+                                                vbo_lindices, &items[it_col])
+                            if status < 0:
+                                break
+                            status = wv_setData(real32, 1, cblack,
+                                                vbo_lcolor, &items[it_col+1])
+                            if status < 0:
+                                break
+                            nitems = 5
+
+                        step = 3
+                        status = wv_addGPrim(cntxt, cnames[i], gtype, attr,
+                                             nitems, items)
+                        if status < 0:
+                            break
+                        # make line width 1
+                        wv_setLineWidth(cntxt, status, 1.0)
+        finally:
+            free(cnames)
+
+        if status < 0:
+            _check(status, ("wv_setData for %s" if step == 2 else
+                            "wv_addGPrim for %s") % names[i])
+
+    def add_lines(self, np.ndarray[np.float32_t, mode="c"] points not None,
+                        point_offsets,
+                        names,
+                        np.ndarray[np.float32_t, mode="c"] colors=None,
+                        bbox=None,
+                        visible=True,
+                        transparency=False,
+                        shading=False,
+                        orientation=False,
+                        points_visible=False,
+                        lines_visible=False,
+                        focus=None,
+                        skip=()):
+        """
+        Set up VBO data for many edges, each one the GPrim add_line would
+        make for it. All edges are checked before any is added, and then
+        added in one loop without the GIL.
+
+            points: float32 Numpy ndarray (1xN*3)
+                The points of all edges one after the other.
+
+            point_offsets: int sequence
+                Where the points of each edge start, with the number of
+                points as last entry.
+
+            names: sequence of strings
+                Names of the graphics primitives, one per edge.
+
+            colors: float32 Numpy ndarray
+                Optional. A single color [r,g,b], one per edge or one per
+                point.
+
+            skip: set
+                Names of edges to leave out.
+
+        The other arguments are as for add_line and apply to every edge.
+        """
+        cdef int attr, status, nvert, cmode
+        cdef int gtype = WV_LINE
+        cdef int real32 = WV_REAL32
+        cdef int vbo_vertices = WV_VERTICES
+        cdef int vbo_colors = WV_COLORS
+        cdef Py_ssize_t i, nline = len(names)
+        cdef wvContext* cntxt = self.context
+        cdef wvData items[2]
+        cdef np.ndarray[np.intp_t, ndim=1, mode="c"] poff
+        cdef np.ndarray[np.uint8_t, ndim=1, mode="c"] keep
+        cdef np.ndarray[np.float32_t, ndim=1, mode="c"] xyzs
+        cdef float *cxyzs
+        cdef float *ccolors
+        cdef np.intp_t *cpoff
+        cdef unsigned char *ckeep
+        cdef char **cnames
+
+        if nline == 0:
+            return
+
+        poff = _offsets(point_offsets, len(points)/3, nline, 'point_offsets')
+        short = np.nonzero(poff[1:] - poff[:-1] < 2)[0]
+        if len(short):
+            raise ValueError("GPrim %r has less than 2 points" % names[short[0]])
+
+        names = list(names)
+        if len(set(names)) != nline:
+            raise RuntimeError("GPrim names of a batch must be unique")
+        keep = np.ones(nline, dtype=np.uint8)
+        if skip:
+            keep[[i for i, name in enumerate(names) if name in skip]] = 0
+
+        attr = make_attr(visible=visible, 
+                         transparency=transparency, 
+                         shading=shading, 
+                         orientation=orientation,
+                         points_visible=points_visible, 
+                         lines_visible=lines_visible)
+
+        # the segments of every polyline, without the ones joining the
+        # last point of a line to the first of the next. Like add_line
+        # the vertices are sent as given.
+        xyz = points.reshape(-1, 3)
+        inside = np.ones(len(xyz)-1, dtype=bool)
+        inside[poff[1:-1]-1] = False
+        xyzs = np.ascontiguousarray(np.hstack((xyz[:-1][inside],
+                                               xyz[1:][inside]))).reshape(-1)
+        cxyzs = &xyzs[0]
+
+        if colors is None:
+            colors = np.array([0.0, 0.0, 1.0], dtype=np.float32, order='C')
+        cmode = _batch_colors(colors, len(points)/3, nline)
+        ccolors = &colors[0]
+
+        cpoff = &poff[0]
+        ckeep = &keep[0]
+
+        cnames = <char**>malloc(nline*sizeof(char*))
+        if cnames == NULL:
+            raise MemoryError()
+        try:
+            for i in range(nline):
+                cnames[i] = names[i]
+
+            status = 0
+            with nogil:
+                for i in range(nline):
+                    if not ckeep[i]:
+                        continue
+                    if cnames[i][0] == 0:
+                        status = -3
+                    elif wv_indexGPrim(cntxt, cnames[i]) >= 0:
+                        status = -2
+                    if status < 0:
+                        break
+            if status < 0:
+                _check(status, "wv_addGPrim for %s" % names[i])
+
+            with self.data_access():
+                with nogil:
+                    for i in range(nline):
+                        if not ckeep[i]:
+                            continue
+                        # the segments of line i come after the segments of
+                        # the i lines before it, one less than their points
+                        nvert = 2*(cpoff[i+1] - cpoff[i] - 1)
+                        status = wv_setData(real32, nvert,
+                                            &cxyzs[6*(cpoff[i] - i)],
+                                            vbo_vertices, &items[0])
+                        if status < 0:
+                            break
+                        if cmode == 2:
+                            status = wv_setData(real32, cpoff[i+1] - cpoff[i],
+                                                &ccolors[3*cpoff[i]],
+                                                vbo_colors, &items[1])
+                        else:
+                            status = wv_setData(real32, 1, &ccolors[3*i*cmode],
+                                                vbo_colors, &items[1])
+                        if status < 0:
+                            break
+
+                        status = wv_addGPrim(cntxt, cnames[i], gtype, attr, 2,
+                                             items)
+                        if status < 0:
+                            break
+                        # make line width 1.5
+                        wv_setLineWidth(cntxt, status, 1.5)
+        finally:
+            free(cnames)
+
+        if status < 0:
+            _check(status, "wv_addGPrim for %s" % names[i])
+
     def focus_vertices(self):
         import warnings
         warnings.warn("pyV3D.focus_vertices is deprecated", DeprecationWarning)
@@ -789,53 +2131,91 @@ cdef class WV_Wrapper:
         cdef wvContext * context
         
         context = self.context
-        wv_setBias(&context[0], bias)
+        with nogil:
+            wv_setBias(&context[0], bias)
 
 
-def get_bounding_box(points):
-    x_min = x_max = points[0]
-    y_min = y_max = points[1]
-    z_min = z_max = points[2]
+ctypedef fused _real:
+    np.float32_t
+    np.float64_t
 
 
-    for index in xrange(points.shape[0]/3):
-        x = points[index*3]
-        y = points[index*3+1]
-        z = points[index*3+2]
+cdef void _bounds(_real *xyz, Py_ssize_t npts, _real *bbox) nogil:
+    '''Find the maxima and then the minima of the x, y and z coordinates
+    of npts points in a single pass.'''
+    cdef Py_ssize_t i
+    cdef int k
+    cdef _real v
 
-        x_min = min(x, x_min)
-        y_min = min(y, y_min)
-        z_min = min(z, z_min)
-       
-        x_max = max(x, x_max)
-        y_max = max(y, y_max)
-        z_max = max(z, z_max)
-
-    return np.array([[x_max, y_max, z_max], [x_min, y_min, z_min]],dtype=np.float32)
+    for k in range(3):
+        bbox[k] = bbox[k+3] = xyz[k]
+    for i in range(1, npts):
+        for k in range(3):
+            v = xyz[3*i+k]
+            if v > bbox[k]:
+                bbox[k] = v
+            elif v < bbox[k+3]:
+                bbox[k+3] = v
 
-def get_focus(bounding_box):
-    x_max = bounding_box[0]
-    y_max = bounding_box[1]
-    z_max = bounding_box[2]
 
-    x_min = bounding_box[3]
-    y_min = bounding_box[4]
-    z_min = bounding_box[5]
-
-    x_center = 0.5*(x_max + x_min)
-    y_center = 0.5*(y_max + y_min)
-    z_center = 0.5*(z_max + z_min)
-
-    max_coordinate_magnitude = abs(x_max - x_center)
-    max_coordinate_magnitude = max(abs(y_max - y_center), max_coordinate_magnitude)
-    max_coordinate_magnitude = max(abs(z_max - z_center), max_coordinate_magnitude)
+def get_bounding_box(points):
+    '''Return the bounding box of points, a flat array of coordinates of
+    the form [x1, y1, z1, .... x_n, y_n, z_n], as a float32 array
+    [[x_max, y_max, z_max], [x_min, y_min, z_min]].'''
+    cdef np.ndarray[np.float32_t, ndim=1, mode="c"] points32
+    cdef np.ndarray[np.float64_t, ndim=1, mode="c"] points64
+    cdef np.float32_t bbox32[6]
+    cdef np.float64_t bbox64[6]
+    cdef np.float32_t *xyz32
+    cdef np.float64_t *xyz64
+    cdef Py_ssize_t npts
+
+    points = np.asarray(points).reshape(-1)
+    npts = points.shape[0]/3
+    if npts == 0:
+        raise ValueError("can't take the bounding box of no points")
+
+    if points.dtype == np.float32:
+        points32 = np.ascontiguousarray(points)
+        xyz32 = &points32[0]
+        with nogil:
+            _bounds(xyz32, npts, bbox32)
+        bbox = [bbox32[k] for k in range(6)]
+    else:
+        points64 = np.ascontiguousarray(points, dtype=np.float64)
+        xyz64 = &points64[0]
+        with nogil:
+            _bounds(xyz64, npts, bbox64)
+        bbox = [bbox64[k] for k in range(6)]
+
+    return np.array(bbox, dtype=np.float32).reshape(2, 3)
 
-    return np.array([x_center, y_center, z_center, max_coordinate_magnitude], dtype=np.float32)
+def get_focus(bounding_box):
+    '''Return [x_center, y_center, z_center, size] for a bounding box
+    [x_max, y_max, z_max, x_min, y_min, z_min], where size is half the
+    length of its longest side.'''
+    bbox = np.asarray(bounding_box).reshape(-1)
+    center = 0.5*(bbox[:3] + bbox[3:])
+    size = np.abs(bbox[:3] - center.astype(np.float64)).max()
+
+    return np.append(center, size).astype(np.float32)
      
-def adjust_points(focus, points):
-    x_center, y_center, z_center, max_coordinate = focus
-    offset = np.tile((x_center, y_center, z_center),points.shape[0]/3)
-    points = points - offset
-    points = points/max_coordinate
-
-    return points
+def adjust_points(focus, points, inplace=False):
+    '''Move points so that the center of focus ends up at the origin and
+    scale them down by its size.
+
+    With inplace the points array is changed and returned instead of a
+    new array, which saves a copy of the whole mesh when the caller owns
+    the points.'''
+    center = np.asarray(focus[:3])
+    size = focus[3]
+
+    if inplace:
+        xyz = points.reshape(-1, 3)
+        xyz -= center
+        xyz /= size
+        return points
+
+    xyz = points.reshape(-1, 3) - center
+    xyz /= size
+    return xyz.reshape(points.shape)
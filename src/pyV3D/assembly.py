@@ -0,0 +1,384 @@
+"""
+Assemblies of many STL parts, given as a directory, a glob pattern or a
+manifest, loaded by a pool of worker processes.
+
+Workers parse the parts and hand their arrays back in files in shared
+memory, /dev/shm where there is one, that the sender maps instead of
+unpickling copies of them. The parts that finish within the first
+interval are sent with a single prepare_for_sends; the rest follow as
+updates, in batches, as they finish.
+"""
+
+import os
+import glob
+import json
+import mmap
+import time
+import Queue
+import logging
+import tempfile
+import threading
+import multiprocessing
+
+import numpy as np
+
+from pyV3D.stl import STLSender, STLGeometryObject
+from pyV3D.stats import PipelineStats, timed
+
+# where workers put the arrays of parts, in memory if the platform allows
+SHARED_DIR = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+
+# the longest wait for a part before the processes of the pool are checked
+POLL_INTERVAL = 1.0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(processes=None):
+    """Return the process pool that parses parts, creating it with the
+    given number of processes, one per CPU by default, on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = multiprocessing.Pool(processes)
+        return _pool
+
+
+def find_parts(spec):
+    """Return the (filename, name) of each part of an assembly. Names are
+    the paths of the parts, without .stl, relative to the directory of the
+    assembly.
+
+    spec: str
+        A directory, searched recursively for .stl files, a glob pattern
+        like parts/*.stl, or a .json manifest listing the files of the
+        parts relative to the directory it is in.
+    """
+    if os.path.isdir(spec):
+        base = spec
+        fnames = []
+        for dirpath, dirnames, filenames in os.walk(spec):
+            fnames.extend(os.path.join(dirpath, f) for f in filenames
+                          if f.lower().endswith('.stl'))
+    elif glob.has_magic(spec):
+        base = spec
+        while glob.has_magic(base):
+            base = os.path.dirname(base)
+        fnames = [f for f in glob.glob(spec) if os.path.isfile(f)]
+    elif spec.lower().endswith('.json'):
+        base = os.path.dirname(spec)
+        with open(spec) as f:
+            fnames = [os.path.join(base, name) for name in json.load(f)]
+    else:
+        raise ValueError("%s is not a directory, glob pattern or manifest"
+                         % spec)
+
+    base = os.path.abspath(base)
+    parts = []
+    for fname in sorted(fnames):
+        fname = os.path.abspath(fname)
+        if not fname.startswith(base + os.sep):
+            raise ValueError("part %s is outside of %s" % (fname, base))
+        name = os.path.splitext(os.path.relpath(fname, base))[0]
+        parts.append((fname, name.replace(os.sep, '/')))
+    if not parts:
+        raise ValueError("no STL parts found for %s" % spec)
+    return parts
+
+
+class _Recorder(object):
+    """Takes the place of a WV_Wrapper in workers."""
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.faces = []
+
+    def set_face_data(self, **kwargs):
+        self.faces.append(kwargs)
+
+
+def parse_part(job):
+    """Parse one part in a worker. Returns (fname, shared, error), where
+    shared is what _share returns for the faces of the part.
+    """
+    fname, name, options, collect_stats = job
+    try:
+        wv = _Recorder(PipelineStats(count_gprims=False)
+                       if collect_stats else None)
+        geom = STLGeometryObject(fname, **options)
+        geom.geom_name = name
+        geom.get_visualization_data(wv, angle=15., relSide=.02, relSag=.001)
+        # binary files name their solid after the header, which parts of
+        # one assembly tend to share
+        if len(wv.faces) == 1:
+            wv.faces[0]['name'] = name
+        stages = None
+        if wv.stats is not None:
+            stages = dict((stage, wv.stats.stages[stage].as_dict())
+                          for stage in ('parse', 'mesh'))
+        return fname, _share(wv.faces, stages), None
+    except Exception as err:
+        return fname, None, str(err)
+
+
+def _share(faces, stages=None):
+    """Put the arrays of faces in a file in SHARED_DIR. Returns (path,
+    faces, stages) with the arrays of faces replaced by their (dtype,
+    offset, count) in the file.
+    """
+    layout = []
+    size = 0
+    for face in faces:
+        for key, value in face.items():
+            if isinstance(value, np.ndarray):
+                size += -size % 16
+                layout.append((face, key, np.ascontiguousarray(value), size))
+                size += value.nbytes
+    if not size:
+        return None, faces, stages
+
+    fd, path = tempfile.mkstemp(prefix='pyv3d-', suffix='.part',
+                                dir=SHARED_DIR)
+    try:
+        os.ftruncate(fd, size)
+        mm = mmap.mmap(fd, size)
+        try:
+            for face, key, array, offset in layout:
+                mm[offset:offset+array.nbytes] = array.tobytes()
+                face[key] = (array.dtype.str, offset, array.size)
+        finally:
+            mm.close()
+    except Exception:
+        os.unlink(path)
+        raise
+    finally:
+        os.close(fd)
+    return path, faces, stages
+
+
+def _attach(shared):
+    """Return the faces of what _share returned, with arrays mapped from
+    its file, which is removed.
+    """
+    path, faces, stages = shared
+    if path is None:
+        return faces
+    try:
+        # private, so the part can be changed without touching the file
+        data = np.memmap(path, dtype=np.uint8, mode='c')
+    finally:
+        os.unlink(path)
+    for face in faces:
+        for key, value in face.items():
+            if isinstance(value, tuple):
+                dtype, offset, count = value
+                dtype = np.dtype(dtype)
+                face[key] = data[offset:offset+count*dtype.itemsize].view(dtype)
+    return faces
+
+
+def _release(result):
+    """Remove the file of a result that is not attached."""
+    shared = result[1]
+    if shared is not None and shared[0] is not None:
+        try:
+            os.unlink(shared[0])
+        except OSError:
+            pass
+
+
+class _Results(object):
+    """The results of parse_part, queued by the pool as they finish until
+    closed, and released as they finish after that.
+    """
+
+    def __init__(self):
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def put(self, result):
+        # runs on the thread of the pool that handles results
+        with self._lock:
+            if not self._closed:
+                self._queue.put(result)
+                return
+        _release(result)
+
+    def get(self, timeout=None):
+        return self._queue.get(timeout=timeout)
+
+    def close(self):
+        """Release the results that are queued and those still to come."""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                _release(self._queue.get_nowait())
+            except Queue.Empty:
+                break
+
+
+class STLAssemblySender(STLSender):
+    """Sends an assembly of STL parts, see find_parts, as one scene with a
+    GPrim per solid of every part. Parts are parsed by the processes of
+    get_pool.
+
+    When the wrapper can send updates, the first send does not wait for
+    every part: the parts parsed within interval seconds are sent as the
+    initial scene and later parts are added with an update every interval
+    seconds, scaled like the initial ones.
+
+    Levels of detail are not built for parts, lod is ignored.
+
+    processes: int
+        Size of the pool if this is the first sender to use it.
+
+    interval: float
+        Seconds between sends while parts are still being parsed.
+
+    timeout: float
+        Seconds to wait for the next part to finish. The parts still being
+        parsed then are left out, as they are once a process of the pool
+        died, whose part never finishes.
+
+    weld, tolerance, edges:
+        See STLGeometryObject.
+    """
+
+    processes = None
+    interval = 0.25
+    timeout = 600.0
+
+    def initialize(self, **kwargs):
+        super(STLAssemblySender, self).initialize(**kwargs)
+        self.processes = kwargs.get('processes', self.processes)
+        self.interval = kwargs.get('interval', self.interval)
+        self.timeout = kwargs.get('timeout', self.timeout)
+        self.options = dict((key, kwargs[key]) for key in
+                            ('weld', 'tolerance', 'edges') if key in kwargs)
+
+    @staticmethod
+    def supports(obj):
+        if not isinstance(obj, basestring):
+            return False
+        return (os.path.isdir(obj) or glob.has_magic(obj) or
+                obj.lower().endswith('.json'))
+
+    def send(self, obj, first=False):
+        if not (first and isinstance(obj, basestring) and
+                hasattr(self.wv, 'send_updates')):
+            return super(STLAssemblySender, self).send(obj, first)
+
+        self.wv.face_levels = []
+        shown = False
+        faces = []
+        deadline = time.time() + self.interval
+        for part in self._finished_parts(obj, self.interval):
+            if part is not None:
+                faces.extend(part)
+            if faces and time.time() >= deadline:
+                self._show(faces, not shown)
+                shown = True
+                faces = []
+                deadline = time.time() + self.interval
+        if faces:
+            self._show(faces, not shown)
+        elif not shown:
+            raise ValueError("none of the parts of %s could be loaded" % obj)
+
+    def _show(self, faces, first):
+        """Send faces, as the initial scene if first is set."""
+        wv = self.wv
+        stats = getattr(wv, 'stats', None)
+        if first:
+            with timed(stats, 'load'):
+                for face in faces:
+                    wv.set_face_data(**face)
+            wv.send(first=True)
+            return
+
+        old = wv.graphics_primitives
+        wv.graphics_primitives = list(old)
+        with timed(stats, 'load'):
+            for face in faces:
+                wv.set_face_data(**face)
+        if wv.update_primitives(old) >= 0:
+            wv.send_updates()
+            return
+        new = wv.graphics_primitives
+        wv.clear()
+        wv.graphics_primitives = new
+        wv.send()
+
+    def geom_from_file(self, spec):
+        for part in self._finished_parts(spec):
+            for face in part:
+                self.wv.set_face_data(**face)
+
+    def _finished_parts(self, spec, interval=None):
+        """Parse the parts of spec on the pool and yield the faces of each
+        as it finishes, or None every interval seconds none does. Gives up
+        on the parts left when none finished for timeout seconds or a
+        process of the pool died.
+        """
+        stats = getattr(self.wv, 'stats', None)
+        jobs = [(fname, name, self.options, stats is not None)
+                for fname, name in find_parts(spec)]
+        pool = get_pool(self.processes)
+        # a pool replaces processes that die, but their jobs are lost and
+        # their callbacks never run
+        workers = [worker for worker in pool._pool if worker.exitcode is None]
+        results = _Results()
+        pending = [pool.apply_async(parse_part, (job,), callback=results.put)
+                   for job in jobs]
+        remaining = len(jobs)
+        step = POLL_INTERVAL if interval is None else min(interval,
+                                                          POLL_INTERVAL)
+        now = time.time()
+        deadline = now + self.timeout
+        tick = None if interval is None else now + interval
+        try:
+            while remaining:
+                try:
+                    result = results.get(step)
+                except Queue.Empty:
+                    now = time.time()
+                    died = any(worker.exitcode is not None
+                               for worker in workers)
+                    if died or now >= deadline:
+                        lost = [job[0] for job, applied in zip(jobs, pending)
+                                if not applied.ready()]
+                        logging.error("gave up on %d parts of %s, %s: %s"
+                                      % (len(lost), spec,
+                                         "a process of the pool died" if died
+                                         else "none finished in %g s"
+                                         % self.timeout, ', '.join(lost)))
+                        return
+                    if tick is not None and now >= tick:
+                        tick = now + interval
+                        yield None
+                    continue
+                remaining -= 1
+                now = time.time()
+                deadline = now + self.timeout
+                if tick is not None:
+                    tick = now + interval
+
+                fname, shared, error = result
+                if error is not None:
+                    logging.error("can't load part %s: %s" % (fname, error))
+                    continue
+                faces = _attach(shared)
+                if stats is not None and shared[2] is not None:
+                    for stage, totals in shared[2].items():
+                        stats.add(stage, totals['wall'], totals['cpu'],
+                                  totals['bytes'], totals['chunks'],
+                                  totals['calls'])
+                yield faces
+        finally:
+            # drop what workers made for parts that are no longer wanted,
+            # without waiting for those that are still being parsed
+            results.close()
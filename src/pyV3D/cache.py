@@ -0,0 +1,285 @@
+"""
+A cache of encoded scenes, so that opening the same model again does not
+mean parsing and encoding it again.
+
+A scene is the init frame plus the frames of the full GPrim suite, exactly
+as WS_WV_Wrapper broadcasts them. Scenes live in an in-memory LRU tier
+limited by a byte budget and, optionally, in a directory on disk. Server
+processes sharing that directory, e.g. the workers of wvserver serve, load
+and encode each scene once between them, see SceneCache.building.
+
+LevelCache keeps the levels of detail of meshes, see pyV3D.lod, the same
+way.
+"""
+
+import os
+import struct
+import hashlib
+import logging
+import tempfile
+from threading import Lock
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Bump this whenever the encoder output changes, so that scenes cached on
+# disk by an older version are not served.
+FORMAT_VERSION = 1
+
+_MAGIC = b'PYV3DSC1'
+
+
+class SceneCache(object):
+    """An LRU cache of encoded scenes with an optional disk tier.
+
+    max_bytes: int
+        Budget for the frames held in memory. The least recently used
+        scenes are evicted to stay under it.
+
+    cache_dir: str
+        If given, scenes are also written to this directory and read back
+        from it when they are not in memory.
+
+    hash_content: bool
+        If True, files are identified by a hash of their content instead of
+        by their size and modification time.
+    """
+
+    suffix = '.wvc'  # of the files in cache_dir
+
+    def __init__(self, max_bytes=256*1024*1024, cache_dir=None,
+                 hash_content=False):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.hash_content = hash_content
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+        self.disk_writes = 0
+
+        self._scenes = OrderedDict()
+        self._lock = Lock()
+
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, fname, *params):
+        """Return the cache key for the scene built from file fname with
+        the given parameters, e.g. the sender class and the context
+        parameters of the wrapper.
+        """
+        fname = os.path.abspath(fname)
+        info = os.stat(fname)
+        if self.hash_content:
+            digest = hashlib.sha1()
+            with open(fname, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            ident = digest.hexdigest()
+        else:
+            ident = (info.st_size, info.st_mtime)
+
+        return hashlib.sha1(repr((FORMAT_VERSION, fname, ident) +
+                                 params).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return (init_frame, scene_frames) for key, or None."""
+        with self._lock:
+            scene = self._scenes.pop(key, None)
+            if scene is not None:
+                self._scenes[key] = scene
+                self.hits += 1
+                return scene
+
+        scene = self._read(key)
+        with self._lock:
+            if scene is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._add(key, scene)
+        return scene
+
+    def put(self, key, init_frame, scene_frames):
+        """Store the frames of a scene under key."""
+        scene = (init_frame, list(scene_frames))
+        with self._lock:
+            self._add(key, scene)
+        self._write(key, scene)
+
+    @contextmanager
+    def building(self, key):
+        """Hold off other processes sharing cache_dir from building the
+        scene of key, e.g. after get missed it, until the with block put it.
+        Yields the scene if another process wrote it in the meantime, and
+        None if it is still to be built. Without a cache_dir, or where
+        files can't be locked, nothing is held off.
+        """
+        if self.cache_dir is None or fcntl is None:
+            yield None
+            return
+
+        try:
+            f = open(self._path(key) + '.lock', 'a')
+        except (IOError, OSError) as err:
+            logging.warning("can't lock scene in cache: %s", err)
+            yield None
+            return
+        with f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                scene = self._read(key)
+                if scene is not None:
+                    with self._lock:
+                        # the miss of get turned out to be a hit
+                        self.misses -= 1
+                        self.hits += 1
+                        self.disk_hits += 1
+                        self._add(key, scene)
+                yield scene
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def clear(self):
+        """Drop every scene held in memory. The disk tier is left alone."""
+        with self._lock:
+            self._scenes.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Return the cache counters as a dict."""
+        with self._lock:
+            return {
+                'scenes': len(self._scenes),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'disk_hits': self.disk_hits,
+                'disk_writes': self.disk_writes,
+            }
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._scenes
+
+    def __len__(self):
+        return len(self._scenes)
+
+    def _add(self, key, scene):
+        """Add a scene to the memory tier. Must hold the lock."""
+        old = self._scenes.pop(key, None)
+        if old is not None:
+            self.nbytes -= self._size(old)
+
+        size = self._size(scene)
+        if size > self.max_bytes:
+            return
+
+        self._scenes[key] = scene
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._scenes.popitem(last=False)
+            self.nbytes -= self._size(evicted)
+            self.evictions += 1
+
+    def _size(self, scene):
+        return _scene_size(scene)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def _write(self, key, scene):
+        if self.cache_dir is None:
+            return
+
+        # write to a temporary file first so readers never see half a scene
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                self._dump(scene, f)
+            os.rename(tmpname, self._path(key))
+        except (IOError, OSError) as err:
+            logging.warning("can't write scene to cache: %s", err)
+            return
+        with self._lock:
+            self.disk_writes += 1
+
+    def _read(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                return self._load(f)
+        except (IOError, OSError):
+            return None
+
+    def _dump(self, scene, f):
+        frames = [scene[0]] + scene[1]
+        f.write(_MAGIC + struct.pack('<I%dQ' % len(frames), len(frames),
+                                     *[len(frame) for frame in frames]))
+        for frame in frames:
+            f.write(frame)
+
+    def _load(self, f):
+        """Return the scene in file f, or None if it is not a valid one."""
+        if f.read(len(_MAGIC)) != _MAGIC:
+            return None
+        try:
+            count = struct.unpack('<I', f.read(4))[0]
+            sizes = struct.unpack('<%dQ' % count, f.read(8*count))
+        except struct.error:
+            return None
+        frames = [f.read(size) for size in sizes]
+        if not frames or any(len(frame) != size
+                             for frame, size in zip(frames, sizes)):
+            return None
+        return frames[0], frames[1:]
+
+
+class LevelCache(SceneCache):
+    """An LRU cache of the levels of detail of meshes, as returned by
+    pyV3D.lod.build_levels, with an optional disk tier. It takes the same
+    arguments as SceneCache; max_bytes bounds the bytes of the level arrays
+    held in memory.
+    """
+
+    suffix = '.lod'
+
+    def put(self, key, levels):
+        """Store a list of (points, normals, tris) levels under key."""
+        levels = [tuple(level) for level in levels]
+        with self._lock:
+            self._add(key, levels)
+        self._write(key, levels)
+
+    def _size(self, levels):
+        return sum(array.nbytes for level in levels for array in level)
+
+    def _dump(self, levels, f):
+        arrays = dict(('level%d_%d' % (i, j), array)
+                      for i, level in enumerate(levels)
+                      for j, array in enumerate(level))
+        np.savez(f, count=len(levels), **arrays)
+
+    def _load(self, f):
+        try:
+            with np.load(f) as data:
+                return [tuple(data['level%d_%d' % (i, j)] for j in range(3))
+                        for i in range(int(data['count']))]
+        except (KeyError, ValueError):
+            return None
+
+
+def _scene_size(scene):
+    return len(scene[0]) + sum(len(f) for f in scene[1])
@@ -0,0 +1,325 @@
+"""
+A compact encoding of the frames made by the wv encoder, for viewers on
+slow links. It is spoken by viewers that ask for COMPACT_PROTOCOL
+instead of pyv3d-bin-1.0.
+
+Frames are rewritten message by message. Everything but the vertex,
+normal and color data of the GPrim stripes is passed on as it is, and the
+counts in front of the data keep their meaning, 3 per vertex, so a viewer
+always knows how many vertices a stripe has. In the compact encoding
+
+- vertices are quantized to 16 bits within the bounding box of their
+  stripe. The count is followed by the minimum and the step of each axis
+  as 6 float32, then by the uint16 coordinates, padded to 4 bytes.
+
+- triangle normals are octahedral, two int16 per vertex that are divided
+  by 32767, or two int8 divided by 127 if NORMALS_8BIT is set in the
+  message flags. A stripe whose normals are all the same gets just one
+  float32 normal and CONSTANT_NORMALS. If every three vertices in a row
+  share their normal, as the corners of facets from STL files do, only
+  every third normal is sent and FLAT_NORMALS is set.
+
+- a stripe whose colors are all the same gets just one color, padded to
+  4 bytes, and CONSTANT_COLORS.
+"""
+
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+COMPACT_PROTOCOL = 'pyv3d-bin-compact-1.0'
+
+# VBO types of the sections of a message
+VERTICES = 1
+INDICES = 2
+COLORS = 4
+NORMALS = 8
+
+# message flags of the compact encoding, next to the VBO types
+CONSTANT_NORMALS = 16
+CONSTANT_COLORS = 32
+NORMALS_8BIT = 64
+FLAT_NORMALS = 128
+
+_TRIANGLE = 2
+
+_U32 = struct.Struct('<I')
+_I32 = struct.Struct('<i')
+_HEAD = struct.Struct('<HBB')
+
+Message = namedtuple('Message', 'opcode stripe vflag gtype name start end '
+                                'sections')
+
+
+def compact_frames(frames, normal_bits=16):
+    """Return the compact version of a list of frames."""
+    return [compact_frame(frame, normal_bits) for frame in frames]
+
+
+def compact_frame(frame, normal_bits=16):
+    """Return the compact version of a frame made by the wv encoder.
+
+    normal_bits: int
+        16 or 8, the size of each of the two octahedral coordinates of a
+        normal.
+    """
+    if normal_bits not in (8, 16):
+        raise ValueError("normal_bits must be 8 or 16, not %r" % normal_bits)
+
+    out = []
+    last = 0
+    for msg in _messages(frame, False):
+        if msg.opcode not in (3, 4):
+            continue
+
+        vflag = msg.vflag
+        parts = []
+        for kind, count, start, size in msg.sections:
+            if kind == VERTICES:
+                body = _pack_vertices(_floats(frame, start, count))
+            elif kind == NORMALS and msg.gtype == _TRIANGLE:
+                flag, body = _pack_normals(_floats(frame, start, count),
+                                           normal_bits)
+                vflag |= flag
+            elif kind == COLORS:
+                flag, body = _pack_colors(
+                    np.frombuffer(frame, np.uint8, count, start))
+                vflag |= flag
+            else:
+                body = frame[start:start+size]
+            parts.append(_I32.pack(count))
+            parts.append(body)
+
+        header = msg.start + 8 + len(msg.name)
+        out.append(frame[last:msg.start+6])
+        out.append(struct.pack('B', vflag))
+        out.append(frame[msg.start+7:header])
+        out.extend(parts)
+        last = msg.end
+
+    if last == 0:
+        return frame
+    out.append(frame[last:])
+    return b''.join(out)
+
+
+def read_frame(frame, compact=False):
+    """Decode a frame, for tests and tools. Returns a list of
+    (Message, arrays) where arrays maps the VBO type of each section of
+    GPrim data messages to a numpy array: (n, 3) float32 vertices and
+    normals, (n, 3) uint8 colors and uint16 indices.
+
+    compact: bool
+        If True the frame is in the compact encoding.
+    """
+    result = []
+    for msg in _messages(frame, compact):
+        arrays = {}
+        for kind, count, start, size in msg.sections:
+            nvert = count // 3
+            if kind == INDICES:
+                data = np.frombuffer(frame, '<u2', count, start)
+            elif kind == COLORS:
+                if msg.vflag & CONSTANT_COLORS:
+                    data = np.tile(np.frombuffer(frame, np.uint8, 3, start),
+                                   (nvert, 1))
+                else:
+                    data = np.frombuffer(frame, np.uint8, count,
+                                         start).reshape(-1, 3)
+            elif compact and kind == VERTICES:
+                low = _floats(frame, start, 3)
+                step = _floats(frame, start+12, 3)
+                q = np.frombuffer(frame, '<u2', count, start+24)
+                data = (low + q.reshape(-1, 3)*step).astype(np.float32)
+            elif compact and kind == NORMALS and msg.gtype == _TRIANGLE:
+                if msg.vflag & CONSTANT_NORMALS:
+                    data = np.tile(_floats(frame, start, 3), (nvert, 1))
+                else:
+                    nsent = nvert
+                    if msg.vflag & FLAT_NORMALS:
+                        nsent //= 3
+                    if msg.vflag & NORMALS_8BIT:
+                        oct = np.frombuffer(frame, np.int8, 2*nsent, start)/127.
+                    else:
+                        oct = np.frombuffer(frame, '<i2', 2*nsent, start)/32767.
+                    data = _from_octahedral(oct)
+                    if msg.vflag & FLAT_NORMALS:
+                        data = np.repeat(data, 3, axis=0)
+            else:
+                data = _floats(frame, start, count).reshape(-1, 3)
+            arrays[kind] = data
+        result.append((msg, arrays))
+    return result
+
+
+def gprim_sizes(frame, compact=False):
+    """Return a dict that maps the name of each GPrim with messages in a
+    frame to the (bytes, messages) of them, without decoding their data.
+    """
+    sizes = {}
+    for msg in _messages(frame, compact):
+        if not msg.name:
+            continue
+        name = memoryview(msg.name).tobytes().split(b'\0', 1)[0]
+        nbytes, count = sizes.get(name, (0, 0))
+        sizes[name] = (nbytes + msg.end - msg.start, count + 1)
+    return sizes
+
+
+def _pad4(nbytes):
+    return nbytes + (-nbytes) % 4
+
+
+def _floats(frame, start, count):
+    return np.frombuffer(frame, '<f4', count, start)
+
+
+def _section_kinds(opcode, vflag):
+    """The VBO types of the sections of a GPrim data message, in order."""
+    if opcode == 4 or not vflag & VERTICES:
+        # an edit of one array, or the point or line indices of a stripe
+        for kind in (VERTICES, INDICES, COLORS, NORMALS):
+            if vflag & kind:
+                return [kind]
+        return []
+    return [kind for kind in (VERTICES, INDICES, COLORS, NORMALS)
+            if vflag & kind]
+
+
+def _section_size(kind, count, vflag, gtype, compact):
+    """Bytes of data following the count of a section."""
+    if kind == INDICES:
+        return _pad4(2*count)
+    if kind == COLORS:
+        if vflag & CONSTANT_COLORS:
+            return 4
+        return _pad4(count)
+    if compact and kind == VERTICES:
+        return 24 + _pad4(2*count)
+    if compact and kind == NORMALS and gtype == _TRIANGLE:
+        if vflag & CONSTANT_NORMALS:
+            return 12
+        nvert = count//3
+        if vflag & FLAT_NORMALS:
+            nvert //= 3
+        if vflag & NORMALS_8BIT:
+            return _pad4(2*nvert)
+        return 4*nvert
+    return 4*count
+
+
+def _messages(frame, compact):
+    """Walk the messages of a frame."""
+    pos = 0
+    end = len(frame)
+    while pos < end:
+        word, = _U32.unpack_from(frame, pos)
+        opcode = word >> 24
+        if opcode in (0, 7):        # continue, end of frame
+            yield Message(opcode, 0, 0, 0, b'', pos, pos+4, [])
+            pos += 4
+            continue
+        if opcode == 8:             # init
+            yield Message(opcode, 0, 0, 0, b'', pos, pos+52, [])
+            pos += 52
+            continue
+
+        name_len, vflag, gtype = _HEAD.unpack_from(frame, pos+4)
+        name = frame[pos+8:pos+8+name_len]
+        p = pos + 8 + name_len
+        sections = []
+        if opcode == 1:             # new GPrim
+            p += 20
+            if gtype > 0:
+                p += 40
+            if gtype > 1:
+                p += 12
+        elif opcode in (3, 4):      # new data, edit
+            for kind in _section_kinds(opcode, vflag):
+                count, = _I32.unpack_from(frame, p)
+                size = _section_size(kind, count, vflag, gtype, compact)
+                sections.append((kind, count, p+4, size))
+                p += 4 + size
+        elif opcode != 2:           # not a delete
+            raise ValueError("unknown opcode %d at byte %d" % (opcode, pos))
+
+        yield Message(opcode, word & 0xffffff, vflag, gtype, name, pos, p,
+                      sections)
+        pos = p
+
+
+def _pack_vertices(values):
+    xyz = values.reshape(-1, 3).astype(np.float64)
+    if len(xyz) == 0:
+        return b'\0'*24
+
+    low = xyz.min(axis=0).astype(np.float32)
+    step = ((xyz.max(axis=0) - low) / 65535.).astype(np.float32)
+    q = np.zeros(xyz.shape, dtype='<u2')
+    good = step > 0
+    if good.any():
+        q[:, good] = np.clip(np.rint((xyz[:, good] - low[good]) / step[good]),
+                             0, 65535)
+
+    data = q.tobytes()
+    return (low.astype('<f4').tobytes() + step.astype('<f4').tobytes() +
+            data + b'\0'*(_pad4(len(data)) - len(data)))
+
+
+def _pack_normals(values, bits):
+    normals = values.reshape(-1, 3)
+    if len(normals) and (normals == normals[0]).all():
+        return CONSTANT_NORMALS, normals[0].astype('<f4').tobytes()
+
+    flag = 0
+    if len(normals) % 3 == 0:
+        corners = normals.reshape(-1, 3, 3)
+        if (corners == corners[:, :1]).all():
+            flag = FLAT_NORMALS
+            normals = corners[:, 0]
+
+    oct = _to_octahedral(normals)
+    if bits == 8:
+        data = np.rint(oct*127.).astype(np.int8).tobytes()
+        return (flag | NORMALS_8BIT,
+                data + b'\0'*(_pad4(len(data)) - len(data)))
+    return flag, np.rint(oct*32767.).astype('<i2').tobytes()
+
+
+def _pack_colors(values):
+    colors = values.reshape(-1, 3)
+    if len(colors) and (colors == colors[0]).all():
+        return CONSTANT_COLORS, colors[0].tobytes() + b'\0'
+    data = values.tobytes()
+    return 0, data + b'\0'*(_pad4(len(data)) - len(data))
+
+
+def _to_octahedral(normals):
+    """Map unit vectors onto the [-1, 1] square of an octahedron that is
+    unfolded along its lower half."""
+    n = normals.astype(np.float64)
+    l1 = np.abs(n).sum(axis=1)
+    l1[l1 == 0] = 1.0
+    n /= l1[:, None]
+
+    x, y, z = n.T
+    sx = np.where(x >= 0, 1.0, -1.0)
+    sy = np.where(y >= 0, 1.0, -1.0)
+    lower = z < 0
+    return np.column_stack((np.where(lower, (1 - np.abs(y))*sx, x),
+                            np.where(lower, (1 - np.abs(x))*sy, y)))
+
+
+def _from_octahedral(values):
+    xy = values.reshape(-1, 2)
+    x = xy[:, 0].copy()
+    y = xy[:, 1].copy()
+    z = 1 - np.abs(x) - np.abs(y)
+    t = np.clip(-z, 0, None)
+    x -= np.where(x >= 0, t, -t)
+    y -= np.where(y >= 0, t, -t)
+
+    n = np.column_stack((x, y, z))
+    n /= np.sqrt((n*n).sum(axis=1))[:, None]
+    return n.astype(np.float32)
@@ -0,0 +1,165 @@
+"""
+Compression of the binary frames sent to viewers.
+
+A Codec compresses each frame on its own, so that a scene compressed once
+can be sent to any number of viewers.
+
+- 'deflate' frames are sent as permessage-deflate messages (RFC 7692), so
+  browsers that negotiated that extension decompress them without help.
+  A fresh compressor is used per frame, which is valid whether or not the
+  viewer keeps its context between messages.
+
+- 'zstd' and 'lz4' frames are zstandard or LZ4 frames, for viewers that
+  ask for them by appending '+zstd' or '+lz4' to their subprotocol. Frames
+  below the minimum size go out as they are. A viewer tells them apart by
+  the codec's magic number, which never starts a wv message: the fourth
+  byte of a wv message is its opcode, at most 8.
+
+zstd and lz4 need the zstandard and lz4 packages.
+"""
+
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+# default compression level of each codec
+CODECS = {
+    'deflate': 6,
+    'zstd': 3,
+    'lz4': 0,
+}
+
+_DEFLATE_TAIL = b'\x00\x00\xff\xff'
+
+# time spent compressing, per thread where the platform can tell
+_clock = getattr(time, 'thread_time', time.time)
+
+
+class Deflated(bytes):
+    """A frame for a permessage-deflate connection. It is written as it is,
+    with the RSV1 bit set if compressed is True.
+    """
+
+    def __new__(cls, data, compressed):
+        frame = super(Deflated, cls).__new__(cls, data)
+        frame.compressed = compressed
+        return frame
+
+
+class Codec(object):
+    """Compresses the binary frames sent to viewers.
+
+    name: str
+        'deflate', 'zstd' or 'lz4'.
+
+    level: int
+        Compression level, the codec's default if None.
+
+    min_size: int
+        Frames smaller than this are sent uncompressed.
+
+    offload_size: int
+        Broadcasts made on the IOLoop with at least this many bytes to
+        compress are compressed on a worker thread.
+    """
+
+    def __init__(self, name='deflate', level=None, min_size=1024,
+                 offload_size=256*1024):
+        if name not in CODECS:
+            raise ValueError("unknown codec %r, use one of %s" %
+                             (name, ', '.join(sorted(CODECS))))
+        if name == 'zstd' and zstandard is None:
+            raise ImportError("the zstd codec needs the zstandard package")
+        if name == 'lz4' and lz4frame is None:
+            raise ImportError("the lz4 codec needs the lz4 package")
+
+        self.name = name
+        self.level = CODECS[name] if level is None else level
+        self.min_size = min_size
+        self.offload_size = offload_size
+
+    def compress_frames(self, frames):
+        """Return the compressed frames and the seconds it took."""
+        start = _clock()
+        if self.name == 'deflate':
+            result = [self._deflate(frame) for frame in frames]
+        elif self.name == 'zstd':
+            # compressor objects may not be shared between threads
+            compressor = zstandard.ZstdCompressor(level=self.level)
+            result = [frame if len(frame) < self.min_size else
+                      compressor.compress(frame) for frame in frames]
+        else:
+            result = [frame if len(frame) < self.min_size else
+                      lz4frame.compress(frame, compression_level=self.level)
+                      for frame in frames]
+        return result, _clock() - start
+
+    def decompress(self, frame):
+        """Return the original of a frame, for tests and tools."""
+        if self.name == 'deflate':
+            if not frame.compressed:
+                return bytes(frame)
+            return zlib.decompressobj(-zlib.MAX_WBITS).decompress(
+                frame + _DEFLATE_TAIL)
+        if self.name == 'zstd':
+            if frame[:4] != b'\x28\xb5\x2f\xfd':
+                return frame
+            return zstandard.ZstdDecompressor().decompress(frame)
+        if frame[:4] != b'\x04\x22\x4d\x18':
+            return frame
+        return lz4frame.decompress(frame)
+
+    def _deflate(self, frame):
+        if len(frame) < self.min_size:
+            return Deflated(frame, False)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                      -zlib.MAX_WBITS)
+        data = compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return Deflated(data[:-len(_DEFLATE_TAIL)], True)
+
+
+class CompressionStats(object):
+    """Bytes sent to a viewer before and after compression, and the time
+    spent compressing them. Frames shared with other viewers count in full.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self.seconds = 0.0
+
+    def add(self, messages, raw_bytes, sent_bytes, seconds):
+        self.messages += messages
+        self.raw_bytes += raw_bytes
+        self.sent_bytes += sent_bytes
+        self.seconds += seconds
+
+    @property
+    def ratio(self):
+        if self.sent_bytes == 0:
+            return 1.0
+        return float(self.raw_bytes) / self.sent_bytes
+
+    def as_dict(self):
+        return {
+            'messages': self.messages,
+            'raw_bytes': self.raw_bytes,
+            'sent_bytes': self.sent_bytes,
+            'ratio': self.ratio,
+            'seconds': self.seconds,
+        }
+
+    def __str__(self):
+        return "%d messages, %d bytes sent as %d (%.2fx) in %.3f s" % (
+            self.messages, self.raw_bytes, self.sent_bytes, self.ratio,
+            self.seconds)
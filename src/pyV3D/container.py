@@ -0,0 +1,266 @@
+"""
+Scene containers: files holding a scene already encoded by wv, so that it
+can be served without loading or encoding anything when a viewer opens it.
+
+A container holds the init frame and the frames of the full GPrim suite,
+exactly as WS_WV_Wrapper broadcasts them, plus an index of the GPrims in
+them and the parameters of the context they were encoded with. It is laid
+out as
+
+  magic           8 bytes, PYV3DSC2
+  index offset    uint64, little endian
+  index size      uint64
+  frames          one after the other
+  index           JSON, utf-8
+
+and the index is a dict with
+
+  version         FORMAT_VERSION of pyV3D.cache when it was written
+  source, sender  what the scene was compiled from, and with what
+  context         the context parameters, see WV_Wrapper.context_params
+  focus           the focus the points were scaled with
+  init, frames    (offset, size) of the init frame and of each frame
+  gprims          per GPrim its name, gtype, bbox, the maxima and then the
+                  minima of its vertices as sent, its bytes, and the
+                  (offset, size) of each run of its messages
+
+Offsets count from the start of the file. compile_scene writes containers,
+SceneContainer maps them and ContainerSender serves them.
+"""
+
+import os
+import json
+import struct
+import tempfile
+
+import numpy as np
+
+from pyV3D.cache import FORMAT_VERSION
+from pyV3D.compact import VERTICES, read_frame
+from pyV3D.handler import WS_WV_Wrapper
+from pyV3D.sender import WV_Sender
+from pyV3D.stl import STLSender, STLGeometryObject
+from pyV3D.assembly import STLAssemblySender
+
+SUFFIX = '.wvs'
+
+_MAGIC = b'PYV3DSC2'
+_HEADER = struct.Struct('<8sQQ')
+
+
+class _ContainerWriter(object):
+    """A send_GPrim callback that writes frames to a container file and
+    indexes the GPrims in them as they go by.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = _HEADER.size
+        self.frames = []
+        self.gprims = {}
+        self.order = []
+
+    def __call__(self, wsi, buf, ibuf):
+        self.write(buf[:ibuf].tobytes())
+        return 0
+
+    def write(self, frame):
+        self.f.write(frame)
+        self.frames.append([self.offset, len(frame)])
+        for msg, arrays in read_frame(frame):
+            if msg.name:
+                self._add(msg, arrays.get(VERTICES))
+        self.offset += len(frame)
+
+    def _add(self, msg, xyz):
+        name = msg.name.split(b'\0', 1)[0].decode('utf-8')
+        gprim = self.gprims.get(name)
+        if gprim is None:
+            gprim = self.gprims[name] = {'name': name, 'gtype': msg.gtype,
+                                         'bbox': None, 'bytes': 0,
+                                         'ranges': []}
+            self.order.append(name)
+
+        start = self.offset + msg.start
+        size = msg.end - msg.start
+        gprim['bytes'] += size
+        ranges = gprim['ranges']
+        if ranges and ranges[-1][0] + ranges[-1][1] == start:
+            ranges[-1][1] += size
+        else:
+            ranges.append([start, size])
+
+        if xyz is not None and len(xyz):
+            bbox = np.concatenate([xyz.max(axis=0), xyz.min(axis=0)])
+            if gprim['bbox'] is not None:
+                old = gprim['bbox']
+                bbox[:3] = np.maximum(bbox[:3], old[:3])
+                bbox[3:] = np.minimum(bbox[3:], old[3:])
+            gprim['bbox'] = bbox
+
+    def index(self):
+        """Return the frames and GPrims of the index, the init frame
+        first."""
+        gprims = []
+        for name in self.order:
+            gprim = self.gprims[name]
+            if gprim['bbox'] is not None:
+                gprim['bbox'] = [float(v) for v in gprim['bbox']]
+            gprims.append(gprim)
+        return self.frames, gprims
+
+
+def compile_scene(source, output=None, buffer_size=None, **options):
+    """Load source, an STL file or an assembly of them as taken by
+    STLAssemblySender, encode it and write it to the container output.
+    Returns the name of the container.
+
+    output: str
+        Name of the container, by default that of source with SUFFIX in
+        place of its extension.
+
+    buffer_size: int
+        The most bytes of the scene in one frame, see WS_WV_Wrapper.
+
+    options:
+        weld, tolerance and edges, see STLGeometryObject.
+    """
+    if output is None:
+        if STLAssemblySender.supports(source) and not os.path.isdir(source):
+            raise ValueError("give the name of the container of %s" % source)
+        output = os.path.splitext(source.rstrip(os.sep))[0] + SUFFIX
+
+    # the geometry is not needed once it's encoded
+    wv = WS_WV_Wrapper(buffer_size=buffer_size)
+    wv.ownership = 'adopt'
+    if STLAssemblySender.supports(source):
+        sender = STLAssemblySender(wv, **options)
+        sender.geom_from_file(source)
+    else:
+        sender = STLSender(wv)
+        sender.geom_from_obj(STLGeometryObject(source, **options))
+
+    dirname = os.path.dirname(os.path.abspath(output))
+    fd, tmpname = tempfile.mkstemp(dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, 0, 0))
+            writer = _ContainerWriter(f)
+            # the init frame and the full suite, as late joiners get them
+            wv.prepare_for_sends()
+            try:
+                writer.write(wv._encode(1)[0])
+                wv.send_GPrim(wv, -1, writer)
+            finally:
+                wv.finish_sends()
+
+            frames, gprims = writer.index()
+            index = json.dumps({
+                'version': FORMAT_VERSION,
+                'source': os.path.abspath(source),
+                'sender': type(sender).__name__,
+                'context': _jsonable(wv.context_params),
+                'focus': [float(v) for v in wv.focus],
+                'init': frames[0],
+                'frames': frames[1:],
+                'gprims': gprims,
+            }).encode('utf-8')
+            f.write(index)
+            f.seek(0)
+            f.write(_HEADER.pack(_MAGIC, writer.offset, len(index)))
+        os.rename(tmpname, output)
+    except Exception:
+        os.unlink(tmpname)
+        raise
+    return output
+
+
+def _jsonable(params):
+    if isinstance(params, (tuple, list)):
+        return [_jsonable(p) for p in params]
+    return float(params)
+
+
+class SceneContainer(object):
+    """A container written by compile_scene, mapped into memory. Frames
+    are read from the file as they are sent, nothing is decoded.
+
+    fname: str
+        Name of the container.
+
+    Attributes are init_frame and scene_frames, read-only uint8 arrays
+    backed by the file, and index, the dict described in the module
+    docstring.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, 'rb') as f:
+            head = f.read(_HEADER.size)
+            if len(head) != _HEADER.size:
+                raise ValueError("%s is not a scene container" % fname)
+            magic, offset, size = _HEADER.unpack(head)
+            if magic != _MAGIC:
+                raise ValueError("%s is not a scene container" % fname)
+            f.seek(offset)
+            index = f.read(size)
+        if len(index) != size:
+            raise ValueError("%s is truncated" % fname)
+        self.index = json.loads(index.decode('utf-8'))
+        if self.index.get('version') != FORMAT_VERSION:
+            raise ValueError("%s was written by another version of "
+                                 "pyV3D, compile it again" % fname)
+
+        self.data = np.memmap(fname, dtype=np.uint8, mode='r')
+        self.init_frame = self._frame(self.index['init'])
+        self.scene_frames = [self._frame(f) for f in self.index['frames']]
+
+    def _frame(self, entry):
+        offset, size = entry
+        return self.data[offset:offset+size]
+
+    @property
+    def context_params(self):
+        return tuple(tuple(p) if isinstance(p, list) else p
+                     for p in self.index['context'])
+
+    def gprims(self):
+        """Return the index entries of the GPrims, in the order they were
+        first sent."""
+        return self.index['gprims']
+
+    def gprim_data(self, name):
+        """Return the bytes of the messages of GPrim name, as they are in
+        the frames."""
+        for gprim in self.index['gprims']:
+            if gprim['name'] == name:
+                return b''.join(self.data[offset:offset+size].tobytes()
+                                for offset, size in gprim['ranges'])
+        raise KeyError(name)
+
+
+class ContainerSender(WV_Sender):
+    """Sends the scene of a container written by compile_scene, as it is.
+    Scenes from containers are never put in a SceneCache, they are on
+    disk already.
+    """
+
+    pre_encoded = True
+
+    def initialize(self, **kwargs):
+        self.container = None
+
+    @staticmethod
+    def supports(obj):
+        return isinstance(obj, basestring) and obj.lower().endswith(SUFFIX)
+
+    def send(self, obj, first=False):
+        if self.container is None or self.container.fname != obj:
+            self.container = SceneContainer(obj)
+        container = self.container
+        self.wv.context_params = container.context_params
+        self.wv.send_frames(container.init_frame, container.scene_frames)
+
+    def on_close(self):
+        super(ContainerSender, self).on_close()
+        self.container = None
@@ -1,58 +1,538 @@
 import os
+import json
+import time
+import zlib
+import struct
 import traceback
-from threading import Lock
+from threading import Lock, RLock
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from tornado import websocket
+import numpy as np
+from tornado import gen, web, websocket
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
 
 from pyV3D._pyV3D import WV_Wrapper
 from pyV3D.cube import CubeGeometry
+from pyV3D.compact import COMPACT_PROTOCOL, compact_frames
+from pyV3D.compress import CompressionStats, Deflated
+from pyV3D.spatial import BVH, Camera, view_order
+from pyV3D.stats import ConnectionStats, PipelineStats, timed
+
+BINARY_PROTOCOL = 'pyv3d-bin-1.0'
+
+# writes smaller than this say little about the speed of a viewer
+MIN_MEASURED_WRITE = 64*1024
+
+# compresses, in order, the frames of broadcasts made on an IOLoop
+_compress_executor = ThreadPoolExecutor(max_workers=1)
+
+# runs the steps of WS_WV_Wrapper.repeat_later, e.g. the sends of the finer
+# levels of detail, of all wrappers in turn
+_repeat_executor = ThreadPoolExecutor(max_workers=1)
+
 
 class WS_WV_Wrapper(WV_Wrapper):
     """A wrapper for the wv library that is used by a Sender to
     send updates out over a WebSocket.
+
+    Any number of WebSocket handlers can view the same wrapper. Each update
+    is encoded once and the resulting frames are broadcast to all of them.
+    The frames of the most recent full scene are kept so that handlers
+    joining later can be brought up to date without encoding again.
+
+    max_pending: int
+        Number of bytes a handler may still have waiting to go out when a
+        new broadcast starts. Handlers that fall further behind are closed,
+        which keeps a slow browser from stalling the others or holding on
+        to an unbounded number of old frames. They can reconnect and will
+        be sent the cached scene.
+
+    io_loop: IOLoop
+        The loop the handlers live on. Sends may then run on other threads,
+        e.g. on WSHandler.executor, and only the writing of the finished
+        frames is handed back to this loop.
+
+    normal_bits: int
+        Size of the octahedral normal coordinates sent to handlers of
+        COMPACT_PROTOCOL, 16 or 8. Those handlers get the frames rewritten
+        by pyV3D.compact; the scene is only rewritten once for all of them.
+
+    compression: Codec
+        If given, handlers whose codec attribute names it get compressed
+        frames. The scene is compressed once for all of them, and large
+        broadcasts made on io_loop are compressed on a worker thread.
+
+    buffer_size: int
+        The most bytes of a scene that go in one frame, the wv default of
+        about 3 MB if None.
+
+    flush_seconds: float
+        Frames are cut to about this many seconds' worth of the measured
+        throughput of the slowest viewer, but not below min_flush_size, so
+        a slow viewer starts drawing early and is not sent more at once than
+        it can take. Viewers that were not measured yet get frames of
+        buffer_size.
+
+    stats: PipelineStats
+        If given, the time spent in each step from loading geometry to
+        writing it to the viewers is collected in it, see pyV3D.stats.
+
+    Setting send_order to 'view' sends the GPrims in the view of camera,
+    or of the context if no viewer sent a camera yet, first, largest on
+    the screen first, and the rest after them, see pyV3D.spatial. The
+    GPrims sent first go out while the others are still being encoded.
     """
     
-    def __init__(self):
-        super(WS_WV_Wrapper, self).__init__()
-        self.handlers = {}
+    min_flush_size = 64*1024
+
+    # None for the order of the GPrim table, or 'view'
+    send_order = None
+    # the Camera of the last camera message, see WV_Sender.on_message
+    camera = None
+    # GPrims smaller than this many pixels across are deferred
+    min_pixels = 1.0
+
+    def __init__(self, max_pending=64*1024*1024, io_loop=None,
+                 normal_bits=16, compression=None, buffer_size=None,
+                 flush_seconds=0.25, stats=None):
+        super(WS_WV_Wrapper, self).__init__(buffer_size)
+        self.stats = stats
+        self.flush_seconds = flush_seconds
+        self.handlers = {}  # map of protocol to list of handlers
+        self.max_pending = max_pending
+        self.io_loop = io_loop
+        self.normal_bits = normal_bits
+        self.compression = compression
+        self.init_frame = None
+        self.scene_frames = []
+        self._frames = []
+        self._lock = RLock()  # one thread at a time uses the encoder
+        self._joining = set() # handlers that are about to join, see expect
+        self._join_lock = Lock()
+        self._bvh = None      # of the GPrim boxes last ordered by view
+        self._pending = 0     # broadcasts waiting on _compress_executor
+        self._pending_lock = Lock()
+
+    @property
+    def scene_frames(self):
+        return self._scene_frames
+
+    @scene_frames.setter
+    def scene_frames(self, frames):
+        self._scene_frames = frames
+        self._scene_variants = {}
 
     def send(self, first=False):
-        self.prepare_for_sends()
+        with self._lock:
+            self.prepare_for_sends()
+
+            # other threads changing GPrims wait until finish_sends
+            try:
+                frames = []
+                scene = []
+                phases = self._phases()
+                if first:
+                    # send init packet
+                    frames.extend(self._encode(1, phases[0]))
+                    self.init_frame = frames[0] if frames else None
+                # send initial suite of GPrims, broadcasting a phase while
+                # the next one is encoded
+                for order in phases:
+                    if frames:
+                        self.broadcast(frames)
+                    frames = self._encode(-1, order)
+                    scene.extend(frames)
+                self.scene_frames = scene
+            finally:
+                self.finish_sends()
+
+            self.broadcast(frames)
+
+    def send_updates(self):
+        """Send only the GPrims that were changed since the last send, e.g.
+        by update_primitives.
+        """
+        with self._lock:
+            self.begin_sends()
+            try:
+                frames = []
+                changed = False
+                for order in self._phases():
+                    if frames:
+                        self.broadcast(frames)
+                    frames = self._encode(0, order)
+                    changed = changed or bool(frames)
+            finally:
+                self.finish_sends()
+
+            # the cached scene no longer matches, it's encoded again when the
+            # next viewer joins
+            if changed:
+                self.scene_frames = None
+            self.broadcast(frames)
+
+    def repeat_later(self, step):
+        """Call step until it returns False. With an io_loop that is done on
+        a worker thread, so the send that asks for it returns first, and
+        each call holds the encoder lock: viewers joining in between wait
+        for one call at most and are sent the scene as it is then. Senders
+        use this to send the finer levels of detail after the coarsest, see
+        WV_Sender.refine.
+        """
+        if self.io_loop is None:
+            while step():
+                pass
+            return
+
+        def repeat():
+            try:
+                with self._lock:
+                    again = step()
+            except Exception:
+                logging.error('Exception: %s' % traceback.format_exc())
+                return
+            if again:
+                _repeat_executor.submit(repeat)
+
+        _repeat_executor.submit(repeat)
+
+    def flush_size(self):
+        rates = [getattr(h, 'throughput', None) for handlers in
+                 list(self.handlers.values()) for h in list(handlers)]
+        rates = [rate for rate in rates if rate]
+        if not rates:
+            return self.buffer_size
+        size = int(min(rates)*self.flush_seconds)
+        return min(max(size, self.min_flush_size), self.buffer_size)
+
+    def _encode(self, flag, order=None):
+        """Run the encoder and return the frames it produced."""
+        self._frames = []
+        try:
+            self.send_GPrim(self, flag, self.send_binary_data, order)
+            return self._frames
+        finally:
+            self._frames = []
 
-        if first:
-            self.send_GPrim(self, 1, self.send_binary_data)  # send init packet
-            self.send_GPrim(self, -1, self.send_binary_data)  # send initial suite of GPrims
-        else:  
-            self.send_GPrim(self, -1, self.send_binary_data)  # send initial suite of GPrims
+    def _phases(self):
+        """Return the orders to encode the GPrims in, one after the other:
+        [None] for that of the GPrim table, or those sent first and those
+        deferred by send_order 'view'.
+        """
+        if self.send_order != 'view':
+            return [None]
+        camera = self.camera
+        if camera is None:
+            params = getattr(self, 'context_params', None)
+            if params is None:
+                return [None]
+            camera = Camera.from_context(params)
 
-        self.finish_sends()
+        boxes, deleted = self.gprim_boxes()
+        if self._bvh is None or not np.array_equal(self._bvh.boxes, boxes):
+            self._bvh = BVH(boxes)
+        first, deferred = view_order(boxes, camera, self.min_pixels,
+                                     deleted, self._bvh)
+        return [first, deferred] if len(deferred) else [first]
         
     def open(self, handler):
-        if handler._protocol in self.handlers:
-            raise RuntimeError("a handler for protocol %s is already registered to this wrapper" % handler._protocol)
-        self.handlers[handler._protocol] = handler
+        handlers = self.handlers.setdefault(handler._protocol, [])
+        if handler in handlers:
+            raise RuntimeError("handler is already registered to this wrapper")
+        handlers.append(handler)
+
+    def close(self, handler):
+        """Stop sending to handler. Returns the number of handlers that are
+        still registered or about to join.
+        """
+        with self._join_lock:
+            self._joining.discard(handler)
+            handlers = self.handlers.get(handler._protocol, [])
+            if handler in handlers:
+                handlers.remove(handler)
+            return (sum(len(h) for h in self.handlers.values()) +
+                    len(self._joining))
+
+    def expect(self, handler):
+        """Count handler as a viewer from now on, though its join runs
+        later, e.g. on an executor, so that close does not report the
+        wrapper as unused in the meantime.
+        """
+        with self._join_lock:
+            self._joining.add(handler)
+
+    def join(self, handler, send_first=None, expected=False):
+        """Register handler and bring it up to date: it gets the cached
+        scene or, if nothing was sent yet, send_first is called to do the
+        initial send. Viewers joining at the same time are handled one
+        after the other, so none of them gets the scene twice.
+
+        expected: bool
+            True if expect was called for handler. If it was closed since,
+            it is not registered. Returns whether it was.
+        """
+        with self._lock:
+            with self._join_lock:
+                if expected:
+                    if handler not in self._joining:
+                        return False
+                    self._joining.discard(handler)
+                self.open(handler)
+            if not self.send_cached(handler) and send_first is not None:
+                send_first()
+            return True
+
+    def send_frames(self, init_frame, scene_frames):
+        """Broadcast a scene that was encoded earlier, e.g. one from a
+        SceneCache or a scene container, and keep it for late joiners.
+        """
+        with self._lock:
+            self.init_frame = init_frame
+            self.scene_frames = list(scene_frames)
+            self.broadcast([self.init_frame] + self.scene_frames)
+
+    def send_cached(self, handler):
+        """Send the cached scene to a handler that joined after it was
+        encoded. Returns False if there is nothing cached yet.
+        """
+        with self._lock:
+            if self.init_frame is None:
+                return False
+            if self.scene_frames is None:
+                self.begin_sends()
+                try:
+                    self.scene_frames = [frame for order in self._phases()
+                                         for frame in self._encode(-1, order)]
+                finally:
+                    self.finish_sends()
+            self.broadcast([self.init_frame] + self.scene_frames, [handler])
+            return True
+
+    def broadcast(self, frames, handlers=None):
+        """Write frames to every binary protocol handler, or to the given
+        handlers. Called from a thread other than that of io_loop, the
+        writes are queued on io_loop, in order, and this returns at once.
+        """
+        if handlers is None:
+            handlers = (self.handlers.get(BINARY_PROTOCOL, []) +
+                        self.handlers.get(COMPACT_PROTOCOL, []))
+        handlers = list(handlers)
+
+        on_loop = (self.io_loop is None or
+                   IOLoop.current(instance=False) is self.io_loop)
+
+        # compressing large frames would hold up the IOLoop, so that's done
+        # on a worker thread. Later broadcasts queue up behind it to keep
+        # the frames in order.
+        with self._pending_lock:
+            queue = self._pending or (on_loop and self.io_loop is not None and
+                                      self._offload(frames, handlers))
+            if queue:
+                self._pending += 1
+        if queue:
+            future = _compress_executor.submit(self._variants, frames, handlers)
+            self.io_loop.add_future(future,
+                                    lambda f: self._write_queued(f, handlers))
+            return
+
+        # rewrite the frames for compact viewers here, off the IOLoop
+        variants = self._variants(frames, handlers)
+        if not on_loop:
+            self.io_loop.add_callback(self._write, variants, handlers)
+            return
+        self._write(variants, handlers)
+
+    def _encoding(self, handler):
+        """Return the (compact, codec) pair of the frames handler gets."""
+        codec = getattr(handler, 'codec', None)
+        if self.compression is None or codec != self.compression.name:
+            codec = None
+        return (handler._protocol == COMPACT_PROTOCOL, codec)
+
+    def _offload(self, frames, handlers):
+        if self.compression is None:
+            return False
+        if all(self._encoding(h) == (False, None) for h in handlers):
+            return False
+        return sum(len(frame) for frame in frames) >= \
+               self.compression.offload_size
+
+    def _variants(self, frames, handlers):
+        """Return a dict that maps the encoding of each handler to the
+        frames in that encoding, their size before and after compression and
+        the seconds spent compressing them. If frames end with the cached
+        scene, its encodings are kept for the next time.
+        """
+        keys = set(self._encoding(handler) for handler in handlers)
+        with self._lock:
+            scene = self.scene_frames or []
+            nhead = len(frames) - len(scene)
+            cached = bool(scene) and nhead >= 0 and \
+                     all(a is b for a, b in zip(frames[nhead:], scene))
+            if not cached:
+                nhead = len(frames)
+            head = frames[:nhead]
+
+            memo = {}
+            variants = {}
+            for key in keys:
+                spent = [0.0]
+                result = self._convert(head, key, memo, spent)
+                raw = self._convert(head, (key[0], None), memo, spent)
+                if cached:
+                    result = result + self._convert(
+                        scene, key, self._scene_variants, spent)
+                    raw = raw + self._convert(
+                        scene, (key[0], None), self._scene_variants, spent)
+                variants[key] = (result, sum(len(f) for f in raw),
+                                 sum(len(f) for f in result), spent[0])
+            return variants
+
+    def _convert(self, frames, key, memo, spent):
+        """Return frames in the encoding key, using and filling memo.
+        Seconds spent compressing are added to spent[0].
+        """
+        if key not in memo:
+            compact, codec = key
+            if codec is not None:
+                memo[key], seconds = self.compression.compress_frames(
+                    _as_bytes(self._convert(frames, (compact, None), memo,
+                                            spent)))
+                spent[0] += seconds
+            elif compact:
+                memo[key] = compact_frames(_as_bytes(frames), self.normal_bits)
+            else:
+                memo[key] = frames
+        return memo[key]
+
+    def _write_queued(self, future, handlers):
+        with self._pending_lock:
+            self._pending -= 1
+        self._write(future.result(), handlers)
+
+    def _write(self, variants, handlers):
+        with timed(self.stats, 'write') as timer:
+            for handler in handlers:
+                pending = getattr(handler, 'pending_bytes', 0)
+                if pending > self.max_pending:
+                    logging.warning("closing a viewer that is %d bytes behind",
+                                    pending)
+                    self.close(handler)
+                    handler.close()
+                    continue
+                frames, raw, sent, seconds = variants[self._encoding(handler)]
+                try:
+                    for frame in frames:
+                        handler.write_binary(frame)
+                except Exception as err:
+                    logging.error("Exception in broadcast: %s", err)
+                    self.close(handler)
+                    continue
+                timer.count(sent, len(frames))
+                stats = getattr(handler, 'compression_stats', None)
+                if stats is not None:
+                    stats.add(len(frames), raw, sent, seconds)
 
     def send_binary_data(self, wsi, buf, ibuf):
         """This is called multiple times during the sending of a 
-        set of graphics primitives.
+        set of graphics primitives. buf is only valid during the call, so
+        a copy of it is kept for broadcasting.
         """
-        try:
-            handler = self.handlers['pyv3d-bin-1.0']
-        except KeyError:
-            raise RuntimeError("Can't send binary data. No registred binary protocol handler")
-        try:
-            handler.write_message(buf, binary=True)
-        except Exception as err:
-            logging.error("Exception in send_binary_data: %s", err)
-            return -1
+        self._frames.append(buf.tobytes())
         return 0
 
 
+def _as_bytes(frames):
+    """Return frames as strings, e.g. those mapped from a scene container,
+    which are only copied where they are rewritten."""
+    return [frame if isinstance(frame, bytes) else memoryview(frame).tobytes()
+            for frame in frames]
+
+
+def _binary_frame_header(length, compressed=False):
+    """Return the header of an unmasked, final, binary WebSocket frame
+    carrying length bytes of payload. compressed sets the RSV1 bit of
+    permessage-deflate.
+    """
+    first = 0xC2 if compressed else 0x82
+    if length < 126:
+        return struct.pack("!BB", first, length)
+    elif length <= 0xFFFF:
+        return struct.pack("!BBH", first, 126, length)
+    return struct.pack("!BBQ", first, 127, length)
+
+
+def _writes_frames(conn):
+    """Return whether write_binary_frame can write whole frames to conn
+    itself: an unmasked tornado connection with a stream and the byte
+    counters tornado keeps. Connections of tornado versions without them go
+    through write_message.
+    """
+    return (getattr(conn, 'stream', None) is not None and
+            not getattr(conn, 'mask_outgoing', True) and
+            hasattr(conn, '_message_bytes_out') and
+            hasattr(conn, '_wire_bytes_out'))
+
+
+def _shares_deflate(conn, compression):
+    """Return whether the viewer of conn can be sent the deflated frames
+    of compression: it negotiated permessage-deflate with a full size
+    window and write_binary_frame writes its frames. What was negotiated is
+    only known to tornado's compressor, so connections of tornado versions
+    without its attributes don't share the deflated frames.
+    """
+    compressor = getattr(conn, '_compressor', None)
+    return (compressor is not None and compression is not None and
+            compression.name == 'deflate' and _writes_frames(conn) and
+            hasattr(compressor, '_compressor') and
+            getattr(compressor, '_max_wbits', None) == zlib.MAX_WBITS)
+
+
+def write_binary_frame(conn, data):
+    """Write data, any object supporting the buffer protocol, to the
+    websocket connection conn as a single binary message.
+
+    Unless data already is a string it is copied once, so the caller may
+    reuse its memory as soon as this returns. Uncompressed connections get
+    the frame header and the payload as two separate stream writes, which
+    saves tornado from copying the payload again to append it to the
+    header. Other connections go through the regular write_message path,
+    except for Deflated frames, which are already compressed for them.
+    """
+    if isinstance(data, bytes):
+        payload = data
+    else:
+        payload = memoryview(data).tobytes()
+
+    deflated = isinstance(data, Deflated)
+    if not _writes_frames(conn) or (
+            not deflated and getattr(conn, '_compressor', None) is not None):
+        if deflated and data.compressed:
+            raise RuntimeError("can't write a deflated frame to %r" % conn)
+        return conn.write_message(payload, binary=True)
+
+    header = _binary_frame_header(len(payload), deflated and data.compressed)
+    conn._message_bytes_out += len(payload)
+    conn._wire_bytes_out += len(header) + len(payload)
+    try:
+        conn.stream.write(header)
+        return conn.stream.write(payload)
+    except StreamClosedError:
+        raise websocket.WebSocketClosedError()
+
+
 class WSHandler(websocket.WebSocketHandler):
 
     subhandlers = {}   # map of obj pathname or file pathname to subhandler instance
     protocols   = {}   # map of protocols to lists of supporting subhandlers
+    scene_cache = None # optional SceneCache of encoded files
+    compression = None # optional Codec for the binary frames
+    collect_stats = False # collect pyV3D.stats of wrappers and viewers
+
+    # loads and encodes geometry so the IOLoop stays free for other viewers
+    executor = ThreadPoolExecutor(max_workers=4)
 
     _lock = Lock()
 
@@ -62,6 +542,18 @@ class WSHandler(websocket.WebSocketHandler):
         self.subhandler = None
         self.fname = None
         self.objname = None
+        self.pending_bytes = 0  # bytes written but not yet sent
+        self.throughput = None  # measured bytes per second
+        self._last_sent = 0.0   # when the last write went out
+        self.codec = None       # name of the codec this viewer accepts
+        self.compression_stats = CompressionStats()
+        self.stats = ConnectionStats() if self.collect_stats else None
+
+    def get_compression_options(self):
+        # permessage-deflate is only offered when frames are deflated
+        if self.compression is not None and self.compression.name == 'deflate':
+            return {'compression_level': self.compression.level}
+        return None
 
     def _handle_request_exception(self, exc):
         logging.error("Unhandled exception: %s" % str(exc))
@@ -93,49 +585,214 @@ class WSHandler(websocket.WebSocketHandler):
         except Exception as err:
             logging.error("%s" % err)
 
+    @gen.coroutine
     def open(self, *args, **kwargs):
-        wv = None
         args = (self.fname, self.objname)
         try:
+            obj = self.fname if self.fname is not None else self._resolve(self.objname)
+
             with self._lock:
             # look for the subhandler to see if we've already created one with 
-            # another protocol, e.g., pyv3d-bin-1.0 and pyv3d-txt-1.0
-                self.subhandler = self.subhandlers.get(args)
-                if self.subhandler is not None:
+            # another protocol, e.g., pyv3d-bin-1.0 and pyv3d-txt-1.0, or
+            # for another viewer of the same geometry. While one is still
+            # being created the entry is a Future for it.
+                entry = self.subhandlers.get(args)
+                if entry is not None:
                     logging.info("subhandler already existed, adding protocol %s to it." % self._protocol)
-
-                if self.subhandler is None:
+                else:
                     logging.info("creating a new subhandler for %s" % str(list(args)))
-                    obj = self.fname if self.fname is not None else self._resolve(self.objname)
-
-                    # try to create a subhandler matching the given protocol.  Take
-                    # the first one that succeeds.  
-                    for klass in self.protocols.get(self._protocol, []):
-                        logging.debug("trying to create a %s" % klass)
-                        if klass.supports(obj):
-                            wv = WS_WV_Wrapper()
-
-                            try:
-                                self.subhandler = klass(wv, obj=obj)
-                            except Exception as err:
-                                logging.warning(err)
-                                pass
-                            else:
-                                self.subhandlers[tuple(args)] = self.subhandler
-                                break
-                    else:
-                        logging.error("No senders found for protocol %s." % self._protocol)
-                        return
-                    logging.info("created a new subhandler!")
+                    entry = self.executor.submit(self._create_subhandler, obj,
+                                                 IOLoop.current())
+                    self.subhandlers[args] = entry
 
-            self.subhandler.wv.open(self)
-            logging.info("subhandler opened with protocol %s" % self._protocol)
+            if isinstance(entry, Future):
+                subhandler = None
+                try:
+                    subhandler = yield entry
+                finally:
+                    with self._lock:
+                        if self.subhandlers.get(args) is entry:
+                            if subhandler is None:
+                                del self.subhandlers[args]
+                            else:
+                                self.subhandlers[args] = subhandler
+                if subhandler is None:
+                    return
+                entry = subhandler
+            self.subhandler = entry
+            self._use_deflate()
 
             if '-bin-' in self._protocol: # only do an initial send if it's a binary protocol 
-                self.subhandler.send(obj, first=True)
+                # late joiners get the already encoded scene. Until the join
+                # ran the wrapper counts this viewer, so other viewers
+                # closing meanwhile don't close it.
+                subhandler = self.subhandler
+                subhandler.wv.expect(self)
+                joined = yield self.executor.submit(
+                    subhandler.wv.join, self,
+                    lambda: self._send_first(subhandler, obj), expected=True)
+                if not joined:
+                    return
+            else:
+                self.subhandler.wv.open(self)
+            logging.info("subhandler opened with protocol %s" % self._protocol)
         except Exception as err:
             logging.error('Exception: %s' % traceback.format_exc())
 
+    def _create_subhandler(self, obj, io_loop):
+        """Create a subhandler for obj matching our protocol, or return
+        None. Runs on the executor.
+        """
+        # try to create a subhandler matching the given protocol.  Take
+        # the first one that succeeds.  
+        for klass in self.protocols.get(self._protocol, []):
+            logging.debug("trying to create a %s" % klass)
+            if klass.supports(obj):
+                stats = PipelineStats() if self.collect_stats else None
+                wv = WS_WV_Wrapper(io_loop=io_loop,
+                                   compression=self.compression,
+                                   stats=stats)
+
+                try:
+                    subhandler = klass(wv, obj=obj)
+                except Exception as err:
+                    logging.warning(err)
+                else:
+                    logging.info("created a new subhandler!")
+                    return subhandler
+
+        logging.error("No senders found for protocol %s." % self._protocol)
+        return None
+
+    def _use_deflate(self):
+        """Take the shared deflated frames if this viewer negotiated
+        permessage-deflate with a full size window.
+        """
+        if not _shares_deflate(self.ws_connection, self.compression):
+            return
+        self.codec = 'deflate'
+        # compress anything else that is written on its own too, because
+        # the viewer's window holds the shared frames, not tornado's
+        self.ws_connection._compressor._compressor = None
+
+    def _send_first(self, subhandler, obj):
+        """Do the initial send of obj, straight from the scene cache if it
+        is a file that has been encoded before. Runs on the executor.
+        """
+        wv = subhandler.wv
+        key = None
+        # assemblies of many files are not cached, see pyV3D.assembly, nor
+        # are scenes that are encoded on disk already, see pyV3D.container
+        if (self.scene_cache is not None and isinstance(obj, basestring) and
+                os.path.isfile(obj) and
+                not getattr(subhandler, 'pre_encoded', False)):
+            key = self.scene_cache.key(obj, type(subhandler).__name__,
+                                       getattr(wv, 'context_params', None))
+            scene = self.scene_cache.get(key)
+            if scene is None:
+                # other processes sharing the cache wait for this one
+                with self.scene_cache.building(key) as scene:
+                    if scene is None:
+                        self._send_and_cache(subhandler, obj, key)
+                        return
+            logging.debug("sending %s from the scene cache" % obj)
+            wv.send_frames(*scene)
+            return
+
+        self._send_and_cache(subhandler, obj, key)
+
+    def _send_and_cache(self, subhandler, obj, key):
+        wv = subhandler.wv
+        subhandler.send(obj, first=True)
+        # scenes refined by levels of detail leave no scene_frames, sending
+        # their finest level at once is what levels of detail avoid. Until
+        # the refining is done the frames are those of a coarser level.
+        if (key is not None and wv.init_frame is not None and
+                wv.scene_frames is not None and not wv.face_levels):
+            self.scene_cache.put(key, wv.init_frame, wv.scene_frames)
+
+    def write_binary(self, data):
+        """Send data, any object supporting the buffer protocol, as a binary
+        message. Unlike write_message, data does not have to be a string.
+        """
+        if self.ws_connection is None:
+            raise websocket.WebSocketClosedError()
+        future = write_binary_frame(self.ws_connection, data)
+
+        # keep track of how far behind this client is, and how fast it is
+        if future is not None:
+            nbytes = len(memoryview(data))
+            self.pending_bytes += nbytes
+            stats = self.stats
+            if stats is not None:
+                stats.written(nbytes, self.pending_bytes)
+            start = time.time()
+            def _sent(f):
+                self.pending_bytes -= nbytes
+                self._measure(nbytes, start)
+                if stats is not None:
+                    stats.sent(time.time() - start)
+            future.add_done_callback(_sent)
+        return future
+
+    def _measure(self, nbytes, start):
+        """Update the throughput with a write of nbytes made at start that
+        just went out. It only began to go out once the write before it had.
+        """
+        now = time.time()
+        elapsed = now - max(start, self._last_sent)
+        self._last_sent = now
+        if nbytes < MIN_MEASURED_WRITE or elapsed <= 0:
+            return
+        rate = nbytes/elapsed
+        if self.throughput is None:
+            self.throughput = rate
+        else:
+            self.throughput = 0.7*self.throughput + 0.3*rate
+
+    @classmethod
+    def stats_dict(cls):
+        """Return the stats of every wrapper and its viewers, and of the
+        scene cache, as a dict of JSON types. Wrappers and viewers only have
+        stats if collect_stats was set when they were created.
+        """
+        with cls._lock:
+            subhandlers = [(key, entry) for key, entry in
+                           cls.subhandlers.items()
+                           if not isinstance(entry, Future)]
+        wrappers = []
+        for (fname, objname), subhandler in subhandlers:
+            wv = subhandler.wv
+            if wv is None:
+                continue
+            viewers = []
+            for protocol, handlers in list(wv.handlers.items()):
+                for handler in list(handlers):
+                    stats = getattr(handler, 'stats', None)
+                    compression = getattr(handler, 'compression_stats', None)
+                    viewers.append({
+                        'protocol': protocol,
+                        'codec': getattr(handler, 'codec', None),
+                        'throughput': getattr(handler, 'throughput', None),
+                        'pending_bytes': getattr(handler, 'pending_bytes', 0),
+                        'writes': stats.as_dict() if stats else None,
+                        'compression': (compression.as_dict()
+                                        if compression else None),
+                    })
+            wrappers.append({
+                'fname': fname,
+                'obj': objname,
+                'sender': type(subhandler).__name__,
+                'pipeline': wv.stats.as_dict() if wv.stats else None,
+                'viewers': viewers,
+            })
+
+        cache = cls.scene_cache
+        return {
+            'wrappers': wrappers,
+            'scene_cache': cache.stats() if cache is not None else None,
+        }
+
     def _resolve(self, name):
         """Try to find an object with the given name."""
         # for demo purposes, we've only got one type of object, a Cube
@@ -148,6 +805,15 @@ class WSHandler(websocket.WebSocketHandler):
         self.subhandler.on_message(self, message)
 
     def on_close(self):
+        if self.subhandler is None:
+            logging.debug("WebSocket closed (proto=%s)" % self._protocol)
+            return
+
+        # the subhandler lives on while other viewers still use it
+        with self._lock:
+            if self.subhandler.wv is not None and self.subhandler.wv.close(self):
+                self.subhandler = None
+
         try:
             if self.subhandler:
                 self.subhandler.on_close()
@@ -158,13 +824,23 @@ class WSHandler(websocket.WebSocketHandler):
                         del self.subhandlers[key]
                         break
 
+        if self.codec is not None:
+            logging.info("compression (%s): %s", self.codec,
+                         self.compression_stats)
         logging.debug("WebSocket closed (proto=%s)" % self._protocol)
 
     def select_subprotocol(self, subprotocols):
         try:
             for p in subprotocols:
-                if p in self.protocols:
-                    self._protocol = p
+                # e.g. pyv3d-bin-1.0+zstd for zstd compressed frames
+                protocol, _, codec = p.partition('+')
+                if codec and (self.compression is None or
+                              codec != self.compression.name or
+                              codec == 'deflate'):
+                    continue
+                if protocol in self.protocols:
+                    self._protocol = protocol
+                    self.codec = codec or None
                     logging.debug("matched subproto %s" % p)
                     return p
             logging.debug("returning None for subproto choices: %s" % subprotocols)
@@ -173,3 +849,12 @@ class WSHandler(websocket.WebSocketHandler):
         self._protocol = None
         return None
 
+
+class StatsHandler(web.RequestHandler):
+    """Serves WSHandler.stats_dict as JSON, e.g. on /stats next to the
+    WSHandler of a server that sets WSHandler.collect_stats.
+    """
+
+    def get(self):
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps(WSHandler.stats_dict()))
@@ -0,0 +1,88 @@
+"""
+Levels of detail for large triangle meshes, so that viewers can be sent a
+coarse version of a mesh first and the finer ones as updates after it, see
+WV_Wrapper.set_face_levels.
+
+The levels are made by vertex clustering on grids that double in
+resolution from one level to the next, so each level has around four times
+the triangles of the one before. The finer grids are clustered first and
+each coarser level is clustered from the one before it, so the whole
+pyramid costs little more than its finest level.
+"""
+
+import numpy as np
+
+from pyV3D.mesh import cluster_vertices, weld_mesh
+
+# Bump this whenever the levels built for a mesh change, so that levels
+# cached on disk by an older version are not used.
+LOD_VERSION = 1
+
+# default number of triangles a mesh needs to get coarser levels, and the
+# most the coarsest of them has
+MAX_TRIANGLES = 100000
+
+
+def build_levels(points, tris, max_triangles=MAX_TRIANGLES, angle=None,
+                 bias=1):
+    '''Return coarser versions of a triangle mesh.
+
+    points, tris: ndarrays
+        The mesh as for set_face_data, with tris counting from bias.
+
+    max_triangles: int
+        The coarsest level has at most this many triangles, unless the
+        grid gets down to two cells across first. Meshes that are no
+        larger get no levels.
+
+    angle: float
+        Crease angle in degrees for the normals of the levels, see
+        weld_mesh.
+
+    Returns a list of (points, normals, tris) tuples, coarsest first,
+    ready for set_face_data. Each level has at most half the triangles of
+    the next one, and the finest at most half those of the mesh.
+    '''
+    ntri = len(tris) // 3
+    if ntri <= max_triangles:
+        return []
+
+    xyz = np.asarray(points).reshape(-1, 3)
+    origin = xyz.min(axis=0).astype(np.float64)
+    span = float((xyz.max(axis=0) - origin).max())
+    if span <= 0.0:
+        return []
+
+    # a grid of n cells across keeps some n**2 vertices of a surface,
+    # start with one that keeps about half of them
+    cells = 2**int(np.floor(np.log2(max(np.sqrt(ntri/2.), 2))))
+
+    meshes = []
+    mesh = (points, tris, None)
+    while cells >= 2:
+        mesh = cluster_vertices(mesh[0], mesh[1], span/cells, origin,
+                                mesh[2], bias)
+        count = len(mesh[1]) // 3
+        finer = len(meshes[-1][1]) // 3 if meshes else ntri
+        if 0 < count and 2*count <= finer:
+            meshes.append(mesh)
+        if count <= max_triangles:
+            break
+        cells //= 2
+
+    levels = []
+    for cpoints, ctris, _ in reversed(meshes):
+        # unroll the triangles and weld them again for creased normals
+        corners = cpoints.reshape(-1, 3)[ctris - bias].reshape(-1)
+        lpoints, lnormals, ltris = weld_mesh(corners, angle=angle)
+        levels.append((lpoints, lnormals, ltris - 1 + bias))
+    return levels
+
+
+def level_name(name, depth):
+    '''Return the GPrim name of a level depth levels above the finest,
+    which keeps name itself.'''
+    if depth == 0:
+        return name
+    # wv ends names at the first NUL, e.g. of padded binary STL headers
+    return '%s@lod%d' % (name.split('\0', 1)[0], depth)
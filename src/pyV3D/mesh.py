@@ -0,0 +1,401 @@
+"""
+Helpers for turning triangle soup, as read from STL files, into indexed
+meshes.
+"""
+
+import operator
+
+import numpy as np
+
+# the ways triangle_edges can pick the edges to draw
+EDGE_MODES = ('all', 'unique', 'feature')
+
+
+def weld_vertices(points, tolerance=0.0):
+    '''Merge coincident vertices.
+
+    points: float32 ndarray
+        coordinates of vertices of the form [x1, y1, z1, .... x_n, y_n, z_n].
+
+    tolerance: float
+        Vertices that fall into the same cell of a grid with this spacing
+        are merged. With the default of 0.0 only vertices with identical
+        coordinates are merged.
+
+    Returns (index, inverse) where index holds the position of the first
+    occurrence of each unique vertex and inverse maps every input vertex to
+    its unique vertex, both as 0 based int arrays.
+    '''
+    xyz = points.reshape(-1, 3)
+    if tolerance > 0.0:
+        keys = np.floor(xyz / tolerance + 0.5).astype(np.int64)
+    else:
+        # -0.0 and 0.0 must land in the same bucket
+        keys = xyz + np.float32(0.0)
+
+    return _unique_rows(keys)
+
+
+def _unique_rows(keys):
+    '''Return (index, inverse) for the unique rows of a 2D array, like
+    np.unique with return_index and return_inverse does for 1D arrays.'''
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    if keys.dtype.kind in 'iu':
+        # Integer rows that fit into an int64 once packed, in the same
+        # order, are much quicker to sort as single numbers.
+        low = keys.min(axis=0)
+        span = [int(s) for s in keys.max(axis=0) - low + 1]
+        if reduce(operator.mul, span, 1) < 2**63:
+            code = np.zeros(len(keys), dtype=np.int64)
+            for j, s in enumerate(span):
+                code *= s
+                code += keys[:, j] - low[j]
+            # with return_index the sort is stable, so index holds the
+            # first occurrences
+            _, index, inverse = np.unique(code, return_index=True,
+                                          return_inverse=True)
+            return index, inverse
+
+    # a stable sort keeps the first occurrence of each row first
+    order = np.lexsort(keys.T[::-1])
+    skeys = keys[order]
+    first = np.empty(len(keys), dtype=bool)
+    first[0] = True
+    first[1:] = (skeys[1:] != skeys[:-1]).any(axis=1)
+
+    inverse = np.empty(len(keys), dtype=np.intp)
+    inverse[order] = np.cumsum(first) - 1
+    return order[first], inverse
+
+
+def _unit(vectors):
+    '''Normalize the rows of vectors, leaving zero rows alone. Also
+    returns a mask of the rows that could be normalized.'''
+    length = np.sqrt((vectors*vectors).sum(axis=1))
+    good = length > 0.0
+    unit = np.zeros_like(vectors)
+    unit[good] = vectors[good] / length[good, None]
+    return unit, good
+
+
+def face_normals(points, fallback=None):
+    '''Return the unit normal of every triangle and the interior angle at
+    every corner of an unrolled list of points. Degenerate triangles take
+    their normal from fallback, which has one normal per triangle, if it is
+    given.
+    '''
+    tri = points.reshape(-1, 3, 3).astype(np.float64)
+    normals, good = _unit(np.cross(tri[:, 1]-tri[:, 0], tri[:, 2]-tri[:, 0]))
+    if fallback is not None:
+        normals[~good] = fallback.reshape(-1, 3)[~good]
+
+    # edges leaving each corner towards the next and previous corner
+    ahead = _unit((np.roll(tri, -1, axis=1) - tri).reshape(-1, 3))[0]
+    behind = _unit((np.roll(tri, 1, axis=1) - tri).reshape(-1, 3))[0]
+    cos = np.clip((ahead*behind).sum(axis=1), -1.0, 1.0)
+
+    return normals, np.arccos(cos)
+
+
+def corner_normals(vertex, normals, weights, angle=None):
+    '''Compute a normal for every triangle corner.
+
+    vertex: int ndarray
+        The welded vertex of each corner, three per triangle.
+
+    normals, weights: ndarrays
+        Unit normal of each triangle and the weight of each corner in the
+        average, as from face_normals.
+
+    angle: float
+        Crease angle in degrees. A corner only averages the normals of the
+        triangles around its vertex that are within this angle of its own
+        triangle. With None every corner of a vertex gets the same smooth
+        normal.
+
+    Returns a (ncorner, 3) float64 array of unit normals.
+    '''
+    face = np.arange(len(vertex)) // 3
+    weighted = normals[face] * weights[:, None]
+
+    if angle is None:
+        acc = np.zeros((vertex.max()+1 if len(vertex) else 0, 3))
+        for i in range(3):
+            acc[:, i] = np.bincount(vertex, weights=weighted[:, i],
+                                    minlength=len(acc))
+        acc = acc[vertex]
+    else:
+        cos_angle = np.cos(np.radians(angle))
+
+        # Visit every pair of corners sharing a vertex by sorting the
+        # corners by vertex and comparing each one with the corners k
+        # places further along. This costs sum(valence**2) work.
+        order = np.argsort(vertex, kind='mergesort')
+        svertex = vertex[order]
+        sface = face[order]
+        sweighted = weighted[order]
+        acc = sweighted.copy()
+        left = np.searchsorted(svertex, svertex, side='right') - \
+               np.arange(len(svertex))
+        same = np.arange(len(svertex))
+        k = 1
+        while True:
+            same = same[left[same] > k]
+            if len(same) == 0:
+                break
+            fa = sface[same]
+            fb = sface[same+k]
+            close = (normals[fa]*normals[fb]).sum(axis=1) >= cos_angle
+            a = same[close]
+            b = a + k
+            acc[a] += sweighted[b]
+            acc[b] += sweighted[a]
+            k += 1
+        unsorted = np.empty_like(acc)
+        unsorted[order] = acc
+        acc = unsorted
+
+    result, good = _unit(acc)
+    result[~good] = normals[face[~good]]
+    return result
+
+
+def weld_mesh(points, normals=None, tolerance=0.0, angle=None):
+    '''Convert unrolled triangles into an indexed mesh.
+
+    points: float32 ndarray
+        coordinates of the triangle corners, nine values per triangle.
+
+    normals: float32 ndarray
+        optional normals from the file, one per corner. They are only used
+        for triangles whose geometry does not define a normal.
+
+    tolerance: float
+        Passed to weld_vertices.
+
+    angle: float
+        Crease angle in degrees, see corner_normals.
+
+    Returns (points, normals, tris) ready for set_face_data, with tris
+    1 based. Triangles that collapse once their vertices are welded are
+    dropped.
+    '''
+    _, vertex = weld_vertices(points, tolerance)
+
+    tri = vertex.reshape(-1, 3)
+    keep = ((tri[:, 0] != tri[:, 1]) & (tri[:, 1] != tri[:, 2]) &
+            (tri[:, 2] != tri[:, 0]))
+    if not keep.all():
+        points = points.reshape(-1, 9)[keep].reshape(-1)
+        vertex = tri[keep].reshape(-1)
+        if normals is not None:
+            normals = normals.reshape(-1, 9)[keep].reshape(-1)
+
+    fallback = None
+    if normals is not None:
+        fallback = normals.reshape(-1, 9)[:, :3]
+    fnormals, weights = face_normals(points, fallback)
+    cnormals = corner_normals(vertex, fnormals, weights, angle)
+
+    # A welded vertex is split wherever its corners ended up with different
+    # normals, which is what keeps creases sharp.
+    qnormals = np.round(cnormals * 1e5).astype(np.int64)
+    index, inverse = _unique_rows(np.column_stack((vertex, qnormals)))
+
+    new_points = np.ascontiguousarray(points.reshape(-1, 3)[index],
+                                      dtype=np.float32).reshape(-1)
+    new_normals = np.ascontiguousarray(cnormals[index],
+                                       dtype=np.float32).reshape(-1)
+    tris = (inverse + 1).astype(np.int32)
+
+    return new_points, new_normals, tris
+
+
+def cluster_vertices(points, tris, cell, origin, weights=None, bias=1):
+    '''Simplify a triangle mesh by vertex clustering.
+
+    points, tris: ndarrays
+        The vertices and the triangles, whose vertex indices count from
+        bias. The triangles don't need to share vertices.
+
+    cell, origin:
+        Vertices in the same cell of a grid with this spacing, starting at
+        origin, are merged into one at their mean.
+
+    weights: float ndarray
+        Weight of each vertex in the means, 1.0 if None.
+
+    Returns (points, tris, weights) of the simplified mesh, with the
+    merged weights. Triangles that collapse are dropped, and of triangles
+    with the same corners only the first is kept. Since the grids of cell
+    and 2*cell are nested, clustering the result again with twice the
+    spacing gives nearly what clustering the original with it does.
+    '''
+    xyz = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if weights is None:
+        weights = np.ones(len(xyz))
+    keys = np.floor((xyz - origin) / cell).astype(np.int64)
+    _, cluster = _unique_rows(keys)
+
+    total = np.bincount(cluster, weights=weights)
+    merged = np.column_stack([np.bincount(cluster, weights=weights*xyz[:, i])
+                              for i in range(3)]) / total[:, None]
+
+    tri = cluster[np.asarray(tris).reshape(-1, 3) - bias]
+    keep = ((tri[:, 0] != tri[:, 1]) & (tri[:, 1] != tri[:, 2]) &
+            (tri[:, 2] != tri[:, 0]))
+    tri = tri[keep]
+    first, _ = _unique_rows(np.sort(tri, axis=1))
+    tri = tri[np.sort(first)]
+
+    # only keep the vertices that are still used
+    used, tri = np.unique(tri, return_inverse=True)
+    return (np.ascontiguousarray(merged[used], dtype=np.float32).reshape(-1),
+            (tri + bias).astype(np.int32), total[used])
+
+
+def morton_order(points, tris, bias=0):
+    '''Return the triangles sorted along a Morton (Z-order) curve through
+    their centroids, so that triangles close in space are close in the
+    list and share vertices with the triangles around them in it.
+
+    points, tris: ndarrays
+        The vertices and the triangles, whose vertex indices count from
+        bias.
+
+    Returns the triangles as a flat array of the dtype of tris.
+    '''
+    tri = np.asarray(tris).reshape(-1, 3)
+    if len(tri) < 2:
+        return np.ascontiguousarray(tri).reshape(-1)
+    xyz = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+    centroid = xyz[tri[:, 0]-bias] + xyz[tri[:, 1]-bias]
+    centroid += xyz[tri[:, 2]-bias]
+
+    # 10 bits an axis, interleaved into 30: a cell of the curve holds a few
+    # triangles even of meshes of a hundred million
+    low = centroid.min(axis=0)
+    span = centroid.max(axis=0) - low
+    span[span == 0] = 1.0
+    centroid -= low
+    centroid *= 1023/span
+    cells = centroid.astype(np.uint32)
+    code = _spread_bits(cells[:, 0])
+    code |= _spread_bits(cells[:, 1]) << np.uint32(1)
+    code |= _spread_bits(cells[:, 2]) << np.uint32(2)
+
+    return tri[np.argsort(code)].reshape(-1)
+
+
+def _spread_bits(x):
+    '''Move the lower 10 bits of uint32 values to every third bit.'''
+    for shift, mask in ((16, 0x030000ff), (8, 0x0300f00f), (4, 0x030c30c3),
+                        (2, 0x09249249)):
+        x = (x | (x << np.uint32(shift))) & np.uint32(mask)
+    return x
+
+
+def triangle_edges(tris, points=None, edges='all', angle=30.0, bias=0):
+    '''Return the segments drawn along the sides of triangles as a flat
+    int32 array of pairs of vertex indices.
+
+    tris: int ndarray
+        Vertex indices of the triangles, three per triangle, counting
+        from bias.
+
+    points: float32 ndarray
+        Coordinates of the vertices, needed by every mode but 'all'. Sides
+        whose end points coincide are the same edge, even when the
+        triangles don't share vertices as in STL files.
+
+    edges: str
+        'all' gives the three sides of every triangle, so shared edges come
+        twice. 'unique' gives every edge once. 'feature' gives only the
+        boundary edges, edges with more than two triangles and edges where
+        the two triangles meet at more than angle degrees.
+
+    angle: float
+        Dihedral angle in degrees above which an edge is a 'feature' edge.
+    '''
+    tri = np.asarray(tris).reshape(-1, 3)
+    pairs = tri[:, [1, 2, 2, 0, 0, 1]].reshape(-1, 2)
+    rows = _edge_rows(tri, points, edges, angle, bias)
+    return np.ascontiguousarray(pairs[rows], dtype=np.int32).reshape(-1)
+
+
+def batch_triangle_edges(tris, points, point_offsets, tri_offsets,
+                         edges='all', angle=30.0, bias=0):
+    '''Like triangle_edges for many faces at once, as passed to
+    WV_Wrapper.set_faces_batch.
+
+    tris, points: ndarrays
+        The triangles and vertices of all faces one after the other. The
+        vertex indices of each face count from bias within its own points.
+
+    point_offsets, tri_offsets: int ndarrays
+        Where the points and triangles of each face start, with the totals
+        as last entries.
+
+    Returns (segs, seg_offsets), the segments of all faces one after the
+    other as a flat int32 array and where the segments of each face start
+    in it. Each face gets exactly what triangle_edges gives for it alone.
+    '''
+    tri = np.asarray(tris).reshape(-1, 3)
+    nface = len(tri_offsets) - 1
+    face = np.repeat(np.arange(nface), np.diff(tri_offsets))
+
+    # the same triangles with vertex indices counting over all the points
+    global_tri = tri
+    if edges != 'all':
+        global_tri = tri + np.asarray(point_offsets)[face, None]
+    rows = _edge_rows(global_tri, points, edges, angle, bias, face)
+
+    pairs = tri[:, [1, 2, 2, 0, 0, 1]].reshape(-1, 2)
+    counts = np.bincount(face[rows // 3], minlength=nface)
+    seg_offsets = np.zeros(nface+1, dtype=np.intp)
+    np.cumsum(2*counts, out=seg_offsets[1:])
+    return (np.ascontiguousarray(pairs[rows], dtype=np.int32).reshape(-1),
+            seg_offsets)
+
+
+def _edge_rows(tri, points, edges, angle, bias, groups=None):
+    '''Return the sides to draw for triangle_edges, as indices into the
+    three sides of every triangle in the order they first appear in. Sides
+    of triangles in different groups are never the same edge.'''
+    if edges not in EDGE_MODES:
+        raise ValueError("edges must be one of %s, not %r" %
+                         (', '.join(EDGE_MODES), edges))
+
+    nside = 3*len(tri)
+    if edges == 'all' or nside == 0:
+        return np.arange(nside)
+
+    pairs = tri[:, [1, 2, 2, 0, 0, 1]].reshape(-1, 2)
+    _, vertex = weld_vertices(points)
+    keys = np.sort(vertex[pairs - bias], axis=1)
+    if groups is not None:
+        keys = np.column_stack((np.repeat(groups, 3), keys))
+    index, inverse = _unique_rows(keys)
+
+    if edges == 'feature':
+        count = np.bincount(inverse)
+        keep = count != 2
+
+        # the sides of the two triangles of each manifold edge are next to
+        # each other once the sides are sorted by edge
+        order = np.argsort(inverse, kind='mergesort')
+        start = np.cumsum(count) - count
+        two = np.nonzero(count == 2)[0]
+        first = order[start[two]] // 3
+        second = order[start[two]+1] // 3
+
+        xyz = np.asarray(points).reshape(-1, 3)[tri - bias].astype(np.float64)
+        normals = _unit(np.cross(xyz[:, 1]-xyz[:, 0], xyz[:, 2]-xyz[:, 0]))[0]
+        cos = (normals[first]*normals[second]).sum(axis=1)
+        keep[two] = cos < np.cos(np.radians(angle))
+        index = index[keep]
+
+    # keep the edges in the order they first appear in
+    return np.sort(index)
@@ -1,3 +1,8 @@
+import json
+import logging
+
+from pyV3D.spatial import Camera
+from pyV3D.stats import timed
 
 
 class Sender(object):
@@ -14,14 +19,83 @@ class WV_Sender(Sender):
         pass
 
     def send(self, obj, first=False):
+        self.wv.face_levels = []
+        if not first:
+            # keep the old GPrim data around to send only what changed
+            old = self.wv.graphics_primitives
+            self.wv.graphics_primitives = []
+
+        with timed(getattr(self.wv, 'stats', None), 'load'):
+            if isinstance(obj, basestring): # assume it's a filename
+                self.geom_from_file(obj)
+            else:
+                self.geom_from_obj(obj)
+
         if not first:
+            if hasattr(self.wv, 'send_updates') and \
+               self.wv.update_primitives(old) >= 0:
+                self.wv.send_updates()
+                self._refine_later()
+                return
+
+            new = self.wv.graphics_primitives
             self.wv.clear()  # clear out old GPrim data
+            self.wv.graphics_primitives = new
+        self.wv.send(first)
+        self._refine_later()
 
-        if isinstance(obj, basestring): # assume it's a filename
-            self.geom_from_file(obj)
+    def _refine_later(self):
+        """Refine after this send returned if the wrapper can do that, see
+        WS_WV_Wrapper.repeat_later, else right away.
+        """
+        if not self.wv.face_levels:
+            return
+        if hasattr(self.wv, 'repeat_later'):
+            self.wv.repeat_later(self.refine_level)
         else:
-            self.geom_from_obj(obj)
-        self.wv.send(first)
+            self.refine()
+
+    def refine(self):
+        """Send the finer levels of the meshes given to set_face_levels,
+        one update per level, once the coarsest ones went out.
+        """
+        while self.refine_level():
+            pass
+
+    def refine_level(self):
+        """Send the next level of the meshes given to set_face_levels.
+        Returns whether there are finer ones left, False as well once the
+        viewers are gone.
+        """
+        wv = self.wv
+        if wv is None or not wv.face_levels:
+            return False
+        if wv.refine() >= 0 and hasattr(wv, 'send_updates'):
+            wv.send_updates()
+        else:
+            new = wv.graphics_primitives
+            wv.clear()
+            wv.graphics_primitives = new
+            wv.send()
+        return bool(wv.face_levels)
+
+    def on_message(self, handler, message):
+        """Handle a message from a viewer. A camera message,
+        {"camera": {"eye": [x, y, z], "center": ..., "up": ..., ...}} with
+        the arguments of pyV3D.spatial.Camera, sets the camera the GPrims
+        are ordered for when the wrapper sends them in view order.
+        """
+        try:
+            msg = json.loads(message)
+            if isinstance(msg, dict) and 'camera' in msg:
+                if hasattr(self.wv, 'camera'):
+                    self.wv.camera = Camera.from_message(
+                        msg['camera'], getattr(self.wv, 'context_params', None))
+                return
+        except (ValueError, TypeError, KeyError) as err:
+            logging.warning("bad message from viewer: %r: %s", message, err)
+            return
+        logging.debug("ignored message from viewer: %r", message)
 
     def on_close(self):
         self.wv = None
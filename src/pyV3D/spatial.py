@@ -0,0 +1,250 @@
+"""
+The order GPrims are sent in, so that a viewer gets what it looks at first.
+
+GPrims are ranked by the size their bounding boxes take on the screen of a
+Camera, largest first. Those inside its view frustum and at least
+min_pixels across are sent first; the others, outside of the view or
+smaller than a pixel, are deferred and sent after them. The frustum is
+tested against a BVH, a bounding volume hierarchy, of the boxes, so whole
+groups of GPrims out of view are dismissed at once.
+
+Boxes are as WV_Wrapper.gprim_boxes returns them: the maxima and then the
+minima of each, in the coordinates the viewer gets, which are also those of
+the camera of the context.
+"""
+
+import math
+
+import numpy as np
+
+
+class Camera(object):
+    '''What a viewer looks at.
+
+    eye, center, up: 3 floats
+        Where the eye is, the point it looks at and which way is up, as in
+        WV_Wrapper.createContext.
+
+    fov: float
+        Vertical field of view in degrees.
+
+    aspect: float
+        Width of the view over its height.
+
+    near, far: float
+        Distances of the clipping planes from the eye.
+
+    height: int
+        Height of the view in pixels.
+    '''
+
+    def __init__(self, eye, center, up, fov=30.0, aspect=1.0, near=1.0,
+                 far=10.0, height=600):
+        self.eye = np.asarray(eye, dtype=np.float64).reshape(3)
+        self.center = np.asarray(center, dtype=np.float64).reshape(3)
+        self.up = np.asarray(up, dtype=np.float64).reshape(3)
+        self.fov = float(fov)
+        self.aspect = float(aspect)
+        self.near = float(near)
+        self.far = float(far)
+        self.height = int(height)
+        if not (0 < self.fov < 180 and self.aspect > 0 and
+                0 <= self.near < self.far and self.height > 0):
+            raise ValueError("bad camera: fov %g, aspect %g, near %g, "
+                             "far %g, height %d" % (self.fov, self.aspect,
+                                                    self.near, self.far,
+                                                    self.height))
+
+    @classmethod
+    def from_context(cls, params):
+        '''Return the camera of a context, from WV_Wrapper.context_params.'''
+        bias, fov, near, far, eye, center, up = params
+        return cls(eye, center, up, fov, near=near, far=far)
+
+    @classmethod
+    def from_message(cls, msg, params=None):
+        '''Return the camera of a camera message from a viewer, a dict with
+        any of the arguments of Camera. The rest are those of the context
+        with the given context_params, if any.
+        '''
+        if not isinstance(msg, dict):
+            raise ValueError("a camera message must be a JSON object")
+        kwargs = {}
+        if params is not None:
+            bias, fov, near, far, eye, center, up = params
+            kwargs = dict(eye=eye, center=center, up=up, fov=fov,
+                          near=near, far=far)
+        for key in ('eye', 'center', 'up', 'fov', 'aspect', 'near', 'far',
+                    'height'):
+            if key in msg:
+                kwargs[key] = msg[key]
+        try:
+            return cls(**kwargs)
+        except TypeError as err:
+            raise ValueError("bad camera message: %s" % err)
+
+    def _axes(self):
+        forward = self.center - self.eye
+        forward /= np.linalg.norm(forward)
+        right = np.cross(forward, self.up)
+        right /= np.linalg.norm(right)
+        return forward, right, np.cross(right, forward)
+
+    def planes(self):
+        '''Return the six planes of the view frustum as a (6, 4) array of
+        (normal, offset) rows, normals pointing inwards: a point x is
+        inside where dot(normal, x) + offset >= 0 for all of them.
+        '''
+        forward, right, up = self._axes()
+        tan_y = math.tan(math.radians(self.fov)/2)
+        tan_x = tan_y*self.aspect
+        normals = np.array([forward, -forward,
+                            tan_x*forward + right, tan_x*forward - right,
+                            tan_y*forward + up, tan_y*forward - up])
+        normals /= np.linalg.norm(normals, axis=1)[:, None]
+        offsets = -normals.dot(self.eye)
+        offsets[0] -= self.near
+        offsets[1] += self.far
+        return np.column_stack([normals, offsets])
+
+    def pixels(self, boxes):
+        '''Return about how many pixels across each box is on the screen.'''
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 6)
+        radius = np.linalg.norm(boxes[:, :3] - boxes[:, 3:], axis=1)/2
+        center = (boxes[:, :3] + boxes[:, 3:])/2
+        distance = np.linalg.norm(center - self.eye, axis=1) - radius
+        distance = np.maximum(distance, max(self.near, 1e-6))
+        tan_y = math.tan(math.radians(self.fov)/2)
+        return radius/(distance*tan_y)*self.height
+
+
+class BVH(object):
+    '''A bounding volume hierarchy of boxes.
+
+    boxes: ndarray
+        (n, 6) maxima and then minima of each box.
+
+    leaf_size: int
+        The most boxes in a leaf. Nodes are split in two halves along the
+        longest extent of the centers of their boxes.
+    '''
+
+    def __init__(self, boxes, leaf_size=8):
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 6)
+        self.boxes = boxes
+        n = len(boxes)
+        centers = (boxes[:, :3] + boxes[:, 3:])/2
+        perm = np.arange(n)
+
+        # nodes in breadth first order, the children of a node next to
+        # each other after it
+        ranges = [(0, n)] if n else []
+        child = []
+        i = 0
+        while i < len(ranges):
+            start, end = ranges[i]
+            i += 1
+            if end - start <= leaf_size:
+                child.append(-1)
+                continue
+            idx = perm[start:end]
+            c = centers[idx]
+            axis = np.argmax(c.max(axis=0) - c.min(axis=0))
+            mid = (end - start)//2
+            perm[start:end] = idx[np.argpartition(c[:, axis], mid)]
+            child.append(len(ranges))
+            ranges.append((start, start + mid))
+            ranges.append((start + mid, end))
+
+        self.perm = perm
+        self.child = np.array(child, dtype=np.intp)
+        ranges = np.array(ranges, dtype=np.intp).reshape(-1, 2)
+        self.start = ranges[:, 0]
+        self.end = ranges[:, 1]
+
+        # the boxes of the nodes, children before their parents
+        self.hi = np.empty((len(ranges), 3), dtype=np.float32)
+        self.lo = np.empty((len(ranges), 3), dtype=np.float32)
+        ordered = boxes[perm]
+        for node in range(len(ranges) - 1, -1, -1):
+            first = self.child[node]
+            if first < 0:
+                part = ordered[self.start[node]:self.end[node]]
+                self.hi[node] = part[:, :3].max(axis=0)
+                self.lo[node] = part[:, 3:].min(axis=0)
+            else:
+                self.hi[node] = np.maximum(self.hi[first], self.hi[first+1])
+                self.lo[node] = np.minimum(self.lo[first], self.lo[first+1])
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def frustum(self, planes):
+        '''Return a bool array that is True for the boxes that are at least
+        partly inside the planes, see Camera.planes. A level of the tree
+        is tested at a time.
+        '''
+        inside = np.zeros(len(self.boxes), dtype=np.bool_)
+        frontier = np.arange(min(1, len(self.child)))
+        while len(frontier):
+            out, full = _classify(self.hi[frontier], self.lo[frontier],
+                                  planes)
+            nodes = frontier[full]
+            inside[self.perm[_ranges(self.start[nodes],
+                                     self.end[nodes])]] = True
+
+            frontier = frontier[~out & ~full]
+            leaves = frontier[self.child[frontier] < 0]
+            idx = self.perm[_ranges(self.start[leaves], self.end[leaves])]
+            out, full = _classify(self.boxes[idx, :3], self.boxes[idx, 3:],
+                                  planes)
+            inside[idx[~out]] = True
+
+            first = self.child[frontier]
+            first = first[first >= 0]
+            frontier = np.concatenate([first, first + 1])
+        return inside
+
+
+def _classify(hi, lo, planes):
+    '''Return which boxes are entirely outside of one of the planes and
+    which are entirely inside all of them.'''
+    normals = planes[:, :3]
+    positive = normals >= 0
+    far = np.where(positive, hi[:, None], lo[:, None])
+    near = np.where(positive, lo[:, None], hi[:, None])
+    out = ((far*normals).sum(axis=2) + planes[:, 3] < 0).any(axis=1)
+    full = ((near*normals).sum(axis=2) + planes[:, 3] >= 0).all(axis=1)
+    return out, full
+
+
+def _ranges(start, end):
+    '''Return the concatenation of arange(s, e) for the given pairs.'''
+    lengths = end - start
+    offsets = start - np.cumsum(lengths) + lengths
+    return np.repeat(offsets, lengths) + np.arange(lengths.sum())
+
+
+def view_order(boxes, camera, min_pixels=1.0, deleted=None, bvh=None):
+    '''Return the indices of the boxes in the order to send them in, as
+    two int32 arrays: those to send first and those to defer.
+
+    deleted: bool ndarray
+        Marks GPrims that are being deleted. They go first, deleting them
+        is cheap.
+
+    bvh: BVH
+        A BVH of boxes, made if not given.
+    '''
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 6)
+    if bvh is None:
+        bvh = BVH(boxes)
+    pixels = camera.pixels(boxes)
+    first = bvh.frustum(camera.planes()) & (pixels >= min_pixels)
+    if deleted is not None:
+        first |= deleted
+        pixels[deleted] = np.inf
+
+    # the largest first, ties in the order of the GPrims
+    order = np.argsort(-pixels, kind='mergesort').astype(np.int32)
+    return order[first[order]], order[~first[order]]
@@ -0,0 +1,255 @@
+"""
+Opt-in timings and byte counts of the steps that get geometry to viewers,
+to tell where the time goes when a viewer is slow.
+
+A WV_Wrapper collects them into its stats attribute once that is set to a
+PipelineStats, and WSHandler does so for every wrapper and viewer when its
+collect_stats is set. With stats left at None each step costs one check.
+
+The stages, in the order geometry goes through them:
+
+- load: the sender turning an object or file into primitives, apart from
+  what the stages below account for.
+- parse: reading STL files.
+- mesh: welding, levels of detail and edges of STL solids, up to
+  set_face_data.
+- register: adding primitives to the wv context, which cuts them into
+  stripes, and modifying them.
+- encode: the wv encoder, without the callbacks it passes buffers to.
+- send: the callbacks given to send_GPrim, e.g. send_binary_data.
+- write: writing the frames of broadcasts to the sockets of viewers.
+
+Time spent in a stage while another is timed on the same thread counts
+for the inner one only.
+"""
+
+import time
+import threading
+from threading import Lock
+from collections import OrderedDict
+
+from pyV3D.compact import gprim_sizes
+
+STAGES = ('load', 'parse', 'mesh', 'register', 'encode', 'send', 'write')
+
+# CPU time, of the thread where the platform can tell
+_cpu_clock = (getattr(time, 'thread_time', None) or
+              getattr(time, 'process_time', None) or time.clock)
+
+
+class StageStats(object):
+    """Totals of one stage: how often it ran, its wall and CPU seconds and
+    the bytes and chunks it handled. Chunks are GPrims for register,
+    buffers for send and frames for write.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes = 0
+        self.chunks = 0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'bytes': self.bytes,
+            'chunks': self.chunks,
+        }
+
+
+class PipelineStats(object):
+    """Per stage totals, see STAGES, along with
+
+    gprims: dict
+        Maps GPrim names to the bytes and messages sent for them and the
+        stripes wv cut them into, if count_gprims is set. That takes
+        walking the messages of every buffer sent, which costs about as
+        much as encoding them when GPrims are small.
+
+    peak_buffer: int
+        Size of the largest buffer a send was made with.
+
+    peak_fill: int
+        The most bytes a send passed on in one buffer.
+    """
+
+    def __init__(self, count_gprims=True):
+        self.count_gprims = count_gprims
+        self._lock = Lock()
+        self._local = threading.local()  # timers running on each thread
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = OrderedDict((name, StageStats())
+                                      for name in STAGES)
+            self.gprims = {}
+            self.peak_buffer = 0
+            self.peak_fill = 0
+
+    def timer(self, stage):
+        """Return a context manager that adds the time of its block to
+        stage. Its count method adds bytes and chunks.
+        """
+        return _Timer(self, stage)
+
+    def add(self, stage, wall=0.0, cpu=0.0, nbytes=0, chunks=0, calls=1):
+        with self._lock:
+            totals = self.stages[stage]
+            totals.calls += calls
+            totals.wall += wall
+            totals.cpu += cpu
+            totals.bytes += nbytes
+            totals.chunks += chunks
+
+    def add_gprim(self, name, nbytes=0, messages=0, stripes=None):
+        # wv ends names at the first NUL
+        name = name.split(b'\0', 1)[0]
+        with self._lock:
+            gprim = self.gprims.get(name)
+            if gprim is None:
+                gprim = self.gprims[name] = {'bytes': 0, 'messages': 0,
+                                             'stripes': 0}
+            gprim['bytes'] += nbytes
+            gprim['messages'] += messages
+            if stripes is not None:
+                gprim['stripes'] = stripes
+
+    def add_buffer(self, size):
+        """Note the size of a buffer a send is made with."""
+        with self._lock:
+            self.peak_buffer = max(self.peak_buffer, size)
+
+    def callback(self, func):
+        """Return a send_GPrim callback that calls func, timing it as the
+        send stage and counting the GPrims in the buffers passed to it.
+        """
+        def counted(wsi, buf, ibuf):
+            with self.timer('send') as timer:
+                status = func(wsi, buf, ibuf)
+                timer.count(ibuf, 1)
+            # not part of any stage, nor of the encode around it
+            if self.count_gprims:
+                with _Timer(self, None):
+                    for name, (nbytes, messages) in gprim_sizes(buf).items():
+                        self.add_gprim(name, nbytes, messages)
+            with self._lock:
+                self.peak_fill = max(self.peak_fill, ibuf)
+            return status
+        return counted
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'stages': OrderedDict((name, totals.as_dict()) for
+                                      name, totals in self.stages.items()),
+                'gprims': dict((name, dict(gprim)) for
+                               name, gprim in self.gprims.items()),
+                'peak_buffer': self.peak_buffer,
+                'peak_fill': self.peak_fill,
+            }
+
+    def __str__(self):
+        lines = ["%-8s %6s %10s %10s %12s %8s" % ('stage', 'calls', 'wall (s)',
+                                                 'cpu (s)', 'bytes',
+                                                 'chunks')]
+        for name, totals in self.stages.items():
+            lines.append("%-8s %6d %10.4f %10.4f %12d %8d" % (
+                name, totals.calls, totals.wall, totals.cpu, totals.bytes,
+                totals.chunks))
+        lines.append("%d GPrims, peak buffer %d bytes, %d used" % (
+            len(self.gprims), self.peak_buffer, self.peak_fill))
+        return '\n'.join(lines)
+
+
+class _Timer(object):
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+        self.nbytes = 0
+        self.chunks = 0
+        self.inner = [0.0, 0.0]  # seconds of timers nested in this one
+
+    def count(self, nbytes, chunks=0):
+        self.nbytes += nbytes
+        self.chunks += chunks
+
+    def __enter__(self):
+        stack = self.stats._local.__dict__.setdefault('timers', [])
+        stack.append(self)
+        self.start = (time.time(), _cpu_clock())
+        return self
+
+    def __exit__(self, *args):
+        wall = time.time() - self.start[0]
+        cpu = _cpu_clock() - self.start[1]
+        stack = self.stats._local.timers
+        stack.pop()
+        if stack:
+            stack[-1].inner[0] += wall
+            stack[-1].inner[1] += cpu
+        if self.stage is not None:
+            self.stats.add(self.stage, wall - self.inner[0],
+                           cpu - self.inner[1], self.nbytes, self.chunks)
+
+
+class _NullTimer(object):
+    """Stands in for a _Timer when no stats are collected."""
+
+    def count(self, nbytes, chunks=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def timed(stats, stage):
+    """Return stats.timer(stage), or a timer that does nothing if stats is
+    None.
+    """
+    if stats is None:
+        return _null_timer
+    return stats.timer(stage)
+
+
+class ConnectionStats(object):
+    """What was written to one viewer: the number of writes, their bytes,
+    the seconds from each write until it was on its way and the most bytes
+    that were waiting to go out at once.
+    """
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.peak_pending = 0
+
+    def written(self, nbytes, pending):
+        self.writes += 1
+        self.bytes += nbytes
+        self.peak_pending = max(self.peak_pending, pending)
+
+    def sent(self, seconds):
+        self.seconds += seconds
+
+    def as_dict(self):
+        return {
+            'writes': self.writes,
+            'bytes': self.bytes,
+            'seconds': self.seconds,
+            'peak_pending': self.peak_pending,
+        }
+
+    def __str__(self):
+        return "%d writes, %d bytes in %.3f s, at most %d pending" % (
+            self.writes, self.bytes, self.seconds, self.peak_pending)
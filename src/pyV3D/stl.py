@@ -1,17 +1,78 @@
 import os
+import glob
+import mmap
 import struct
 
 from numpy import array, float32
 import numpy as np
 
+from pyV3D import get_bounding_box
 from pyV3D.sender import WV_Sender
+from pyV3D.mesh import weld_mesh
+from pyV3D.lod import build_levels, LOD_VERSION
+from pyV3D.stats import timed
+
+BINARY_HEADER = "80sI"
+
+# Record layout of one facet in a binary STL file: normal, three vertices
+# and the (unused) attribute byte count, 50 bytes with no padding.
+BINARY_FACET = np.dtype([('normal', '<f4', (3,)),
+                         ('vertices', '<f4', (3, 3)),
+                         ('attr', '<u2')])
+
+# Bytes read at a time when parsing ascii STL files.
+ASCII_CHUNK_SIZE = 1 << 22
+
+# Everything in the body of an ascii solid that is not a number. Longer
+# words come first so "endfacet" is not left behind as "end".
+_FACET_KEYWORDS = ('endfacet', 'endloop', 'facet', 'normal', 'outer',
+                   'loop', 'vertex')
 
 class STLGeometryObject(object):
     '''This is an object that follows the IStaticGeometry interface.
+
+    filename: str
+        Path to an ASCII or binary STL file.
+
+    use_mmap: bool
+        If True, binary files are read through a read-only memory map
+        instead of through the file object.
+
+    weld: bool
+        If True, coincident vertices are merged into an indexed mesh and
+        vertex normals are computed from the geometry, using the 'angle'
+        argument of get_visualization_data as the crease angle.
+
+    tolerance: float
+        Distance below which vertices are merged when welding.
+
+    edges: str
+        Which facet sides are sent as edges, see WV_Wrapper.add_triangle.
+        'unique' and 'feature' send far fewer of them than 'all'.
+
+    lod: int
+        If given, solids of more than this many triangles are set with
+        WV_Wrapper.set_face_levels, starting from a level of at most this
+        many triangles, see pyV3D.lod.build_levels. The coarsest level is
+        only sent once the whole solid is parsed and all its levels are
+        built, as each is clustered from the finer one, so this cuts the
+        bytes the first scene takes on the wire, not the parsing. Wrappers
+        that can send the finer levels after the send returned do, see
+        WS_WV_Wrapper.repeat_later.
+
+    lod_cache: LevelCache
+        Keeps the levels built for lod, so they are built once per file.
     '''
 
-    def __init__(self, filename):
+    def __init__(self, filename, use_mmap=False, weld=False, tolerance=0.0,
+                 edges='all', lod=None, lod_cache=None):
         self.filename = filename
+        self.use_mmap = use_mmap
+        self.weld = weld
+        self.tolerance = tolerance
+        self.edges = edges
+        self.lod = lod
+        self.lod_cache = lod_cache
         self.geom_name = os.path.basename(filename)[:-4]
         
     def get_visualization_data(self, wv, *args, **kwargs):
@@ -19,135 +80,264 @@ class STLGeometryObject(object):
         
         wv: WV_Wrapper instance
             The pyV3D WV_Wrapper object
+
+        angle: float
+            Crease angle in degrees used when welding. Edges between facets
+            meeting at a larger angle stay sharp.
         '''
         
-        # Determine if we are binary or ascii
-        binary = False
-        with open(self.filename, 'rU') as stl:
-            for line in stl:
-        
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                fields = line.split()
-                if fields[0] not in ('solid'):
-                    binary = True
-                
-                break
-                
-        if binary:
+        angle = kwargs.get('angle')
+        with timed(getattr(wv, 'stats', None), 'parse') as timer:
+            timer.count(os.path.getsize(self.filename))
             with open(self.filename, 'rb') as stl:
-                self._load_binary(wv, stl)
-        else:
-            with open(self.filename, 'rU') as stl:
-                self._load_ascii(wv, stl)
+                if self._is_binary(stl):
+                    self._load_binary(wv, stl, angle)
+                else:
+                    self._load_ascii(wv, stl, angle)
+
+    def _is_binary(self, stl):
+        '''Sniff the start of the open file to decide between binary and
+        ascii. The file position is left at the start of the file.
+        '''
+        head = stl.read(84)
+        stl.seek(0)
+
+        if not head.lstrip().startswith('solid'):
+            return True
+        if len(head) < 84:
+            return False
+
+        # Plenty of exporters write binary files whose 80 byte header
+        # starts with "solid". Those are identified by the facet count
+        # matching the file size, as long as no ascii facet follows.
+        ntri = struct.unpack('<I', head[80:84])[0]
+        if 84 + BINARY_FACET.itemsize*ntri != os.fstat(stl.fileno()).st_size:
+            return False
+        binary = 'facet' not in stl.read(1024).lower()
+        stl.seek(0)
+        return binary
             
-    def _load_ascii(self, wv, stl):
-        '''Load from ascii STL file.'''
+    def _load_ascii(self, wv, stl, angle=None):
+        '''Load from ascii STL file.
 
-        vertices = []
-        normals = []
+        The file is read in chunks of ASCII_CHUNK_SIZE bytes and the numbers
+        of each chunk are converted in bulk. Only the data for the current
+        solid is held, and each solid gets its own call to set_face_data.
+        '''
+
+        values = []
         nsolid = 0
-        
-        for line in stl:
-        
-            line = line.strip()
-            if not line:
-                continue
-            fields = line.split()
-            
-            if fields[0] in ('solid', 'outer',
-                             'endloop', 'endfacet'):
-                continue
-                
-            elif fields[0] == 'facet':
-            
-                # Replicate normal for each vertex.
-                normal = [float(xyz) for xyz in fields[2:]]
-                normals.extend(normal)
-                normals.extend(normal)
-                normals.extend(normal)
-                
-            elif fields[0] == 'vertex':
-                vertices.extend([float(xyz) for xyz in fields[1:]])
-            
-            # Finish with this solid and prepare for next one.
-            elif fields[0] == 'endsolid':
-                ntri = len(vertices)/3
-                    
-                nsolid += 1
-                wv.set_face_data(points=np.array(vertices, dtype=np.float32),
-                                 tris=np.array(range(1, ntri+1), dtype=np.int32),
-                                 normals=np.array(normals, dtype=np.float32), 
-                                 bbox=self._get_bbox(ntri/3, vertices),
-                                 name="%s_solid%d"%(self.geom_name, nsolid))
-                                                 
-                normals = []
-                vertices = []
+        tail = ''
+
+        def parse(text):
+            try:
+                return _parse_facet_numbers(text)
+            except ValueError as err:
+                raise ValueError("%s: solid %d: %s"
+                                 % (self.filename, nsolid + 1, err))
+
+        while True:
+            # old Mac files end their lines with a lone CR
+            chunk = stl.read(ASCII_CHUNK_SIZE).replace('\r', '\n')
+            if chunk:
+                # only parse complete lines, carry the rest over
+                text = tail + chunk
+                end = text.rfind('\n') + 1
+                text, tail = text[:end], text[end:]
+                if not end:
+                    continue
+            else:
+                text, tail = tail, ''
+            text = text.lower()
+
+            start = 0
+            for bol, eol, keyword in _solid_lines(text):
+                values.append(parse(text[start:bol]))
+                start = eol
+
+                # Finish with this solid and prepare for next one.
+                if keyword == 'endsolid':
+                    nsolid += 1
+                    self._set_ascii_solid(wv, values, nsolid, angle)
+                    values = []
+
+            values.append(parse(text[start:]))
+
+            if not chunk:
+                break
+
+        # tolerate a missing endsolid at the end of the file
+        if sum(len(v) for v in values):
+            nsolid += 1
+            self._set_ascii_solid(wv, values, nsolid, angle)
+
+    def _set_ascii_solid(self, wv, values, nsolid, angle=None):
+        '''Hand the facet numbers gathered for one ascii solid to wv.'''
+
+        values = np.concatenate(values)
+        if len(values) == 0:
+            return
+        if len(values) % 12:
+            raise ValueError("%s: solid %d does not contain complete facets"
+                             % (self.filename, nsolid))
+
+        # each facet is a normal followed by three vertices
+        values = values.reshape(-1, 12)
+        points = np.ascontiguousarray(values[:, 3:]).reshape(-1)
+        ntri = len(points)/3
+
+        # Replicate normal for each vertex.
+        normals = np.repeat(values[:, :3], 3, axis=0).reshape(-1)
+
+        self._set_faces(wv, points, normals,
+                        np.arange(1, ntri+1, dtype=np.int32),
+                        "%s_solid%d"%(self.geom_name, nsolid), angle)
                     
-    def _load_binary(self, wv, stl):
+    def _load_binary(self, wv, stl, angle=None):
         '''Load from binary STL file.'''
         
-        BINARY_HEADER ="80sI"
-        BINARY_FACET = "12fH"
-        
-        vertices = []
-        normals = []
-        
         header, ntri = struct.unpack(BINARY_HEADER, stl.read(84))
 
         def remove_non_ascii(s): 
             return "".join([i for i in s if ord(i)<128])
 
         header = remove_non_ascii(header)
-        
-        for i in xrange(0, ntri):
-            facet = struct.unpack(BINARY_FACET, stl.read(50))
 
-            normal = [float(xyz) for xyz in facet[0:3]]
-            normals.extend(normal)
-            normals.extend(normal)
-            normals.extend(normal)
-            
-            vertices.extend([float(xyz) for xyz in facet[3:12]])
-            
-        wv.set_face_data(points=np.array(vertices, dtype=np.float32),
-                         tris=np.array(range(1, 3*ntri+1), dtype=np.int32),
-                         colors=None,
-                         normals=np.array(normals, dtype=np.float32), 
-                         bbox=self._get_bbox(ntri, vertices),
-                         name=header)
-
-    def _get_bbox(self, ntri, vertices):
-        """Determine the bounding box
+        if self.use_mmap:
+            mm = mmap.mmap(stl.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                ntri = min(ntri, (len(mm)-84)//BINARY_FACET.itemsize)
+                facets = np.frombuffer(mm, dtype=BINARY_FACET, count=ntri,
+                                       offset=84)
+                points, normals, tris = _unroll_facets(facets)
+                del facets
+            finally:
+                mm.close()
+        else:
+            facets = np.fromfile(stl, dtype=BINARY_FACET, count=ntri)
+            points, normals, tris = _unroll_facets(facets)
+
+        self._set_faces(wv, points, normals, tris, header, angle)
+
+    def _set_faces(self, wv, points, normals, tris, name, angle=None):
+        '''Hand the unrolled facets of one solid to wv, welding them
+        first if requested.'''
+
+        with timed(getattr(wv, 'stats', None), 'mesh'):
+            if self.weld:
+                points, normals, tris = weld_mesh(points, normals,
+                                                  self.tolerance, angle)
 
-        ntri: int
-            Number of triangles
+            if self.lod is not None and len(tris) > 3*self.lod:
+                levels = self._get_levels(points, tris, name, angle)
+                wv.set_face_levels(levels + [(points, normals, tris)],
+                                   colors=None,
+                                   bbox=self._get_bbox(points),
+                                   name=name,
+                                   edges=self.edges)
+                return
 
-        vertices: list of float
+            wv.set_face_data(points=points,
+                             tris=tris,
+                             colors=None,
+                             normals=normals, 
+                             bbox=self._get_bbox(points),
+                             name=name,
+                             edges=self.edges)
+
+    def _get_levels(self, points, tris, name, angle=None):
+        '''Return the coarser levels of a solid, from lod_cache if they
+        were built before.'''
+        key = None
+        if self.lod_cache is not None:
+            key = self.lod_cache.key(self.filename, LOD_VERSION, name,
+                                     self.weld, self.tolerance, angle,
+                                     self.lod)
+            levels = self.lod_cache.get(key)
+            if levels is not None:
+                return levels
+
+        levels = build_levels(points, tris, self.lod, angle)
+        if key is not None:
+            self.lod_cache.put(key, levels)
+        return levels
+
+    def _get_bbox(self, vertices):
+        """Determine the bounding box
+
+        vertices: float32 ndarray
             coordinates of vertices of the form [x1, y1, z1, .... x_n, y_n, z_n].
-            Length of vertices is ntri*9
 
         """
+        return get_bounding_box(vertices).reshape(-1).tolist()
+
+
+def _solid_lines(text):
+    '''Yield (start, end, keyword) for every "solid" and "endsolid" line
+    in a lowercased piece of ascii STL made of complete lines.
+    '''
+    pos = text.find('solid')
+    while pos >= 0:
+        bol = text.rfind('\n', 0, pos) + 1
+        keyword = text[bol:pos].strip() + 'solid'
+        if keyword not in ('solid', 'endsolid'):
+            # part of a name, e.g. "solid mysolid"
+            pos = text.find('solid', pos+5)
+            continue
+        eol = text.find('\n', pos)
+        if eol < 0:
+            eol = len(text)
+        yield bol, eol, keyword
+        pos = text.find('solid', eol)
 
-        min_x = max_x = vertices[0]
-        min_y = max_y = vertices[1]
-        min_z = max_z = vertices[2]
-        for i in range(ntri*3):
-            min_x = min(min_x, vertices[i*3])
-            max_x = max(max_x, vertices[i*3])
-            min_y = min(min_y, vertices[i*3+1])
-            max_y = max(max_y, vertices[i*3+1])
-            min_z = min(min_z, vertices[i*3+2])
-            max_z = max(max_z, vertices[i*3+2])
-            
-        return [max_x, max_y, max_z, min_x, min_y, min_z]
+
+def _parse_facet_numbers(text):
+    '''Return all numbers in a piece of lowercased ascii STL facet data as
+    a float32 array, in the order they appear. Raises ValueError unless
+    there are three for each facet normal and vertex.
+    '''
+    expected = 3*(text.count('facet') - text.count('endfacet') +
+                  text.count('vertex'))
+    for keyword in _FACET_KEYWORDS:
+        text = text.replace(keyword, ' ')
+    if not text or text.isspace():
+        values = np.empty(0, dtype=np.float32)
+    else:
+        # parse as double first so values round exactly like float() did.
+        # Parsing stops at anything that is not a number.
+        values = np.fromstring(text, dtype=np.float64,
+                               sep=' ').astype(np.float32)
+    if len(values) != expected:
+        raise ValueError("%d numbers where the facets take %d, bad number "
+                         "or keyword" % (len(values), expected))
+    return values
+
+
+def _unroll_facets(facets):
+    '''Convert an array of BINARY_FACET records into the contiguous 
+    points, normals and tris arrays expected by set_face_data. Every facet
+    contributes three unshared vertices, each carrying the facet normal.
+    '''
+    ntri = len(facets)
+    points = np.ascontiguousarray(facets['vertices'], 
+                                  dtype=np.float32).reshape(-1)
+    normals = np.repeat(facets['normal'].astype(np.float32, copy=False), 3, 
+                        axis=0).reshape(-1)
+    tris = np.arange(1, 3*ntri+1, dtype=np.int32)
+
+    return points, normals, tris
 
                                          
 
 class STLSender(WV_Sender):
+
+    lod = None        # see STLGeometryObject
+    lod_cache = None
+
     def initialize(self, **kwargs):
+        self.lod = kwargs.get('lod', self.lod)
+        self.lod_cache = kwargs.get('lod_cache', self.lod_cache)
+
         eye    = array([0.0, 0.0, 7.0], dtype=float32)
         center = array([0.0, 0.0, 0.0], dtype=float32)
         up     = array([0.0, 1.0, 0.0], dtype=float32)
@@ -162,10 +352,12 @@ class STLSender(WV_Sender):
     def supports(obj):
         if isinstance(obj, STLGeometryObject):
             return True
-        return isinstance(obj, basestring) and obj.lower().endswith('.stl')
+        # glob patterns are assemblies, see pyV3D.assembly
+        return (isinstance(obj, basestring) and obj.lower().endswith('.stl')
+                and not glob.has_magic(obj))
 
     def geom_from_file(self, fname):
-        geom = STLGeometryObject(fname)
+        geom = STLGeometryObject(fname, lod=self.lod, lod_cache=self.lod_cache)
         geom.get_visualization_data(self.wv, 
                                     angle=15., relSide=.02, relSag=.001)
 
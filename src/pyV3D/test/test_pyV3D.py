@@ -1,13 +1,42 @@
 
 import os
+import copy
+import json
+import shutil
+import zlib
 import unittest
 import tempfile
+import time
+import signal
+import threading
+import multiprocessing
 
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
-from pyV3D import WV_Wrapper, ConnectivitiesError
+from pyV3D import WV_Wrapper, ConnectivitiesError, BufferPool
 from pyV3D.cube import CubeGeometry, CubeSender
-from pyV3D.stl import STLSender
+from pyV3D import stl
+from pyV3D.stl import STLSender, STLGeometryObject
+from pyV3D.mesh import weld_mesh, triangle_edges, cluster_vertices
+from pyV3D.handler import (WS_WV_Wrapper, WSHandler, write_binary_frame,
+                           _writes_frames, _shares_deflate)
+from pyV3D.cache import SceneCache, LevelCache
+from pyV3D.lod import build_levels, level_name
+from pyV3D.compact import (COMPACT_PROTOCOL, compact_frames, read_frame,
+                           gprim_sizes, VERTICES, INDICES, NORMALS)
+from pyV3D.compress import Codec, CompressionStats
+from pyV3D.sender import WV_Sender
+from pyV3D.stats import PipelineStats, STAGES
+import pyV3D.assembly
+from pyV3D.assembly import STLAssemblySender, find_parts, SHARED_DIR
+from pyV3D.container import SceneContainer, ContainerSender
+from pyV3D import wvserver
+from pyV3D.spatial import BVH, Camera, view_order
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.websocket import WebSocketProtocol13
 from pyV3D import get_bounding_box, get_focus, adjust_points
 
 
@@ -15,6 +44,13 @@ class WV_Test_Wrapper(WV_Wrapper):
     pass
 
 
+class Tight_Wrapper(WV_Wrapper):
+    """Encodes in buffers too small for the largest message."""
+
+    def _buffer_length(self, total, largest):
+        return largest
+
+
 class WV_test_Wrapper(WV_Wrapper):
 
     def __init__(self, fname):
@@ -43,6 +79,131 @@ class WV_test_Wrapper(WV_Wrapper):
         return 0
 
 
+class Stub_Stream(object):
+
+    def __init__(self):
+        self.data = []
+
+    def write(self, data):
+        self.data.append(bytes(data))
+
+
+class Stub_Handler(object):
+    """Enough of a WSHandler to build a tornado websocket connection on."""
+
+    def __init__(self, pending_bytes=0):
+        self.request = None
+        self.stream = Stub_Stream()
+        self.ws_connection = WebSocketProtocol13(self)
+        self._protocol = 'pyv3d-bin-1.0'
+        self.pending_bytes = pending_bytes
+        self.closed = False
+
+    def write_binary(self, data):
+        return write_binary_frame(self.ws_connection, data)
+
+    def close(self):
+        self.closed = True
+
+
+class Plain_Connection(object):
+    """A websocket connection without tornado's private counters."""
+
+    mask_outgoing = False
+
+    def __init__(self):
+        self.stream = Stub_Stream()
+        self.messages = []
+
+    def write_message(self, message, binary=False):
+        self.messages.append((message, binary))
+
+
+class Counting_Codec(Codec):
+    """Counts the frames it compresses."""
+
+    def __init__(self, *args, **kwargs):
+        super(Counting_Codec, self).__init__(*args, **kwargs)
+        self.count = 0
+
+    def compress_frames(self, frames):
+        self.count += len(frames)
+        return super(Counting_Codec, self).compress_frames(frames)
+
+
+def deflate_handler():
+    """A Stub_Handler that negotiated permessage-deflate."""
+    handler = Stub_Handler()
+    handler.max_message_size = 1 << 30
+    handler.ws_connection._create_compressors('server', {})
+    handler.codec = 'deflate'
+    handler.compression_stats = CompressionStats()
+    return handler
+
+
+def inflate(handler):
+    """Return the messages written to a deflate_handler, decompressed
+    the way a browser does, with one context for all of them.
+    """
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    payloads = []
+    for header, data in zip(handler.stream.data[::2],
+                            handler.stream.data[1::2]):
+        if ord(header[0]) & 0x40:
+            data = decompressor.decompress(data + b'\x00\x00\xff\xff')
+        payloads.append(data)
+    return payloads
+
+
+class Stub_Primitive(object):
+    """Just what WV_Wrapper._mod_primitive looks at."""
+
+    def __init__(self, name, points):
+        self.name = name
+        self.points = points
+
+
+class Assembly(object):
+    """A row of tetrahedra, any of which can be moved."""
+
+    def __init__(self, nparts):
+        self.offsets = np.zeros((nparts, 3), dtype=np.float32)
+        self.offsets[:, 0] = np.arange(nparts)*2
+        self.hidden = set()
+
+    def get_visualization_data(self, wv, **kwargs):
+        tet = np.array([0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1], dtype=np.float32)
+        tris = np.array([1, 3, 2, 1, 2, 4, 1, 4, 3, 2, 3, 4], dtype=np.int32)
+        for i, offset in enumerate(self.offsets):
+            if i in self.hidden:
+                continue
+            points = tet + np.tile(offset, 4)
+            wv.set_face_data(points=points, tris=tris,
+                             normals=np.repeat(np.float32(0.5), 12),
+                             name='part_%03d' % i)
+
+
+class Assembly_Sender(WV_Sender):
+
+    def initialize(self, **kwargs):
+        eye = np.array([0.0, 0.0, 7.0], dtype=np.float32)
+        center = np.array([0.0, 0.0, 0.0], dtype=np.float32)
+        up = np.array([0.0, 1.0, 0.0], dtype=np.float32)
+        self.wv.createContext(1, 30.0, 1.0, 10.0, eye, center, up)
+
+    def geom_from_obj(self, obj):
+        obj.get_visualization_data(self.wv)
+
+
+class Face_Recording_Wrapper(object):
+
+    def __init__(self):
+        self.faces = []
+
+    def set_face_data(self, **kwargs):
+        self.faces.append(kwargs)
+
+
 class PyV3DTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -80,6 +241,17 @@ class PyV3DTestCase(unittest.TestCase):
         bbox2 = get_bounding_box(bbox.flatten())
         self.assertTrue((bbox2 == bbox).all())
 
+        # any dtype, same result as the reductions numpy does
+        points = np.random.RandomState(1).randn(3000)
+        bbox = get_bounding_box(points)
+        self.assertEqual(bbox.dtype, np.float32)
+        xyz = points.reshape(-1, 3)
+        self.assertTrue((bbox[0] == xyz.max(axis=0).astype(np.float32)).all())
+        self.assertTrue((bbox[1] == xyz.min(axis=0).astype(np.float32)).all())
+
+        self.assertRaises(ValueError, get_bounding_box,
+                          np.array([], dtype=np.float32))
+
     def test_focus(self):
         #test for cube
         bounding_box = np.array([10, 10, 10, 0, 0, 0], dtype=np.float32)
@@ -160,6 +332,14 @@ class PyV3DTestCase(unittest.TestCase):
         self.assertEqual(translated_pmin.all(), new_pmin.all())
         self.assertEqual(translated_pmax.all(), new_pmax.all())
 
+        # in place gives the same numbers without a new array
+        focus = np.array([50, 25, 12.5, 50], dtype=np.float32)
+        points = np.concatenate((pmin, pmax))
+        expected = adjust_points(focus, points)
+        self.assertTrue((expected == np.concatenate((new_pmin, new_pmax))/50).all())
+        self.assertTrue(adjust_points(focus, points, inplace=True) is points)
+        self.assertTrue((points == expected).all())
+
     def test_cube(self):
         cname = os.path.join(self.path, 'cube.bin')
         newname = os.path.join(self.tdir, 'cube.bin')
@@ -203,6 +383,1347 @@ class PyV3DTestCase(unittest.TestCase):
             newcontent = f.read()
         self._compare(content, newcontent, cname, newname)
     
+    def test_binary_stl_arrays(self):
+        fname = os.path.join(self.path, 'knot.stl')
+        with open(fname, 'rb') as f:
+            f.seek(80)
+            ntri = np.fromfile(f, dtype=np.uint32, count=1)[0]
+
+        faces = []
+        for use_mmap in (False, True):
+            wrapper = Face_Recording_Wrapper()
+            STLGeometryObject(fname, use_mmap=use_mmap).get_visualization_data(wrapper)
+            self.assertEqual(len(wrapper.faces), 1)
+            faces.append(wrapper.faces[0])
+
+        face = faces[0]
+        self.assertEqual(face['points'].shape, (9*ntri,))
+        self.assertEqual(face['normals'].shape, (9*ntri,))
+        self.assertEqual(face['points'].dtype, np.float32)
+        self.assertEqual(face['tris'].dtype, np.int32)
+        self.assertTrue(face['points'].flags['C_CONTIGUOUS'])
+        self.assertTrue(face['normals'].flags['C_CONTIGUOUS'])
+        self.assertTrue((face['tris'] == np.arange(1, 3*ntri+1)).all())
+
+        # each facet normal is repeated for its three vertices
+        normals = face['normals'].reshape(ntri, 3, 3)
+        self.assertTrue((normals[:, 0] == normals[:, 2]).all())
+
+        for key in ('points', 'normals', 'tris'):
+            self.assertTrue(np.array_equal(face[key], faces[1][key]))
+
+    def test_ascii_stl_chunks(self):
+        with open(os.path.join(self.path, 'Star.stl'), 'rb') as f:
+            star = f.read()
+        fname = os.path.join(self.tdir, 'two_stars.stl')
+        with open(fname, 'wb') as f:
+            f.write(star)
+            f.write(star.replace('solid Star', 'solid vertex 1 2 3'))
+
+        wrapper = Face_Recording_Wrapper()
+        STLGeometryObject(fname).get_visualization_data(wrapper)
+
+        chunk_size = stl.ASCII_CHUNK_SIZE
+        stl.ASCII_CHUNK_SIZE = 100
+        try:
+            chunked = Face_Recording_Wrapper()
+            STLGeometryObject(fname).get_visualization_data(chunked)
+        finally:
+            stl.ASCII_CHUNK_SIZE = chunk_size
+
+        self.assertEqual([f['name'] for f in chunked.faces],
+                         ['two_stars_solid1', 'two_stars_solid2'])
+        for face, other in zip(wrapper.faces, chunked.faces):
+            self.assertEqual(face['points'].shape, (68*9,))
+            for key in ('points', 'normals', 'tris'):
+                self.assertTrue(np.array_equal(face[key], other[key]))
+                self.assertTrue(np.array_equal(face[key],
+                                               chunked.faces[0][key]))
+
+        # lines may end in LF, CR LF or a lone CR
+        for eol in ('\n', '\r\n', '\r'):
+            with open(fname, 'wb') as f:
+                f.write(star.replace('\r\n', '\n').replace('\n', eol)*2)
+            other = Face_Recording_Wrapper()
+            STLGeometryObject(fname).get_visualization_data(other)
+            self.assertEqual(len(other.faces), 2)
+            for key in ('points', 'normals', 'tris'):
+                self.assertTrue(np.array_equal(other.faces[1][key],
+                                               wrapper.faces[0][key]))
+
+        # a number that doesn't parse fails the load, even where those
+        # before it make whole facets
+        start = star.index('facet normal', star.index('endfacet'))
+        start += len('facet normal ')
+        with open(fname, 'wb') as f:
+            f.write(star[:start] + 'x' + star[start:])
+        self.assertRaises(ValueError, lambda: STLGeometryObject(fname)
+                          .get_visualization_data(Face_Recording_Wrapper()))
+
+    def test_binary_stl_solid_header(self):
+        with open(os.path.join(self.path, 'knot.stl'), 'rb') as f:
+            knot = f.read()
+        fname = os.path.join(self.tdir, 'solid_header.stl')
+        with open(fname, 'wb') as f:
+            f.write('solid knot'.ljust(80))
+            f.write(knot[80:])
+
+        wrapper = Face_Recording_Wrapper()
+        STLGeometryObject(fname).get_visualization_data(wrapper)
+        self.assertEqual(len(wrapper.faces), 1)
+        self.assertEqual(wrapper.faces[0]['name'].strip(), 'solid knot')
+
+    def test_weld_mesh(self):
+        # unit cube as triangle soup, two triangles per side
+        corners = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+                            [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]],
+                           dtype=np.float32)
+        quads = [(0, 3, 2, 1), (4, 5, 6, 7), (0, 1, 5, 4),
+                 (2, 3, 7, 6), (1, 2, 6, 5), (0, 4, 7, 3)]
+        tris = []
+        for a, b, c, d in quads:
+            tris.extend([a, b, c, a, c, d])
+        points = corners[tris].reshape(-1)
+
+        # smooth normals point away from the center
+        pts, normals, tris = weld_mesh(points)
+        self.assertEqual(len(pts), 8*3)
+        self.assertEqual(len(tris), 12*3)
+        self.assertEqual(tris.dtype, np.int32)
+        xyz = pts.reshape(-1, 3)
+        np.testing.assert_allclose(normals.reshape(-1, 3),
+                                   (xyz-0.5)/np.sqrt(0.75), atol=1e-6)
+        np.testing.assert_array_equal(xyz[tris-1].reshape(-1), points)
+
+        # with a crease angle every side keeps its own corners
+        pts, normals, tris = weld_mesh(points, angle=15.)
+        self.assertEqual(len(pts), 24*3)
+        self.assertEqual(tris.min(), 1)
+        self.assertEqual(tris.max(), 24)
+        np.testing.assert_array_equal(np.abs(normals).sum(), 24)
+
+        # vertices within the tolerance are merged
+        jiggled = points + np.float32(1e-4)*np.sin(np.arange(len(points)))
+        self.assertEqual(len(weld_mesh(jiggled)[0]), len(points))
+        self.assertEqual(len(weld_mesh(jiggled, tolerance=1e-2)[0]), 8*3)
+
+    def test_stl_weld(self):
+        fname = os.path.join(self.path, 'Star.stl')
+        wrapper = Face_Recording_Wrapper()
+        STLGeometryObject(fname, weld=True).get_visualization_data(
+            wrapper, angle=15.)
+        welded = wrapper.faces[0]
+
+        wrapper = Face_Recording_Wrapper()
+        STLGeometryObject(fname).get_visualization_data(wrapper, angle=15.)
+        soup = wrapper.faces[0]
+
+        self.assertEqual(len(welded['tris']), len(soup['tris']))
+        self.assertTrue(len(welded['points']) < len(soup['points']))
+        xyz = welded['points'].reshape(-1, 3)
+        np.testing.assert_array_equal(xyz[welded['tris']-1].reshape(-1),
+                                      soup['points'])
+        self.assertEqual(welded['bbox'], soup['bbox'])
+
+    def test_triangle_edges(self):
+        # a unit cube, two triangles per side
+        corners = np.array([[x, y, z] for x in (0, 1) for y in (0, 1)
+                            for z in (0, 1)], dtype=np.float32).reshape(-1)
+        tris = np.array([0, 1, 3, 0, 3, 2, 4, 6, 7, 4, 7, 5, 0, 4, 5, 0, 5, 1,
+                         2, 3, 7, 2, 7, 6, 0, 2, 6, 0, 6, 4, 1, 5, 7, 1, 7, 3],
+                        dtype=np.int32) + 1
+
+        segs = triangle_edges(tris, edges='all')
+        expected = [tris[3*i+j] for i in range(12)
+                    for k in range(3) for j in ((k+1) % 3, (k+2) % 3)]
+        self.assertEqual(segs.tolist(), expected)
+
+        unique = triangle_edges(tris, corners, 'unique', bias=1)
+        self.assertEqual(len(unique), 2*18)  # 12 sides, 6 diagonals
+        pairs = set(tuple(sorted(p)) for p in unique.reshape(-1, 2))
+        self.assertEqual(len(pairs), 18)
+
+        feature = triangle_edges(tris, corners, 'feature', 30., bias=1)
+        self.assertEqual(len(feature), 2*12)
+        self.assertEqual(len(triangle_edges(tris, corners, 'feature', 100.,
+                                            bias=1)), 0)
+
+        # triangle soup, as read from an STL file, has the same edges
+        soup = corners.reshape(-1, 3)[tris-1].reshape(-1)
+        soup_tris = np.arange(1, len(tris)+1, dtype=np.int32)
+        self.assertEqual(len(triangle_edges(soup_tris, soup, 'unique',
+                                            bias=1)), 2*18)
+        self.assertEqual(len(triangle_edges(soup_tris, soup, 'feature', 30.,
+                                            bias=1)), 2*12)
+
+        # a side of its own is a boundary
+        self.assertEqual(len(triangle_edges(tris[:6], corners, 'feature',
+                                            30., bias=1)), 2*4)
+        self.assertRaises(ValueError, triangle_edges, tris, corners, 'some')
+
+        # fewer edges, smaller scene
+        sizes = []
+        for edges in ('all', 'unique', 'feature'):
+            wv = WS_WV_Wrapper()
+            STLSender(wv)  # 1 based, like tris
+            wv.set_face_data(points=soup, tris=soup_tris, name='box',
+                             edges=edges, feature_angle=100.)
+            wv.prepare_for_sends()
+            sizes.append(len(b''.join(wv._encode(-1))))
+            wv.finish_sends()
+        self.assertTrue(sizes[0] > sizes[1] > sizes[2])
+
+    def test_stripe_order(self):
+        # a welded grid of more vertices than fit in a stripe, its
+        # triangles shuffled
+        n = 300
+        x, y = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+        points = np.column_stack([x.ravel(), y.ravel(), np.zeros(n*n)])
+        corner = (x[:-1, :-1]*n + y[:-1, :-1]).ravel() + 1
+        tris = np.vstack([np.column_stack([corner, corner+n, corner+n+1]),
+                          np.column_stack([corner, corner+n+1, corner+1])])
+        tris = tris[np.random.RandomState(0).permutation(len(tris))]
+
+        stripes = {}
+        triangles = {}
+        for order in (None, 'morton'):
+            wv = WS_WV_Wrapper()
+            STLSender(wv)
+            wv.stripe_order = order
+            wv.set_face_data(points=points.astype(np.float32).ravel(),
+                             tris=tris.astype(np.int32).ravel(), name='grid')
+            wv.prepare_for_sends()
+            sent = [arrays for frame in wv._encode(-1)
+                    for msg, arrays in read_frame(frame)
+                    if msg.opcode == 3 and msg.gtype == 2 and
+                    VERTICES in arrays]
+            wv.finish_sends()
+            stripes[order] = [len(arrays[VERTICES]) for arrays in sent]
+            triangles[order] = sorted(
+                tri.tobytes() for arrays in sent
+                for tri in arrays[VERTICES][arrays[INDICES]].reshape(-1, 9))
+
+        self.assertEqual(len(triangles['morton']), len(tris))
+        self.assertEqual(triangles[None], triangles['morton'])
+        self.assertTrue(len(stripes['morton']) < len(stripes[None]))
+        self.assertTrue(sum(stripes['morton']) < 1.1*n*n < sum(stripes[None]))
+
+    def test_ownership(self):
+        wrapper = Face_Recording_Wrapper()
+        STLGeometryObject(os.path.join(self.path, 'knot.stl'),
+                          weld=True).get_visualization_data(wrapper)
+        face = wrapper.faces[0]
+        points, normals, tris = face['points'], face['normals'], face['tris']
+
+        frames = {}
+        for mode in ('copy', 'borrow', 'adopt'):
+            given = points.copy()
+            wv = WS_WV_Wrapper()
+            wv.ownership = mode
+            wv.open(Stub_Handler())
+            STLSender(wv)
+            wv.set_face_data(points=given, tris=tris.copy(),
+                             normals=normals.copy(), name='knot')
+            wv.send(first=True)
+            frames[mode] = wv.scene_frames
+
+            usage = wv.memory_usage()['knot']
+            if mode == 'copy':
+                self.assertEqual(usage['borrowed'], 0)
+                self.assertTrue(usage['source'] > 0)
+            else:
+                # the faces are used in place, the stripes are gone
+                self.assertTrue(usage['borrowed'] >= usage['vertices'] > 0)
+                self.assertEqual(usage['stripes'], 0)
+            # only adopt scales the caller's points
+            self.assertEqual(np.array_equal(given, points), mode != 'adopt')
+
+            # stripes are made again for the next send
+            wv.begin_sends()
+            self.assertTrue(wv._encode(-1) == frames[mode])
+            wv.finish_sends()
+
+            # and updates work on the borrowed arrays
+            old = wv.graphics_primitives
+            wv.graphics_primitives = []
+            wv.set_face_data(points=points*1.5, tris=tris.copy(),
+                             normals=normals.copy(), name='knot')
+            self.assertEqual(wv.update_primitives(old), 1)
+            wv.begin_sends()
+            frames[mode, 'update'] = wv._encode(0)
+            wv.finish_sends()
+
+        for mode in ('borrow', 'adopt'):
+            self.assertTrue(frames[mode] == frames['copy'])
+            self.assertEqual(frames[mode, 'update'], frames['copy', 'update'])
+
+    def test_binary_frames(self):
+        for size in (0, 125, 126, 65535, 65536, 3205696):
+            data = np.arange(size, dtype=np.uint8).tostring()
+
+            handler = Stub_Handler()
+            handler.ws_connection.write_message(data, binary=True)
+            expected = handler.stream.data[0]
+
+            # the caller's buffer can be reused right after the write
+            buf = bytearray(data)
+            handler = Stub_Handler()
+            write_binary_frame(handler.ws_connection, memoryview(buf))
+            buf[:] = b'\0'*len(buf)
+            self.assertEqual(b''.join(handler.stream.data), expected)
+
+        # frames are written to the stream only where tornado keeps the
+        # counters they update, anything else gets write_message
+        self.assertTrue(_writes_frames(handler.ws_connection))
+        conn = Plain_Connection()
+        write_binary_frame(conn, memoryview(b'data'))
+        self.assertEqual(conn.messages, [(b'data', True)])
+        self.assertEqual(conn.stream.data, [])
+
+    def test_ws_send(self):
+        fname = os.path.join(self.path, 'knot.stl')
+        cname = os.path.join(self.tdir, 'knot.bin')
+
+        wv = WV_test_Wrapper(cname)
+        STLSender(wv).send(fname, first=True)
+        wv.binfile.close()
+        with open(cname, 'rb') as f:
+            expected = f.read()
+
+        wv = WS_WV_Wrapper()
+        handler = Stub_Handler()
+        wv.open(handler)
+        STLSender(wv).send(fname, first=True)
+
+        # strip the frame headers back off
+        payload = []
+        for header, data in zip(handler.stream.data[::2],
+                                handler.stream.data[1::2]):
+            self.assertEqual(header[0], b'\x82')
+            payload.append(data)
+        self.assertTrue(len(payload) > 1)
+        self.assertEqual(b''.join(payload), expected)
+
+    def test_ws_broadcast(self):
+        fname = os.path.join(self.path, 'Star.stl')
+        wv = WS_WV_Wrapper(max_pending=1000)
+        first, second = Stub_Handler(), Stub_Handler()
+        wv.open(first)
+        wv.open(second)
+        self.assertRaises(RuntimeError, wv.open, first)
+
+        sender = STLSender(wv)
+        sender.send(fname, first=True)
+        self.assertEqual(second.stream.data, first.stream.data)
+
+        # a late joiner gets the very same frames, no re-encoding
+        late = Stub_Handler()
+        wv.open(late)
+        self.assertTrue(wv.send_cached(late))
+        scene = len(wv.scene_frames)*2
+        self.assertEqual(late.stream.data,
+                         first.stream.data[:2] + first.stream.data[-scene:])
+        self.assertTrue(late.stream.data[-1] is first.stream.data[-1])
+
+        # a viewer that has fallen behind is dropped, the others carry on
+        second.pending_bytes = 1001
+        nframes = len(first.stream.data)
+        sender.send(os.path.join(self.path, 'knot.stl'))
+        self.assertTrue(second.closed)
+        self.assertFalse(first.closed)
+        self.assertTrue(len(first.stream.data) > nframes)
+        self.assertEqual(wv.close(first), 1)
+        self.assertEqual(wv.handlers['pyv3d-bin-1.0'], [late])
+
+        # a viewer whose join is still to run keeps the wrapper in use
+        joining = Stub_Handler()
+        wv.expect(joining)
+        self.assertEqual(wv.close(late), 1)
+        self.assertTrue(wv.join(joining, expected=True))
+        self.assertEqual(joining.stream.data[1], wv.init_frame)
+        # unless it closed before it could join
+        gone = Stub_Handler()
+        wv.expect(gone)
+        self.assertEqual(wv.close(gone), 1)
+        self.assertFalse(wv.join(gone, expected=True))
+        self.assertEqual(wv.handlers['pyv3d-bin-1.0'], [joining])
+        self.assertEqual(gone.stream.data, [])
+
+    def test_compact_encoding(self):
+        fname = os.path.join(self.path, 'knot.stl')
+        wv = WS_WV_Wrapper()
+        STLSender(wv)
+        STLGeometryObject(fname).get_visualization_data(wv)
+        wv.prepare_for_sends()
+        frames = wv._encode(-1)
+        wv.finish_sends()
+
+        for bits, max_angle in ((16, 0.05), (8, 1.5)):
+            compact = compact_frames(frames, bits)
+            self.assertTrue(sum(map(len, compact)) < 0.5*sum(map(len, frames)))
+
+            for frame, small in zip(frames, compact):
+                messages = read_frame(frame)
+                decoded = read_frame(small, compact=True)
+                self.assertEqual([m.name for m, _ in messages],
+                                 [m.name for m, _ in decoded])
+                for (_, expected), (_, arrays) in zip(messages, decoded):
+                    self.assertEqual(sorted(expected), sorted(arrays))
+                    for kind, data in expected.items():
+                        if kind == VERTICES:
+                            # within half a step of the stripe's box
+                            step = (data.max(axis=0) - data.min(axis=0))/65535.
+                            self.assertTrue((np.abs(arrays[kind] - data) <=
+                                             0.5*step + 1e-6).all())
+                        elif kind == NORMALS:
+                            # STL normals are not quite unit length
+                            length = np.sqrt((data*data).sum(axis=1))
+                            good = length > 0
+                            cos = (arrays[kind]*data).sum(axis=1)[good]
+                            cos /= length[good]
+                            angle = np.degrees(np.arccos(np.clip(cos, -1, 1)))
+                            self.assertTrue(angle.max() < max_angle)
+                        else:
+                            self.assertTrue((arrays[kind] == data).all())
+
+        # viewers get the encoding they asked for, and the compact version
+        # of the scene is only made once
+        wv = WS_WV_Wrapper()
+        plain, small = Stub_Handler(), Stub_Handler()
+        small._protocol = COMPACT_PROTOCOL
+        wv.open(plain)
+        wv.open(small)
+        STLSender(wv).send(fname, first=True)
+        self.assertEqual(small.stream.data[1::2],
+                         compact_frames(plain.stream.data[1::2]))
+
+        late = Stub_Handler()
+        late._protocol = COMPACT_PROTOCOL
+        wv.open(late)
+        wv.send_cached(late)
+        scene = len(wv.scene_frames)*2
+        self.assertEqual(late.stream.data,
+                         small.stream.data[:2] + small.stream.data[-scene:])
+        self.assertTrue(late.stream.data[-1] is small.stream.data[-1])
+
+    def test_compression(self):
+        fname = os.path.join(self.path, 'knot.stl')
+        self.assertRaises(ValueError, Codec, 'brotli')
+
+        codec = Counting_Codec('deflate', level=1)
+        wv = WS_WV_Wrapper(compression=codec)
+        plain, deflated = Stub_Handler(), deflate_handler()
+        wv.open(plain)
+        wv.open(deflated)
+        STLSender(wv).send(fname, first=True)
+        expected = plain.stream.data[1::2]
+        self.assertEqual(inflate(deflated), expected)
+
+        # the small init frame goes out uncompressed
+        flags = [ord(header[0]) & 0x40 for header in deflated.stream.data[::2]]
+        self.assertEqual(flags[0], 0)
+        self.assertTrue(all(flags[2:]))
+
+        stats = deflated.compression_stats
+        self.assertEqual(stats.raw_bytes, sum(map(len, expected)))
+        self.assertEqual(stats.sent_bytes,
+                         sum(map(len, deflated.stream.data[1::2])))
+        self.assertTrue(stats.ratio > 2)
+
+        # only viewers with a full size window, on connections whose
+        # negotiated window tornado keeps, share the deflated frames
+        conn = deflate_handler().ws_connection
+        self.assertTrue(_shares_deflate(conn, codec))
+        self.assertFalse(_shares_deflate(conn, None))
+        self.assertFalse(_shares_deflate(plain.ws_connection, codec))
+        self.assertFalse(_shares_deflate(Plain_Connection(), codec))
+        small = Stub_Handler()
+        small.max_message_size = 1 << 30
+        small.ws_connection._create_compressors(
+            'server', {'server_max_window_bits': '10'})
+        self.assertFalse(_shares_deflate(small.ws_connection, codec))
+        del conn._compressor._max_wbits
+        self.assertFalse(_shares_deflate(conn, codec))
+
+        # the scene is compressed once, late joiners only cost the init frame
+        count = codec.count
+        late = deflate_handler()
+        wv.open(late)
+        wv.send_cached(late)
+        self.assertEqual(codec.count, count + 1)
+        scene = len(wv.scene_frames)
+        self.assertEqual(inflate(late), expected[:1] + expected[-scene:])
+
+        for name in ('zstd', 'lz4'):
+            try:
+                codec = Codec(name, min_size=100)
+            except ImportError:
+                continue
+            frames, _ = codec.compress_frames(expected)
+            self.assertEqual([codec.decompress(f) for f in frames], expected)
+
+        # on the IOLoop, large broadcasts are compressed on a worker thread
+        # and later ones wait their turn
+        loop = IOLoop(make_current=False)
+        wv = WS_WV_Wrapper(io_loop=loop,
+                           compression=Codec('deflate', level=1,
+                                             offload_size=1))
+        handler = deflate_handler()
+        wv.open(handler)
+
+        @gen.coroutine
+        def send():
+            STLSender(wv).send(fname, first=True)
+            wv.broadcast([b'last'])
+            self.assertEqual(handler.stream.data, [])
+            while wv._pending:
+                yield gen.sleep(0.01)
+
+        loop.run_sync(send)
+        loop.close()
+        self.assertEqual(inflate(handler), expected + [b'last'])
+
+    def test_pipeline_stats(self):
+        fname = os.path.join(self.path, 'knot.stl')
+        wv = WS_WV_Wrapper(stats=PipelineStats())
+        handler = Stub_Handler()
+        wv.open(handler)
+        sender = STLSender(wv)
+        sender.send(fname, first=True)
+
+        stats = wv.stats.as_dict()
+        stages = stats['stages']
+        self.assertEqual(list(stages), list(STAGES))
+        self.assertEqual(stages['parse']['bytes'], os.path.getsize(fname))
+        self.assertEqual(stages['register']['chunks'], 1)
+        self.assertEqual(stages['encode']['calls'], 2)  # init and scene
+        sent = sum(len(frame) for frame in handler.stream.data[1::2])
+        self.assertEqual(stages['send']['bytes'], sent)
+        self.assertEqual(stages['write']['bytes'], sent)
+        self.assertEqual(stages['write']['chunks'], len(handler.stream.data)//2)
+        for name in ('load', 'parse', 'mesh', 'register', 'encode', 'send'):
+            self.assertTrue(stages[name]['calls'] > 0, name)
+            self.assertTrue(stages[name]['wall'] >= 0.0, name)
+
+        # every GPrim message is counted, as are the stripes of the mesh
+        gprim, = stats['gprims'].values()
+        messages = [msg for frame in handler.stream.data[1::2]
+                    for msg, _ in read_frame(frame) if msg.name]
+        self.assertEqual(gprim['messages'], len(messages))
+        self.assertEqual(gprim['bytes'],
+                         sum(msg.end - msg.start for msg in messages))
+        self.assertTrue(gprim['stripes'] > 1)
+        self.assertTrue(0 < stats['peak_fill'] <= stats['peak_buffer'])
+
+        # updates count too, and without stats nothing is collected
+        sender.send(fname)
+        self.assertEqual(wv.stats.stages['load'].calls, 2)
+        wv.stats.reset()
+        self.assertEqual(wv.stats.stages['load'].calls, 0)
+        self.assertEqual(WS_WV_Wrapper().stats, None)
+
+        # the stats of all viewers, as served by StatsHandler
+        subhandlers = WSHandler.subhandlers
+        WSHandler.subhandlers = {(fname, None): sender}
+        try:
+            served = json.loads(json.dumps(WSHandler.stats_dict()))
+        finally:
+            WSHandler.subhandlers = subhandlers
+        wrapper, = served['wrappers']
+        self.assertEqual(wrapper['sender'], 'STLSender')
+        self.assertEqual(wrapper['pipeline']['stages']['load']['calls'], 0)
+        self.assertEqual(len(wrapper['viewers']), 1)
+        self.assertEqual(served['scene_cache'], None)
+
+    def test_send_buffers(self):
+        pool = BufferPool(max_bytes=128*1024, min_size=1024)
+        buf = pool.take(1500)
+        self.assertEqual(len(buf), 2048)
+        pool.give(buf)
+        self.assertTrue(pool.take(2000) is buf)
+        pool.give(bytearray(256*1024))  # beyond max_bytes, not kept
+        self.assertEqual(pool.free_bytes, 0)
+
+        def encode(**kwargs):
+            wv = WS_WV_Wrapper(**kwargs)
+            wv.buffer_pool = pool
+            STLSender(wv)
+            STLGeometryObject(fname).get_visualization_data(wv)
+            wv.prepare_for_sends()
+            frames = wv._encode(-1)
+            wv.finish_sends()
+            return wv, frames
+
+        # a small scene only takes a small buffer, and gives it back
+        fname = os.path.join(self.path, 'Star.stl')
+        wv, frames = encode()
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(pool.free_bytes, pool.size_for(len(frames[0])))
+
+        # smaller buffers carry the same messages in more frames
+        _, small = encode(buffer_size=2048)
+        self.assertTrue(len(small) > 1)
+        self.assertEqual(b''.join(f[:-4] for f in small), frames[0][:-4])
+        for frame in small[:-1]:
+            self.assertEqual(frame[-4:], b'\0\0\0\0')  # continue opcode
+
+        # a message that does not fit in the buffer fails the send, not the
+        # process
+        tight = Tight_Wrapper()
+        STLSender(tight)
+        STLGeometryObject(fname).get_visualization_data(tight)
+        tight.prepare_for_sends()
+        try:
+            self.assertRaises(RuntimeError, tight.send_GPrim, tight, -1,
+                              lambda wsi, buf, ibuf: 0)
+        finally:
+            tight.finish_sends()
+
+        # frames follow the speed of the slowest viewer
+        fast, slow = Stub_Handler(), Stub_Handler()
+        fast.throughput, slow.throughput = 1e9, 1e6
+        wv.open(fast)
+        self.assertEqual(wv.flush_size(), wv.buffer_size)
+        wv.open(slow)
+        self.assertEqual(wv.flush_size(), 250000)
+        slow.throughput = 1e3
+        self.assertEqual(wv.flush_size(), wv.min_flush_size)
+
+    def test_threaded_send(self):
+        fname = os.path.join(self.path, 'Star.stl')
+        loop = IOLoop(make_current=False)
+        wv = WS_WV_Wrapper(io_loop=loop)
+        sender = STLSender(wv)
+        handlers = [Stub_Handler() for i in range(4)]
+
+        # viewers joining together on worker threads get the scene once each
+        executor = ThreadPoolExecutor(max_workers=len(handlers))
+        futures = [executor.submit(wv.join, handler,
+                                   lambda: sender.send(fname, first=True))
+                   for handler in handlers]
+        for future in futures:
+            future.result()
+        executor.shutdown()
+
+        # the frames are only written once the loop gets to run
+        for handler in handlers:
+            self.assertEqual(handler.stream.data, [])
+        loop.add_callback(loop.stop)
+        loop.start()
+        loop.close()
+
+        # one of them did the first send, the others got the cached scene
+        cached = 2*(1 + len(wv.scene_frames))
+        sizes = sorted(len(handler.stream.data) for handler in handlers)
+        self.assertEqual(sizes[:-1], [cached]*(len(handlers)-1))
+        self.assertTrue(sizes[-1] > cached)
+        for handler in handlers:
+            self.assertTrue(handler.stream.data[1] is wv.init_frame)
+            self.assertEqual(handler.stream.data[-cached+3::2],
+                             wv.scene_frames)
+
+    def test_concurrent_access(self):
+        wv = WV_Test_Wrapper()
+        eye = np.array([0.0, 0.0, 7.0], dtype=np.float32)
+        center = np.array([0.0, 0.0, 0.0], dtype=np.float32)
+        up = np.array([0.0, 1.0, 0.0], dtype=np.float32)
+        wv.createContext(1, 30.0, 1.0, 10.0, eye, center, up)
+        wv.focus = np.array([0.0, 0.0, 0.0, 1.0], dtype=np.float32)
+
+        points = np.array([0, 0, 0, 1, 0, 0, 0, 1, 0], dtype=np.float32)
+        tris = np.array([1, 2, 3], dtype=np.int32)
+        for i in range(10):
+            wv.add_triangle(points, tris, name='fixed_%d' % i)
+
+        nthreads, count = 4, 200
+        errors = []
+        done = threading.Event()
+
+        def add(t):
+            # add GPrims, one at a time and in batches, and remove some
+            for i in range(count):
+                name = 'gprim_%d_%d' % (t, i)
+                if i % 10 == 9:
+                    wv.add_triangles(np.tile(points, 2), np.tile(tris, 2),
+                                     [0, 3, 6], [0, 1, 2],
+                                     [name, name + '_b'])
+                else:
+                    wv.add_triangle(points, tris, name=name)
+                if i % 4 == 3:
+                    with wv.data_access():
+                        wv.remove_GPrim(wv._index_GPrim(name))
+
+        def modify():
+            i = 0
+            while not done.is_set():
+                prim = Stub_Primitive('fixed_%d' % (i % 10), points*(i % 7))
+                wv._mod_primitive(prim, ['points'])
+                i += 1
+
+        def send():
+            # every full send must be a well formed stream
+            while not done.is_set():
+                frames = []
+                wv.begin_sends()
+                try:
+                    wv.send_GPrim(wv, -1, lambda wsi, buf, ibuf:
+                                  frames.append(buf.tobytes()) or 0)
+                finally:
+                    wv.finish_sends()
+                names = [msg.name for frame in frames
+                         for msg, _ in read_frame(frame) if msg.opcode == 1]
+                if len(names) != len(set(names)):
+                    errors.append("a GPrim was sent twice")
+
+        def run(func, *args):
+            try:
+                func(*args)
+            except Exception as err:
+                errors.append(err)
+
+        others = [threading.Thread(target=run, args=(func,))
+                  for func in (modify, send, send)]
+        adders = [threading.Thread(target=run, args=(add, t))
+                  for t in range(nthreads)]
+        for thread in others + adders:
+            thread.start()
+        for thread in adders:
+            thread.join()
+        done.set()
+        for thread in others:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        # everything that was added and not removed is there, once the
+        # removals have been sent
+        wv.begin_sends()
+        wv.send_GPrim(wv, 0, lambda wsi, buf, ibuf: 0)
+        wv.finish_sends()
+        for t in range(nthreads):
+            for i in range(count):
+                name = 'gprim_%d_%d' % (t, i)
+                if i % 4 == 3:
+                    self.assertRaises(RuntimeError, wv._index_GPrim, name)
+                else:
+                    wv._index_GPrim(name)
+                if i % 10 == 9:
+                    wv._index_GPrim(name + '_b')
+        frames = []
+        wv.begin_sends()
+        wv.send_GPrim(wv, -1, lambda wsi, buf, ibuf:
+                      frames.append(buf.tobytes()) or 0)
+        wv.finish_sends()
+        names = [msg.name for frame in frames
+                 for msg, _ in read_frame(frame) if msg.opcode == 1]
+        self.assertEqual(len(names),
+                         10 + nthreads*(count - count//4 + count//10))
+        wv.remove_GPrim(len(names))
+
+        # the thread that is sending may look at and remove GPrims while
+        # another one waits to send
+        def wait_to_send():
+            wv.begin_sends()
+            wv.finish_sends()
+
+        def sending():
+            wv.begin_sends()
+            try:
+                waiter.start()
+                time.sleep(0.2)
+                wv.memory_usage()
+                with wv.data_access():
+                    wv.remove_GPrim(wv._index_GPrim('fixed_0'))
+            finally:
+                wv.finish_sends()
+
+        waiter = threading.Thread(target=run, args=(wait_to_send,))
+        sender = threading.Thread(target=run, args=(sending,))
+        waiter.daemon = sender.daemon = True
+        sender.start()
+        for thread in (sender, waiter):
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(errors, [])
+
+    def test_scene_cache(self):
+        fname = os.path.join(self.path, 'Star.stl')
+        wv = WS_WV_Wrapper()
+        sender = STLSender(wv)
+        wv.open(Stub_Handler())
+        sender.send(fname, first=True)
+
+        cache_dir = os.path.join(self.tdir, 'scenes')
+        cache = SceneCache(max_bytes=2*len(b''.join(wv.scene_frames)),
+                           cache_dir=cache_dir)
+        key = cache.key(fname, 'STLSender', wv.context_params)
+        self.assertEqual(cache.get(key), None)
+        cache.put(key, wv.init_frame, wv.scene_frames)
+        self.assertEqual(cache.get(key), (wv.init_frame, wv.scene_frames))
+
+        # anything that changes the output changes the key
+        self.assertNotEqual(key, cache.key(fname, 'STLSender', None))
+        self.assertEqual(key, SceneCache(hash_content=False).key(
+            fname, 'STLSender', wv.context_params))
+        self.assertNotEqual(key, SceneCache(hash_content=True).key(
+            fname, 'STLSender', wv.context_params))
+
+        # least recently used scenes go first
+        cache.put('a', b'init', [b'x'*100])
+        cache.get(key)
+        cache.put('b', b'init', [b'y'*(cache.max_bytes//2 - 100)])
+        self.assertTrue(key in cache)
+        self.assertFalse('a' in cache)
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertTrue(stats['bytes'] <= cache.max_bytes)
+
+        # a fresh cache finds the scene on disk
+        cache = SceneCache(cache_dir=cache_dir)
+        self.assertEqual(cache.get(key), (wv.init_frame, wv.scene_frames))
+        self.assertEqual(cache.disk_hits, 1)
+
+        # and a new viewer can be sent the cached scene
+        wv = WS_WV_Wrapper()
+        handler = Stub_Handler()
+        wv.open(handler)
+        wv.send_frames(*cache.get(key))
+        self.assertEqual(handler.stream.data[1], wv.init_frame)
+
+    def test_shared_scene_cache(self):
+        # two workers sharing a cache directory, each with a cache of its own
+        cache_dir = os.path.join(self.tdir, 'scenes')
+        first = SceneCache(cache_dir=cache_dir)
+        second = SceneCache(cache_dir=cache_dir)
+        key = first.key(os.path.join(self.path, 'Star.stl'), 'STLSender')
+        scene = (b'init', [b'x'*100, b'y'*100])
+
+        building = threading.Event()
+        def build():
+            self.assertEqual(first.get(key), None)
+            with first.building(key) as found:
+                self.assertEqual(found, None)
+                building.set()
+                time.sleep(0.2)
+                first.put(key, *scene)
+        thread = threading.Thread(target=build)
+        thread.start()
+        building.wait()
+
+        # the second worker waits for the first to build the scene
+        self.assertEqual(second.get(key), None)
+        with second.building(key) as found:
+            self.assertEqual(found, scene)
+        thread.join()
+        self.assertEqual(second.get(key), scene)
+        stats = second.stats()
+        self.assertEqual((stats['hits'], stats['misses'],
+                          stats['disk_hits']), (2, 0, 1))
+
+        # without a directory nothing is shared, or held off
+        with SceneCache().building(key) as found:
+            self.assertEqual(found, None)
+
+    def test_scene_container(self):
+        fname = os.path.join(self.tdir, 'knot.stl')
+        shutil.copy(os.path.join(self.path, 'knot.stl'), fname)
+        status = wvserver.main(['--log-level', 'error', 'compile', fname,
+                                '--buffer-size', '100000'])
+        self.assertEqual(status, 0)
+        container = SceneContainer(os.path.join(self.tdir, 'knot.wvs'))
+
+        # the frames are those of a send of the file
+        wv = WS_WV_Wrapper(buffer_size=100000)
+        handler = Stub_Handler()
+        wv.open(handler)
+        STLSender(wv).send(fname, first=True)
+        frames = [memoryview(f).tobytes() for f in
+                  [container.init_frame] + container.scene_frames]
+        self.assertTrue(len(frames) > 2)
+        self.assertEqual(frames, [wv.init_frame] + wv.scene_frames)
+        self.assertEqual(container.context_params, wv.context_params)
+
+        # the index finds the messages of each GPrim
+        sizes = {}
+        for frame in frames:
+            for name, (nbytes, count) in gprim_sizes(frame).items():
+                name = name.decode('utf-8')
+                sizes[name] = sizes.get(name, 0) + nbytes
+        gprims = container.gprims()
+        self.assertEqual(dict((g['name'], g['bytes']) for g in gprims), sizes)
+        for gprim in gprims:
+            data = container.gprim_data(gprim['name'])
+            self.assertEqual(len(data), gprim['bytes'])
+            names = set(msg.name.split(b'\0', 1)[0]
+                        for msg, arrays in read_frame(data))
+            self.assertEqual(names, set([gprim['name'].encode('utf-8')]))
+        face = [g for g in gprims if g['gtype'] == 2][0]
+        self.assertTrue(-1 <= face['bbox'][3] < face['bbox'][0] <= 1)
+
+        # viewers of either protocol get what a send of the file gives them
+        view = WS_WV_Wrapper()
+        binary = Stub_Handler()
+        compact = Stub_Handler()
+        compact._protocol = COMPACT_PROTOCOL
+        view.open(binary)
+        view.open(compact)
+        sender = ContainerSender(view, obj=container.fname)
+        self.assertTrue(sender.pre_encoded)
+        self.assertTrue(ContainerSender.supports(container.fname))
+        self.assertFalse(ContainerSender.supports(fname))
+        sender.send(container.fname, first=True)
+        self.assertEqual(binary.stream.data[1::2], frames)
+        self.assertEqual(compact.stream.data[1::2],
+                         compact_frames(frames))
+
+        with open(os.path.join(self.tdir, 'bad.wvs'), 'wb') as f:
+            f.write(b'not a container')
+        self.assertRaises(ValueError, SceneContainer,
+                          os.path.join(self.tdir, 'bad.wvs'))
+
+        # the default scene cache of serve is private to the user
+        cache_dir = wvserver.private_cache_dir(self.tdir)
+        self.assertEqual(os.stat(cache_dir).st_mode & 0o777, 0o700)
+        self.assertEqual(wvserver.private_cache_dir(self.tdir), cache_dir)
+        os.chmod(cache_dir, 0o777)
+        self.assertRaises(OSError, wvserver.private_cache_dir, self.tdir)
+        os.rmdir(cache_dir)
+        os.symlink(self.tdir, cache_dir)
+        self.assertRaises(OSError, wvserver.private_cache_dir, self.tdir)
+
+    def test_levels_of_detail(self):
+        # two triangles, a cell takes in both ends of their shared edge
+        points = np.array([0, 0, 0, 1, 0, 0, 0, 1, 0, 1.1, 1, 0],
+                          dtype=np.float32)
+        tris = np.array([1, 2, 3, 2, 4, 3], dtype=np.int32)
+        pts, ctris, weights = cluster_vertices(points, tris, 0.5, np.zeros(3))
+        self.assertEqual(len(pts), 4*3)
+        np.testing.assert_array_equal(pts.reshape(-1, 3)[ctris-1],
+                                      points.reshape(-1, 3)[tris-1])
+        pts, ctris, weights = cluster_vertices(points, tris, 2., np.zeros(3))
+        self.assertEqual(len(ctris), 0)
+        self.assertEqual(len(pts), 0)
+
+        fname = os.path.join(self.path, 'knot.stl')
+        wrapper = Face_Recording_Wrapper()
+        STLGeometryObject(fname).get_visualization_data(wrapper)
+        face = wrapper.faces[0]
+        ntri = len(face['tris'])//3
+        self.assertEqual(build_levels(face['points'], face['tris'], ntri), [])
+        levels = build_levels(face['points'], face['tris'], 1000, 15.)
+        counts = [len(tris)//3 for _, _, tris in levels] + [ntri]
+        self.assertTrue(len(levels) > 1)
+        self.assertTrue(counts[0] <= 1000)
+        for coarse, fine in zip(counts, counts[1:]):
+            self.assertTrue(2*coarse <= fine)
+        for pts, normals, tris in levels:
+            self.assertEqual(len(pts), len(normals))
+            self.assertEqual(tris.min(), 1)
+            self.assertEqual(tris.max(), len(pts)//3)
+
+        # the viewer gets the coarsest level first, then each finer one in
+        # place of the one before
+        cache = LevelCache(cache_dir=os.path.join(self.tdir, 'levels'))
+        wv = WS_WV_Wrapper()
+        handler = Stub_Handler()
+        wv.open(handler)
+        STLSender(wv, lod=1000, lod_cache=cache).send(fname, first=True)
+        messages = [(msg.opcode, msg.name.split(b'\0', 1)[0].decode())
+                    for frame in handler.stream.data[1::2]
+                    for msg, _ in read_frame(frame) if msg.opcode in (1, 2)]
+        names = [level_name(face['name'], depth).split('\0', 1)[0]
+                 for depth in range(len(levels), -1, -1)]
+        expected = [(1, names[0])]
+        for coarse, fine in zip(names, names[1:]):
+            expected += [(2, coarse), (1, fine)]
+        # the first send of a new context has its scene twice
+        self.assertEqual(messages, expected[:1] + expected)
+        self.assertEqual([prim.name for prim in wv.graphics_primitives],
+                         [face['name']])
+        self.assertEqual(wv.face_levels, [])
+
+        # on an IOLoop the first send returns after the coarsest level, and
+        # the finer ones follow on a worker thread
+        loop = IOLoop(make_current=False)
+        wv = WS_WV_Wrapper(io_loop=loop)
+        late = Stub_Handler()
+        sender = STLSender(wv, lod=1000, lod_cache=cache)
+        pending = []
+
+        def send_first():
+            sender.send(fname, first=True)
+            pending.extend(len(entry[1]) for entry in wv.face_levels)
+
+        @gen.coroutine
+        def join():
+            executor = ThreadPoolExecutor(max_workers=1)
+            yield executor.submit(wv.join, late, send_first)
+            executor.shutdown()
+            start = time.time()
+            while (len(late.stream.data) < len(handler.stream.data) and
+                   time.time() - start < 60):
+                yield gen.sleep(0.01)
+
+        loop.run_sync(join)
+        loop.close()
+        self.assertEqual(pending, [len(levels)])
+        self.assertEqual([(msg.opcode, msg.name.split(b'\0', 1)[0].decode())
+                          for frame in late.stream.data[1::2]
+                          for msg, _ in read_frame(frame)
+                          if msg.opcode in (1, 2)], expected[:1] + expected)
+        self.assertEqual(wv.face_levels, [])
+
+        # the levels are built once
+        self.assertEqual(cache.stats()['misses'], 1)
+        cache = LevelCache(cache_dir=cache.cache_dir)
+        wv = WS_WV_Wrapper()
+        wv.open(Stub_Handler())
+        STLSender(wv, lod=1000, lod_cache=cache).send(fname, first=True)
+        self.assertEqual(cache.disk_hits, 1)
+        self.assertEqual(cache.misses, 0)
+
+    def test_incremental_update(self):
+        assembly = Assembly(300)
+        wv = WS_WV_Wrapper()
+        handler = Stub_Handler()
+        wv.open(handler)
+        sender = Assembly_Sender(wv)
+        sender.send(assembly, first=True)
+
+        # move 2% of the parts, staying inside the bounding box
+        moved = range(25, 300, 50)
+        assembly.offsets[moved, 0] += 0.5
+        nframes = len(handler.stream.data)
+        sender.send(assembly)
+        self.assertEqual(len(wv.graphics_primitives), 300)
+
+        update = b''.join(handler.stream.data[nframes+1::2])
+        for i in range(300):
+            self.assertEqual(('part_%03d' % i).encode() in update, i in moved)
+
+        # late joiners get the updated scene, same as a full send
+        late = Stub_Handler()
+        wv.open(late)
+        wv.send_cached(late)
+        fresh = WS_WV_Wrapper()
+        fresh.open(Stub_Handler())
+        Assembly_Sender(fresh).send(assembly, first=True)
+        self.assertTrue(wv.scene_frames == fresh.scene_frames)
+
+        # nothing changed, nothing to send
+        nframes = len(handler.stream.data)
+        sender.send(assembly)
+        self.assertEqual(len(handler.stream.data), nframes)
+
+        # parts come and go
+        assembly.hidden.add(150)
+        sender.send(assembly)
+        update = b''.join(handler.stream.data[nframes+1::2])
+        self.assertTrue(b'part_150' in update)
+        self.assertFalse(b'part_151' in update)
+        self.assertEqual(len(wv.graphics_primitives), 299)
+
+        assembly.hidden.clear()
+        nframes = len(handler.stream.data)
+        sender.send(assembly)
+        update = b''.join(handler.stream.data[nframes+1::2])
+        self.assertTrue(b'part_150' in update)
+        self.assertFalse(b'part_151' in update)
+
+        # a change in connectivity needs a full send
+        old = [copy.copy(prim) for prim in wv.graphics_primitives]
+        old[0].tris = old[0].tris[::-1].copy()
+        self.assertEqual(wv.update_primitives(old), -1)
+
+    def test_view_order(self):
+        # the BVH finds what a test of every box finds
+        rng = np.random.RandomState(1)
+        low = rng.uniform(-1, 1, (1000, 3)).astype(np.float32)
+        boxes = np.hstack([low + rng.uniform(0, 0.1, (1000, 3)), low])
+        camera = Camera([0.5, 0.2, 2.0], [0.3, 0, 0], [0, 1, 0], fov=20.0)
+        planes = camera.planes()
+        normals = planes[:, :3]
+        far = np.where(normals >= 0, boxes[:, None, :3], boxes[:, None, 3:])
+        inside = ((far*normals).sum(axis=2) + planes[:, 3] >= 0).all(axis=1)
+        self.assertTrue(0 < inside.sum() < 1000)
+        self.assertTrue((BVH(boxes, leaf_size=4).frustum(planes) ==
+                         inside).all())
+        first, deferred = view_order(boxes, camera, min_pixels=0)
+        self.assertEqual(sorted(first), list(np.flatnonzero(inside)))
+        self.assertEqual(sorted(np.concatenate([first, deferred])),
+                         list(range(1000)))
+        pixels = camera.pixels(boxes)
+        self.assertTrue((np.diff(pixels[first]) <= 0).all())
+
+        # the parts in view are sent first, the others after them
+        assembly = Assembly(300)
+        wv = WS_WV_Wrapper()
+        wv.send_order = 'view'
+        handler = Stub_Handler()
+        wv.open(handler)
+        sender = Assembly_Sender(wv)
+        sender.on_message(handler, json.dumps(
+            {'camera': {'eye': [0.9, 0, 0.3], 'center': [0.9, 0, 0],
+                        'near': 0.01}}))
+        self.assertEqual(tuple(wv.camera.up), (0, 1, 0))
+        sender.send(assembly, first=True)
+
+        names = [msg.name.split(b'\0', 1)[0].decode()
+                 for frame in handler.stream.data[3::2]
+                 for msg, arrays in read_frame(frame) if msg.name]
+        self.assertEqual(sorted(set(names)),
+                         ['part_%03d' % i for i in range(300)])
+        # the view is about 0.16 wide, parts are 0.0067 apart
+        order = []
+        for name in names:
+            if int(name[5:]) not in order:
+                order.append(int(name[5:]))
+        self.assertTrue(max(order.index(i) for i in range(275, 294)) <
+                        min(order.index(i) for i in range(250)))
+        nscene = len(wv.scene_frames)
+        self.assertEqual(wv.scene_frames, handler.stream.data[-2*nscene+1::2])
+
+        # updates are ordered too, deletions first
+        assembly.hidden.add(10)
+        assembly.offsets[[20, 290], 1] += 0.5
+        nframes = len(handler.stream.data)
+        sender.send(assembly)
+        update = [(msg.opcode, msg.name.split(b'\0', 1)[0])
+                  for frame in handler.stream.data[nframes+1::2]
+                  for msg, arrays in read_frame(frame) if msg.name]
+        names = [name for opcode, name in update]
+        self.assertEqual(names[0], b'part_010')
+        self.assertTrue(names.index(b'part_290') < names.index(b'part_020'))
+
+        # bad camera messages leave the camera as it is
+        camera = wv.camera
+        sender.on_message(handler, '{"camera": {"eye": [1, 2]}}')
+        sender.on_message(handler, 'not json')
+        sender.on_message(handler, '{"camera": {"fov": [30], "eye": {}}}')
+        # nor do those missing keys the context can't fill in
+        params, wv.context_params = wv.context_params, None
+        sender.on_message(handler, '{"camera": {"fov": 20}}')
+        wv.context_params = params
+        self.assertTrue(wv.camera is camera)
+
+    def test_stl_assembly(self):
+        parts = os.path.join(self.tdir, 'parts')
+        os.makedirs(os.path.join(parts, 'sub'))
+        for src, dst in (('knot.stl', 'knot.stl'), ('Star.stl', 'star.stl'),
+                         ('knot.stl', os.path.join('sub', 'knot.stl'))):
+            shutil.copy(os.path.join(self.path, src), os.path.join(parts, dst))
+        manifest = os.path.join(parts, 'parts.json')
+        with open(manifest, 'w') as f:
+            json.dump(['star.stl', 'sub/knot.stl'], f)
+
+        names = ['knot', 'star', 'sub/knot']
+        self.assertEqual([name for _, name in find_parts(parts)], names)
+        self.assertEqual([name for _, name in
+                          find_parts(os.path.join(parts, '*.stl'))],
+                         ['knot', 'star'])
+        self.assertEqual([name for _, name in find_parts(manifest)],
+                         ['star', 'sub/knot'])
+        self.assertTrue(STLAssemblySender.supports(parts))
+        self.assertTrue(STLAssemblySender.supports(parts + '/*.stl'))
+        self.assertFalse(STLSender.supports(parts + '/*.stl'))
+        with open(manifest, 'w') as f:
+            json.dump(['../knot.stl'], f)
+        self.assertRaises(ValueError, find_parts, manifest)
+        os.remove(manifest)
+
+        # a broken part is left out
+        with open(os.path.join(parts, 'broken.stl'), 'w') as f:
+            f.write('solid broken\nfacet normal 0 0 1\nendsolid broken\n')
+
+        # parts are sent as they are parsed, each in an update of its own
+        wv = WS_WV_Wrapper()
+        handler = Stub_Handler()
+        wv.open(handler)
+        STLAssemblySender(wv, interval=0).send(parts, first=True)
+        self.assertEqual(sorted(prim.name for prim in wv.graphics_primitives),
+                         names)
+        sent = b''.join(handler.stream.data[1::2])
+        for name in names:
+            self.assertTrue(name.encode() in sent)
+        self.assertTrue(wv.scene_frames is None)
+
+        knot = Face_Recording_Wrapper()
+        STLGeometryObject(os.path.join(parts, 'sub', 'knot.stl')
+                          ).get_visualization_data(knot, angle=15.)
+        prim = [prim for prim in wv.graphics_primitives
+                if prim.name == 'sub/knot'][0]
+        for key in ('points', 'normals', 'tris'):
+            self.assertTrue(np.array_equal(getattr(prim, key),
+                                           knot.faces[0][key]))
+
+        # parts that are all done within the interval are sent as one
+        wv = WS_WV_Wrapper(stats=PipelineStats())
+        wv.open(Stub_Handler())
+        STLAssemblySender(wv, interval=60).send(parts, first=True)
+        self.assertEqual(len(wv.graphics_primitives), 3)
+        self.assertTrue(wv.scene_frames)
+        self.assertEqual(wv.stats.stages['parse'].calls, 3)
+
+        # parts that are no longer wanted are released as they finish
+        finished = STLAssemblySender(wv)._finished_parts(parts)
+        next(finished)
+        finished.close()
+
+        # a part that doesn't finish is given up on after timeout seconds,
+        # and all that are left once a process of the pool died. The part
+        # of a FIFO is read until the test closes it.
+        hung = os.path.join(self.tdir, 'hung')
+        os.makedirs(hung)
+        fifo = os.path.join(hung, 'hung.stl')
+        os.mkfifo(fifo)
+
+        def open_fifo():
+            # once the part is being read
+            while True:
+                try:
+                    return os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+                except OSError:
+                    time.sleep(0.01)
+
+        pool = pyV3D.assembly._pool
+        pyV3D.assembly._pool = multiprocessing.Pool(1)
+        try:
+            for timeout in (0.5, 600):
+                sender = STLAssemblySender(wv, timeout=timeout)
+                start = time.time()
+                fd = None
+                for part in sender._finished_parts(hung, 0.05):
+                    self.assertEqual(part, None)
+                    if fd is None:
+                        fd = open_fifo()
+                        if timeout == 600:
+                            for worker in pyV3D.assembly._pool._pool:
+                                os.kill(worker.pid, signal.SIGKILL)
+                self.assertTrue(time.time() - start < 10)
+                os.close(fd)
+        finally:
+            pyV3D.assembly._pool.terminate()
+            pyV3D.assembly._pool = pool
+
+        # the arrays of the parts were not left behind in shared memory
+        def left_behind():
+            return [f for f in os.listdir(SHARED_DIR or tempfile.gettempdir())
+                    if f.startswith('pyv3d-') and f.endswith('.part')]
+        deadline = time.time() + 10
+        while left_behind() and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(left_behind())
+
+    def test_gprim_table(self):
+        wrapper = WV_Test_Wrapper()
+        STLSender(wrapper)
+        points = np.array([0, 0, 0, 1, 0, 0, 0, 1, 0], dtype=np.float32)
+        tris = np.array([1, 2, 3], dtype=np.int32)
+        names = ['face_%d' % i for i in range(1000)]
+        for name in names:
+            wrapper.add_triangle(points, tris, name=name)
+
+        for i, name in enumerate(names):
+            self.assertEqual(wrapper._index_GPrim(name), i)
+        self.assertRaises(RuntimeError, wrapper._index_GPrim, 'face_1000')
+        try:
+            wrapper.add_triangle(points, tris, name='face_10')
+        except RuntimeError as err:
+            self.assertTrue('face_10' in str(err))
+        else:
+            self.fail("a GPrim named face_10 was added twice")
+
+        # purging removed GPrims moves the others down
+        for name in names[::2]:
+            wrapper.remove_GPrim(wrapper._index_GPrim(name))
+        # until then their names are taken
+        self.assertRaises(RuntimeError, wrapper.add_triangle, points, tris,
+                          name='face_0')
+        wrapper.begin_sends()
+        wrapper.send_GPrim(wrapper, 0, lambda wsi, buf, ibuf: 0)
+        wrapper.finish_sends()
+        for i, name in enumerate(names[1::2]):
+            self.assertEqual(wrapper._index_GPrim(name), i)
+        self.assertRaises(RuntimeError, wrapper._index_GPrim, 'face_0')
+        wrapper.add_triangle(points, tris, name='face_0')
+        self.assertEqual(wrapper._index_GPrim('face_0'), len(names)//2)
+
+        wrapper.clear()
+        self.assertRaises(RuntimeError, wrapper._index_GPrim, 'face_1')
+        wrapper.add_triangle(points, tris, name='face_1')
+        self.assertEqual(wrapper._index_GPrim('face_1'), 0)
+
+    def test_faces_batch(self):
+        cube = CubeGeometry()
+        names = ['Face %d' % (i+1) for i in range(6)]
+        edge_names = ['Edge %d' % (i+1) for i in range(6)]
+        points = cube.vertices.reshape(-1)
+        tris = np.tile(cube.triangles, 6).astype(np.int32)
+        point_offsets = 4*np.arange(7)
+        tri_offsets = 2*np.arange(7)
+
+        # the same GPrims as one call per face
+        for edges in ('all', 'unique'):
+            wv = WS_WV_Wrapper()
+            CubeSender(wv)
+            for i in range(6):
+                wv.set_face_data(points=cube.vertices[i], tris=cube.triangles,
+                                 colors=cube.colors[i], bbox=cube.bbox,
+                                 name=names[i], edges=edges)
+            for i in range(6):
+                wv.set_edge_data(points=cube.vertices[i], bbox=cube.bbox,
+                                 name=edge_names[i])
+            wv.prepare_for_sends()
+            expected = b''.join(wv._encode(-1))
+            wv.finish_sends()
+
+            wv = WS_WV_Wrapper()
+            CubeSender(wv)
+            wv.set_faces_batch(points, tris, point_offsets, tri_offsets,
+                               names, colors=cube.colors.reshape(-1),
+                               bbox=cube.bbox, edges=edges)
+            wv.set_edges_batch(points, point_offsets, edge_names,
+                               bbox=cube.bbox)
+            self.assertEqual(len(wv.graphics_primitives), 2)
+            wv.prepare_for_sends()
+            self.assertEqual(b''.join(wv._encode(-1)), expected)
+            wv.finish_sends()
+
+        # a removed face stays away on the next full send
+        wv.remove_GPrim(wv._index_GPrim('Face 3'))
+        prims = wv.graphics_primitives
+        wv.clear()
+        wv.graphics_primitives = prims
+        wv.prepare_for_sends()
+        wv.finish_sends()
+        self.assertRaises(RuntimeError, wv._index_GPrim, 'Face 3')
+        self.assertEqual(wv._index_GPrim('Face 4'), 2)
+        self.assertEqual(wv.update_primitives(wv.graphics_primitives), -1)
+
+        # nothing is added unless the whole batch is good
+        wv = WV_Test_Wrapper()
+        CubeSender(wv)
+        bad = tris.copy()
+        bad[-1] = 4
+        self.assertRaises(ConnectivitiesError, wv.add_triangles, points, bad,
+                          point_offsets, tri_offsets, names)
+        self.assertRaises(RuntimeError, wv.add_triangles, points, tris,
+                          point_offsets, tri_offsets, ['Face'] * 6)
+        self.assertRaises(ValueError, wv.add_triangles, points, tris,
+                          point_offsets[::-1], tri_offsets, names)
+        self.assertRaises(ValueError, wv.add_triangles, points, tris,
+                          point_offsets, tri_offsets, names,
+                          colors=cube.colors[:2].reshape(-1))
+        self.assertRaises(RuntimeError, wv._index_GPrim, 'Face 1')
+        wv.add_triangle(cube.vertices[5], cube.triangles, name='Face 6')
+        self.assertRaises(RuntimeError, wv.add_triangles, points, tris,
+                          point_offsets, tri_offsets, names)
+        self.assertRaises(RuntimeError, wv._index_GPrim, 'Face 1')
+        wv.add_triangles(points, tris, point_offsets, tri_offsets, names,
+                         skip=set(['Face 6']))
+        self.assertEqual(wv._index_GPrim('Face 5'), 5)
+
     def test_checkConnectivities(self):
         '''
         Test for geometry with a single face with 4 points and two triangles
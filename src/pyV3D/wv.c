@@ -16,7 +16,6 @@
 #ifdef WIN32
 #include <Windows.h>
 #endif
-#include <unistd.h>
 
 #include "wv.h"
 
@@ -71,6 +70,114 @@ wv_strdup(/*@null@*/ const char *str)
 }
 
 
+/* ************************ Access Control ************************** */
+
+/*
+ * The data routines (adding, modifying and removing GPrims) and the IO
+ * (wv_prepareForSends through wv_finishSends) take turns on a context:
+ *
+ * - data routines wait until no thread is sending, then do their work
+ *   holding the context's mutex, so they are safe to call from any thread.
+ * - a send waits until no data transaction (wv_beginData/wv_endData) is
+ *   open. Transactions keep GPrim indices valid across calls, because only
+ *   wv_finishSends moves GPrims. Waiting sends hold off new transactions,
+ *   except those of the thread that is sending, which they wait for anyway.
+ * - looking up names only needs the mutex and may overlap with sends.
+ *
+ * The thread that is sending may itself call the data routines, which
+ * then do not wait, but not from within the callback of wv_sendGPrim.
+ */
+
+#ifdef WIN32
+#define wv_mutexInit(m)     InitializeCriticalSection(m)
+#define wv_mutexDestroy(m)  DeleteCriticalSection(m)
+#define wv_mutexLock(m)     EnterCriticalSection(m)
+#define wv_mutexUnlock(m)   LeaveCriticalSection(m)
+#define wv_condInit(c)      InitializeConditionVariable(c)
+#define wv_condDestroy(c)
+#define wv_condWait(c, m)   SleepConditionVariableCS(c, m, INFINITE)
+#define wv_condWakeAll(c)   WakeAllConditionVariable(c)
+#define wv_thisThread()     GetCurrentThreadId()
+#define wv_sameThread(a, b) ((a) == (b))
+#else
+#define wv_mutexInit(m)     pthread_mutex_init(m, NULL)
+#define wv_mutexDestroy(m)  pthread_mutex_destroy(m)
+#define wv_mutexLock(m)     pthread_mutex_lock(m)
+#define wv_mutexUnlock(m)   pthread_mutex_unlock(m)
+#define wv_condInit(c)      pthread_cond_init(c, NULL)
+#define wv_condDestroy(c)   pthread_cond_destroy(c)
+#define wv_condWait(c, m)   pthread_cond_wait(c, m)
+#define wv_condWakeAll(c)   pthread_cond_broadcast(c)
+#define wv_thisThread()     pthread_self()
+#define wv_sameThread(a, b) pthread_equal(a, b)
+#endif
+
+
+/* is this thread sending? must hold the mutex */
+static int
+wv_selfSending(wvContext *cntxt)
+{
+  return (cntxt->ioAccess != 0) &&
+         wv_sameThread(cntxt->ioThread, wv_thisThread());
+}
+
+
+/* is another thread sending? must hold the mutex */
+static int
+wv_othersSending(wvContext *cntxt)
+{
+  return (cntxt->ioAccess != 0) &&
+         !wv_sameThread(cntxt->ioThread, wv_thisThread());
+}
+
+
+/* take the mutex once no other thread is sending, for the data routines */
+static void
+wv_lockData(wvContext *cntxt)
+{
+  wv_mutexLock(&cntxt->lock);
+  while (wv_othersSending(cntxt))
+    wv_condWait(&cntxt->released, &cntxt->lock);
+}
+
+
+static void
+wv_unlockData(wvContext *cntxt)
+{
+  wv_mutexUnlock(&cntxt->lock);
+}
+
+
+/* 
+ * opens a data transaction: no sends start until it is closed with
+ * wv_endData. Transactions may be open in several threads at once.
+ */
+void
+wv_beginData(wvContext *cntxt)
+{
+  if (cntxt == NULL) return;
+
+  wv_mutexLock(&cntxt->lock);
+  while (wv_othersSending(cntxt) ||
+         ((cntxt->ioWaiting != 0) && !wv_selfSending(cntxt)))
+    wv_condWait(&cntxt->released, &cntxt->lock);
+  cntxt->dataAccess += 1;
+  wv_mutexUnlock(&cntxt->lock);
+}
+
+
+void
+wv_endData(wvContext *cntxt)
+{
+  if (cntxt == NULL) return;
+
+  wv_mutexLock(&cntxt->lock);
+  if (cntxt->dataAccess > 0) cntxt->dataAccess -= 1;
+  if (cntxt->dataAccess == 0) wv_condWakeAll(&cntxt->released);
+  wv_mutexUnlock(&cntxt->lock);
+}
+
+
 static void
 wv_freeStripe(wvStripe stripe, int num)
 {
@@ -86,6 +193,14 @@ wv_freeStripe(wvStripe stripe, int num)
 }
 
 
+/* frees an array of a GPrim unless it was borrowed */
+static void
+wv_freeData(wvGPrim *gp, int VBOtype, /*@null@*/ /*@only@*/ void *ptr)
+{
+  if ((gp->borrowed&VBOtype) == 0) wv_free(ptr);
+}
+
+
 void
 wv_freeGPrim(wvGPrim gprim)
 {
@@ -95,12 +210,12 @@ wv_freeGPrim(wvGPrim gprim)
     wv_freeStripe(gprim.stripes[i], gprim.nStripe);
   wv_free(gprim.stripes);
   wv_free(gprim.name);
-  wv_free(gprim.vertices);
-  wv_free(gprim.normals);
+  wv_freeData(&gprim, WV_VERTICES, gprim.vertices);
+  wv_freeData(&gprim, WV_NORMALS,  gprim.normals);
   wv_free(gprim.colors);
-  wv_free(gprim.indices);
-  wv_free(gprim.lIndices);
-  wv_free(gprim.pIndices);
+  wv_freeData(&gprim, WV_INDICES,  gprim.indices);
+  wv_freeData(&gprim, WV_LINDICES, gprim.lIndices);
+  wv_freeData(&gprim, WV_PINDICES, gprim.pIndices);
 }
 
 
@@ -116,6 +231,9 @@ wv_destroyContext(wvContext **context)
       wv_freeGPrim(cntxt->gPrims[i]);
     wv_free(cntxt->gPrims);
   }
+  wv_free(cntxt->nameHash);
+  wv_condDestroy(&cntxt->released);
+  wv_mutexDestroy(&cntxt->lock);
 
   wv_free(cntxt);
   *context = NULL;
@@ -133,6 +251,9 @@ wv_createContext(int bias, float fov, float zNear, float zFar, float *eye,
 
   context->ioAccess   = 0;
   context->dataAccess = 0;
+  context->ioWaiting  = 0;
+  wv_mutexInit(&context->lock);
+  wv_condInit(&context->released);
   context->bias       = bias;
   context->fov        = fov;
   context->zNear      = zNear;
@@ -150,6 +271,8 @@ wv_createContext(int bias, float fov, float zNear, float zFar, float *eye,
   context->nGPrim     = 0;
   context->mGPrim     = 0;
   context->gPrims     = NULL;
+  context->mHash      = 0;
+  context->nameHash   = NULL;
 
   return context;
 }
@@ -160,11 +283,91 @@ wv_removeAll(wvContext *cntxt)
 {
   int i;
 
+  wv_lockData(cntxt);
   if (cntxt->gPrims != NULL)
     for (i = 0; i < cntxt->nGPrim; i++)
       wv_freeGPrim(cntxt->gPrims[i]);
+  if (cntxt->nameHash != NULL)
+    for (i = 0; i < cntxt->mHash; i++) cntxt->nameHash[i] = -1;
   cntxt->nGPrim   = 0;
   cntxt->cleanAll = 1;
+  wv_unlockData(cntxt);
+}
+
+
+/* ********************** GPrim Name Index ************************** */
+
+/* FNV-1a */
+static unsigned int
+wv_hashName(const char *name)
+{
+  unsigned int hash = 2166136261u;
+
+  while (*name != 0) {
+    hash ^= (unsigned char) *name++;
+    hash *= 16777619u;
+  }
+  return hash;
+}
+
+
+static void
+wv_hashGPrim(wvContext *cntxt, int index)
+{
+  int slot, mask;
+
+  mask = cntxt->mHash - 1;
+  slot = wv_hashName(cntxt->gPrims[index].name) & mask;
+  while (cntxt->nameHash[slot] != -1) slot = (slot+1) & mask;
+  cntxt->nameHash[slot] = index;
+}
+
+
+/* 
+ * rebuilds the name index for all gPrims, sized to stay at most half full
+ *
+ * if it can't be allocated lookups fall back to a linear search
+ */
+static void
+wv_rehashGPrims(wvContext *cntxt)
+{
+  int i, mHash;
+
+  mHash = 16;
+  while (mHash < 2*(cntxt->nGPrim+1)) mHash *= 2;
+  if ((mHash != cntxt->mHash) || (cntxt->nameHash == NULL)) {
+    wv_free(cntxt->nameHash);
+    cntxt->mHash    = 0;
+    cntxt->nameHash = (int *) wv_alloc(mHash*sizeof(int));
+    if (cntxt->nameHash == NULL) return;
+    cntxt->mHash    = mHash;
+  }
+
+  for (i = 0; i < mHash; i++) cntxt->nameHash[i] = -1;
+  for (i = 0; i < cntxt->nGPrim; i++) wv_hashGPrim(cntxt, i);
+}
+
+
+static int
+wv_findGPrim(wvContext *cntxt, const char *name)
+{
+  int i, slot, mask;
+
+  if (cntxt->gPrims == NULL) return -2;
+
+  if (cntxt->nameHash == NULL) {
+    for (i = 0; i < cntxt->nGPrim; i++)
+      if (strcmp(name, cntxt->gPrims[i].name) == 0) return i;
+    return -2;
+  }
+
+  mask = cntxt->mHash - 1;
+  slot = wv_hashName(name) & mask;
+  while ((i = cntxt->nameHash[slot]) != -1) {
+    if (strcmp(name, cntxt->gPrims[i].name) == 0) return i;
+    slot = (slot+1) & mask;
+  }
+  return -2;
 }
 
 
@@ -343,6 +546,41 @@ wv_setData(int type, int len, void *data, int VBOtype, wvData *dstruct)
 }
 
 
+/* like wv_setData for 32 bit float vertices and normals and 32 bit int
+ * indices, but the GPrim uses data in place instead of a copy. The caller
+ * keeps data alive, and unchanged, until the GPrim is freed or the item is
+ * replaced with wv_modGPrim
+ */
+int
+wv_borrowData(int len, void *data, int VBOtype, wvData *dstruct)
+{
+  if ((len == 1) && (VBOtype == WV_NORMALS))
+    return wv_setData(WV_REAL32, len, data, VBOtype, dstruct);
+
+  dstruct->dataType = 0;
+  dstruct->dataLen  = len;
+  dstruct->dataPtr  = NULL;
+  dstruct->data[0]  = 0.0;
+  dstruct->data[1]  = 0.0;
+  dstruct->data[2]  = 0.0;
+  if (len <= 0) return -4;
+  switch (VBOtype) {
+    case WV_VERTICES:
+    case WV_NORMALS:
+    case WV_INDICES:
+    case WV_PINDICES:
+    case WV_LINDICES:
+      break;
+    default:
+      return -2;
+  }
+
+  dstruct->dataPtr  = data;
+  dstruct->dataType = VBOtype|WV_BORROWED;
+  return 0;
+}
+
+
 void
 wv_adjustVerts(wvData *dstruct, float *focus)
 {
@@ -399,12 +637,13 @@ wv_fixupLineData(wvGPrim *gp, int nstripe, wvStripe *stripes, int *lmark, int bi
   if (gp->normals != NULL) {
     ftmp = (float *) wv_realloc(stripes[nstripe-1].normals, 3*nslen*sizeof(float));
     if (ftmp == NULL) return;
-    stripes[i].normals = ftmp;
+    stripes[nstripe-1].normals = ftmp;
   }
   if (gp->colors != NULL) {
     ctmp = (unsigned char *) wv_realloc(stripes[nstripe-1].colors, 
                                         3*nslen*sizeof(unsigned char));
     if (ctmp == NULL) return;
+    stripes[nstripe-1].colors = ctmp;
   }
   
   nsline = stripes[nstripe-1].nlIndices + 2*cnt;
@@ -465,10 +704,69 @@ wv_fixupLineData(wvGPrim *gp, int nstripe, wvStripe *stripes, int *lmark, int bi
 }
 
 
+/* number of vertices of the primitive at indices[j], unit indices long,
+ * that are not stamped n yet, counting each vertex once */
+static int
+wv_newVerts(wvGPrim *gp, int bias, int j, int unit, int *stamp, int n)
+{
+  int i, k, m, add;
+
+  for (add = k = 0; (k < unit) && (j+k < gp->nIndex); k++) {
+    m = gp->indices[j+k] - bias;
+    if (stamp[m] == n) continue;
+    for (i = 0; i < k; i++)
+      if (gp->indices[j+i] == gp->indices[j+k]) break;
+    if (i == k) add++;
+  }
+  return add;
+}
+
+
+/* cut the indices of an indexed GPrim into stripes of whole primitives,
+ * unit indices each, that use at most maxLen vertices. Primitives are
+ * taken in order and a stripe holds as many as fit, which for meshes that
+ * share vertices are many more than maxLen indices.
+ *
+ * where: stamp  - scratch space of nVerts ints
+ *        starts - returns the start of each stripe in indices followed by
+ *                 nIndex, room for nIndex/unit+2 ints
+ *
+ * returns the number of stripes */
+static int
+wv_stripeStarts(wvGPrim *gp, int bias, int maxLen, int unit, int *stamp,
+                int *starts)
+{
+  int j, k, n, cnt, add;
+
+  if (gp->nIndex == 0) {
+    starts[0] = 0;
+    return 0;
+  }
+  for (k = 0; k < gp->nVerts; k++) stamp[k] = -1;
+
+  starts[0] = 0;
+  for (n = cnt = j = 0; j < gp->nIndex; j += unit) {
+    add = wv_newVerts(gp, bias, j, unit, stamp, n);
+    if (cnt+add > maxLen) {
+      n++;
+      starts[n] = j;
+      cnt = 0;
+      add = wv_newVerts(gp, bias, j, unit, stamp, n);
+    }
+    for (k = 0; (k < unit) && (j+k < gp->nIndex); k++)
+      stamp[gp->indices[j+k]-bias] = n;
+    cnt += add;
+  }
+  starts[n+1] = gp->nIndex;
+  return n+1;
+}
+
+
 static int
 wv_makeStripes(wvGPrim *gp, int bias)
 {
-  int            i, j, k, m, maxLen, cnt, len, nstripe, *index, *lmark;
+  int            i, j, k, m, n, maxLen, cnt, len, nstripe, *index, *lmark;
+  int            unit, *starts;
   unsigned short *i2, *il2, *ip2;
   wvStripe       *stripes;
 
@@ -799,19 +1097,22 @@ wv_makeStripes(wvGPrim *gp, int bias)
         
         } else {
         
-          index = (int *) wv_alloc((gp->nVerts+gp->nIndex)*sizeof(int));
+          /* the starts of the stripes follow the scratch space */
+          unit  = (gp->gtype == WV_TRIANGLE) ? 3 : 2;
+          index = (int *) wv_alloc((gp->nVerts+gp->nIndex+gp->nIndex/unit+2)*
+                                   sizeof(int));
           if (index == NULL) return -1;
-          nstripe = gp->nIndex/maxLen;
-          if (nstripe*maxLen != gp->nIndex) nstripe++;
+          starts  = index + gp->nVerts + gp->nIndex;
+          nstripe = wv_stripeStarts(gp, bias, maxLen, unit, index, starts);
           stripes = (wvStripe *) wv_alloc(nstripe*sizeof(wvStripe));
           if (stripes == NULL) {
             wv_free(index);
             return -1;
           }
-          for (j = i = 0; i < nstripe; i++, j+=maxLen) {
+          for (i = 0; i < nstripe; i++) {
             for (k = 0; k < gp->nVerts; k++) index[k] = -1;
-            len = maxLen;
-            if (i == nstripe-1) len = gp->nIndex - j;
+            j   = starts[i];
+            len = starts[i+1] - j;
             for (cnt = k = 0; k < len; k++) {
               m = gp->indices[j+k] - bias;
               if (index[m] == -1) {
@@ -1141,23 +1442,25 @@ wv_makeStripes(wvGPrim *gp, int bias)
         
         } else {
         
-          index = (int *) wv_alloc((gp->nVerts+gp->nIndex)*sizeof(int));
+          /* the starts of the stripes follow the scratch space */
+          index = (int *) wv_alloc((gp->nVerts+gp->nIndex+gp->nIndex/3+2)*
+                                   sizeof(int));
           if (index == NULL) {
             wv_free(lmark);
             return -1;
           }
-          nstripe = gp->nIndex/maxLen;
-          if (nstripe*maxLen != gp->nIndex) nstripe++;
+          starts  = index + gp->nVerts + gp->nIndex;
+          nstripe = wv_stripeStarts(gp, bias, maxLen, 3, index, starts);
           stripes = (wvStripe *) wv_alloc(nstripe*sizeof(wvStripe));
           if (stripes == NULL) {
             wv_free(index);
             wv_free(lmark);
             return -1;
           }
-          for (j = i = 0; i < nstripe; i++, j+=maxLen) {
+          for (i = 0; i < nstripe; i++) {
             for (k = 0; k < gp->nVerts; k++) index[k] = -1;
-            len = maxLen;
-            if (i == nstripe-1) len = gp->nIndex - j;
+            j   = starts[i];
+            len = starts[i+1] - j;
             for (cnt = k = 0; k < len; k++) {
               m = gp->indices[j+k] - bias;
               if (index[m] == -1) {
@@ -1349,11 +1652,10 @@ wv_makeStripes(wvGPrim *gp, int bias)
               for (cnt = k = 0; k < gp->nlIndex/2; k++) {
                 if (lmark[k] != -1) continue;
                 m = gp->lIndices[2*k  ]-bias;
-                if (index[m] == -1) continue;
+                n = gp->lIndices[2*k+1]-bias;
+                if ((index[m] == -1) || (index[n] == -1)) continue;
                 stripes[i].lIndice2[2*cnt  ] = index[m];
-                m = gp->lIndices[2*k+1]-bias;
-                if (index[m] == -1) continue;
-                stripes[i].lIndice2[2*cnt+1] = index[m];
+                stripes[i].lIndice2[2*cnt+1] = index[n];
                 lmark[k] = i;
                 cnt++;
               }
@@ -1578,15 +1880,72 @@ wv_printGPrim(wvContext *cntxt, int index)
 int
 wv_indexGPrim(wvContext *cntxt, char *name)
 {
-  int i;
+  int index;
 
   if (name == NULL) return -3;
-  
-  if (cntxt->gPrims != NULL)
-    for (i = 0; i < cntxt->nGPrim; i++)
-      if (strcmp(name, cntxt->gPrims[i].name) == 0) return i;
-      
-  return -2;
+
+  wv_mutexLock(&cntxt->lock);
+  index = wv_findGPrim(cntxt, name);
+  wv_mutexUnlock(&cntxt->lock);
+  return index;
+}
+
+
+/*
+ * copies the name of a GPrim into name, which has room for len chars, and
+ * returns its full length -- like snprintf
+ */
+int
+wv_nameGPrim(wvContext *cntxt, int index, char *name, int len)
+{
+  int  stat = -3;
+  char *nam;
+
+  if (len <= 0) return -3;
+  wv_mutexLock(&cntxt->lock);
+  if ((index >= 0) && (index < cntxt->nGPrim) && (cntxt->gPrims != NULL)) {
+    nam  = cntxt->gPrims[index].name;
+    stat = strlen(nam);
+    strncpy(name, nam, len-1);
+    name[len-1] = 0;
+  }
+  wv_mutexUnlock(&cntxt->lock);
+  return stat;
+}
+
+
+int
+wv_setLineWidth(wvContext *cntxt, int index, float width)
+{
+  int stat = -3;
+
+  wv_lockData(cntxt);
+  if ((index >= 0) && (index < cntxt->nGPrim) && (cntxt->gPrims != NULL)) {
+    cntxt->gPrims[index].lWidth = width;
+    stat = index;
+  }
+  wv_unlockData(cntxt);
+  return stat;
+}
+
+
+/* the bounding box of the vertices, maxima then minima as get_bounding_box
+ * in pyV3D gives it */
+static void
+wv_boundGPrim(wvGPrim *gp)
+{
+  int   i, j;
+  float *v = gp->vertices;
+
+  for (j = 0; j < 3; j++) {
+    gp->box[j]   = v[j];
+    gp->box[j+3] = v[j];
+  }
+  for (i = 1; i < gp->nVerts; i++)
+    for (j = 0; j < 3; j++) {
+      if (v[3*i+j] > gp->box[j])   gp->box[j]   = v[3*i+j];
+      if (v[3*i+j] < gp->box[j+3]) gp->box[j+3] = v[3*i+j];
+    }
 }
 
 
@@ -1594,10 +1953,10 @@ int
 wv_addGPrim(wvContext *cntxt, char *name, int gtype, int attrs, 
             int nItems, wvData *items)
 {
-  int     i, nameLen, type, *cnt;
+  int     i, nameLen, type, mGPrim, *cnt;
   char    *nam;
   float   *norm;
-  wvGPrim *gp;
+  wvGPrim gprim, *gp;
 
   if (name == NULL) {
     fprintf(stderr, "name is NULL in wv_addGPrim\n");
@@ -1609,13 +1968,8 @@ wv_addGPrim(wvContext *cntxt, char *name, int gtype, int attrs,
     return -3;
   }
 
-  if (cntxt->gPrims != NULL) {
-    for (i = 0; i < cntxt->nGPrim; i++) {
-       if (strcmp(name, cntxt->gPrims[i].name) == 0) {
-        fprintf(stderr, "name %s is not unique in GPrims\n", name);
-        return -2;
-      }
-    }
+  if (wv_indexGPrim(cntxt, name) >= 0) {
+    return -2;
   }
 
   nameLen += 4 - nameLen%4;
@@ -1627,31 +1981,11 @@ wv_addGPrim(wvContext *cntxt, char *name, int gtype, int attrs,
     nam[i] = name[i];
   }
 
-  while (cntxt->ioAccess != 0) usleep(10000);
-  cntxt->dataAccess = 1;
-  if (cntxt->nGPrim == cntxt->mGPrim) {
-    if (cntxt->nGPrim == 0) {
-      gp = (wvGPrim *) wv_alloc(sizeof(wvGPrim));
-    } else {
-      gp = (wvGPrim *) wv_realloc( cntxt->gPrims,
-                                  (cntxt->mGPrim+1)*sizeof(wvGPrim));
-    }
-    if (gp == NULL) {
-      wv_free(nam);
-      return -1;
-    }
-    cntxt->mGPrim += 1;
-    cntxt->gPrims  = gp;
-  }
-  if (cntxt->gPrims == NULL) {
-    wv_free(nam);
-    return -1;
-  }
-  gp = &cntxt->gPrims[cntxt->nGPrim];
-  cntxt->dataAccess = 0;
-
+  /* the GPrim is built on the side, other threads may use the table */
+  gp = &gprim;
   gp->gtype     = gtype;
   gp->updateFlg = WV_PCOLOR;            /* all sub-data types (new) */
+  gp->borrowed  = 0;
   gp->attrs     = attrs;
   gp->nVerts    = 0;
   gp->nIndex    = 0;
@@ -1684,7 +2018,8 @@ wv_addGPrim(wvContext *cntxt, char *name, int gtype, int attrs,
   
   /* parse through the data items and store away */
   for (i = 0; i < nItems; i++) {
-    type = items[i].dataType;
+    type = items[i].dataType&~WV_BORROWED;
+    if ((items[i].dataType&WV_BORROWED) != 0) gp->borrowed |= type;
     switch (type) {
       case WV_VERTICES:
         if (gp->nVerts == 0) {
@@ -1780,6 +2115,7 @@ wv_addGPrim(wvContext *cntxt, char *name, int gtype, int attrs,
     wv_free(nam);
     return -5;
   }
+  wv_boundGPrim(gp);
 
   /* do we need to compute normals? */
   norm = NULL;
@@ -1823,12 +2159,41 @@ wv_addGPrim(wvContext *cntxt, char *name, int gtype, int attrs,
     items[i].dataPtr  = NULL;
   }
   
-  while (cntxt->ioAccess != 0) usleep(10000);
-  cntxt->dataAccess = 1;
+  wv_lockData(cntxt);
+  /* another thread may have taken the name meanwhile */
+  if (wv_findGPrim(cntxt, name) >= 0) {
+    wv_unlockData(cntxt);
+    wv_freeGPrim(gprim);
+    return -2;
+  }
+  if (cntxt->nGPrim == cntxt->mGPrim) {
+    /* grow geometrically so adding n gPrims copies O(n) of them */
+    mGPrim = (cntxt->mGPrim < 8) ? 8 : 2*cntxt->mGPrim;
+    if (cntxt->nGPrim == 0) {
+      gp = (wvGPrim *) wv_alloc(mGPrim*sizeof(wvGPrim));
+    } else {
+      gp = (wvGPrim *) wv_realloc( cntxt->gPrims,
+                                  mGPrim*sizeof(wvGPrim));
+    }
+    if (gp == NULL) {
+      wv_unlockData(cntxt);
+      wv_freeGPrim(gprim);
+      return -1;
+    }
+    cntxt->mGPrim  = mGPrim;
+    cntxt->gPrims  = gp;
+  }
+  cntxt->gPrims[cntxt->nGPrim] = gprim;
   cntxt->nGPrim += 1;
-  cntxt->dataAccess = 0;
+  if (2*cntxt->nGPrim > cntxt->mHash) {
+    wv_rehashGPrims(cntxt);
+  } else {
+    wv_hashGPrim(cntxt, cntxt->nGPrim-1);
+  }
+  i = cntxt->nGPrim-1;
+  wv_unlockData(cntxt);
 
-  return cntxt->nGPrim-1;
+  return i;
 }
 
 
@@ -1874,11 +2239,12 @@ wv_triNorms(float *verts, float *norms)
 }
 
 
-int
-wv_addArrowHeads(wvContext *cntxt, int index, float size, 
-                 int nHeads, int *heads)
+/* adds arrow heads to a line GPrim, holding the mutex */
+static int
+wv_makeArrowHeads(wvContext *cntxt, int index, float size, 
+                  int nHeads, int *heads)
 {
-  int     i, j, nh;
+  int     i, j;
   float   hpt[3], tpt[3], sprd, spread = 0.20;
   float   axn[3], ayn[3], azn[3], base[3], dis, *norm;
   wvGPrim *gp;
@@ -1901,7 +2267,7 @@ wv_addArrowHeads(wvContext *cntxt, int index, float size,
   norm = (float *) wv_alloc(12*6*nHeads*sizeof(float));
   if (norm == NULL) return -1;
   
-  for (nh = i = 0; i < nHeads; i++) {
+  for (i = 0; i < nHeads; i++) {
     for (j = 0; j < 36; j++) norm[36*i+j] = norm[36*i+j+36*nHeads] = 0.0;
     if (gp->indices == NULL) {
       if (heads[i] > 0) {
@@ -2019,7 +2385,21 @@ wv_addArrowHeads(wvContext *cntxt, int index, float size,
 
 
 int
-wv_modGPrim(wvContext *cntxt, int index, int nItems, wvData *items)
+wv_addArrowHeads(wvContext *cntxt, int index, float size, 
+                 int nHeads, int *heads)
+{
+  int stat;
+
+  wv_lockData(cntxt);
+  stat = wv_makeArrowHeads(cntxt, index, size, nHeads, heads);
+  wv_unlockData(cntxt);
+  return stat;
+}
+
+
+/* modifies a GPrim, holding the mutex */
+static int
+wv_modifyGPrim(wvContext *cntxt, int index, int nItems, wvData *items)
 {
   int     i, type, vlen, *cnt, norm = 0;
   float   *normals;
@@ -2030,7 +2410,8 @@ wv_modGPrim(wvContext *cntxt, int index, int nItems, wvData *items)
   gp   = &cntxt->gPrims[index];
   vlen = -1;
   for (i = 0; i < nItems; i++)
-    if (items[i].dataType == WV_VERTICES) vlen = items[i].dataLen;
+    if ((items[i].dataType&~WV_BORROWED) == WV_VERTICES)
+      vlen = items[i].dataLen;
   if (vlen == -1) {
     vlen = gp->nVerts;
     if (gp->normals != NULL) norm = 1;
@@ -2038,7 +2419,7 @@ wv_modGPrim(wvContext *cntxt, int index, int nItems, wvData *items)
     /* if we had stuff it better be replaced! */
     if (gp->colors != NULL) {
       for (i = 0; i < nItems; i++)
-        if (items[i].dataType == WV_COLORS) {
+        if ((items[i].dataType&~WV_BORROWED) == WV_COLORS) {
           if (items[i].dataLen != vlen) return -4;
           break;
         }
@@ -2046,34 +2427,33 @@ wv_modGPrim(wvContext *cntxt, int index, int nItems, wvData *items)
     }
     if (gp->normals != NULL) {
       for (i = 0; i < nItems; i++)
-        if (items[i].dataType == WV_NORMALS) {
+        if ((items[i].dataType&~WV_BORROWED) == WV_NORMALS) {
           if (items[i].dataLen != vlen) return -4;
           norm = 1;
           break;
         }
     }
     if (gp->colors  != NULL) wv_free(gp->colors);
-    if (gp->normals != NULL) wv_free(gp->normals);
-    gp->colors  = NULL;
-    gp->normals = NULL;
+    if (gp->normals != NULL) wv_freeData(gp, WV_NORMALS, gp->normals);
+    gp->colors    = NULL;
+    gp->normals   = NULL;
+    gp->borrowed &= ~WV_NORMALS;
   }
-  
-  while (cntxt->ioAccess != 0) usleep(10000);
-  cntxt->dataAccess = 1;
 
   gp->updateFlg = 0;
   for (i = 0; i < nItems; i++) {
     if (items[i].dataLen == 1) continue;
-    type = items[i].dataType;
+    type = items[i].dataType&~WV_BORROWED;
     gp->updateFlg |= type;
     switch (type) {
       case WV_VERTICES:
-        wv_free(gp->vertices);
+        wv_freeData(gp, type, gp->vertices);
         gp->nVerts   = vlen;
         gp->vertices = (float *) items[i].dataPtr;
+        wv_boundGPrim(gp);
         break;
       case WV_INDICES:
-        wv_free(gp->indices);
+        wv_freeData(gp, type, gp->indices);
         gp->nIndex  = items[i].dataLen;
         gp->indices = (int *) items[i].dataPtr;
         break;
@@ -2084,16 +2464,18 @@ wv_modGPrim(wvContext *cntxt, int index, int nItems, wvData *items)
         gp->normals = (float *) items[i].dataPtr;
         break;
       case WV_PINDICES:
-        wv_free(gp->pIndices);
+        wv_freeData(gp, type, gp->pIndices);
         gp->npIndex  = items[i].dataLen;
         gp->pIndices = (int *) items[i].dataPtr;
         break;
       case WV_LINDICES:
-        wv_free(gp->lIndices);
+        wv_freeData(gp, type, gp->lIndices);
         gp->nlIndex  = items[i].dataLen;
         gp->lIndices = (int *) items[i].dataPtr;
         break;
     }
+    gp->borrowed &= ~type;
+    if ((items[i].dataType&WV_BORROWED) != 0) gp->borrowed |= type;
   }
   
   /* compute new normals? */
@@ -2131,35 +2513,45 @@ wv_modGPrim(wvContext *cntxt, int index, int nItems, wvData *items)
     items[i].dataLen  = 0;
     items[i].dataPtr  = NULL;
   }
-  cntxt->dataAccess = 0;
 
   return index;
 }
 
 
+int
+wv_modGPrim(wvContext *cntxt, int index, int nItems, wvData *items)
+{
+  int stat;
+
+  wv_lockData(cntxt);
+  stat = wv_modifyGPrim(cntxt, index, nItems, items);
+  wv_unlockData(cntxt);
+  return stat;
+}
+
+
 void
 wv_removeGPrim(wvContext *cntxt, int index)
 {
-  if ((index >= cntxt->nGPrim) || (index < 0)) return;
-  if (cntxt->gPrims == NULL) return;
-  
-  while (cntxt->ioAccess != 0) usleep(10000);
-  cntxt->dataAccess = 1;
-  cntxt->gPrims[index].updateFlg = WV_DELETE;
-  cntxt->dataAccess = 0;
+  wv_lockData(cntxt);
+  if ((index < cntxt->nGPrim) && (index >= 0) && (cntxt->gPrims != NULL))
+    cntxt->gPrims[index].updateFlg = WV_DELETE;
+  wv_unlockData(cntxt);
 }
 
 /* *********************** Server Functions ************************* */
 
 
-static void
-wv_writeBuf(void *wsi, unsigned char *buf, int npack, int *iBuf,
+/* makes room for a message of npack bytes, returns -3 if it does not fit
+   even in an empty buffer */
+static int
+wv_writeBuf(void *wsi, unsigned char *buf, int bufLen, int npack, int *iBuf,
             cy_callback wv_sendBinaryData,
             void* callback)
 {
-  if (*iBuf+npack <= BUFLEN-4) return;
+  if (npack > bufLen-4) return -3;
+  if (*iBuf+npack <= bufLen-4) return 0;
   
-  printf("  iBuf = %d, BUFLEN = %d\n", *iBuf, BUFLEN);
   buf[*iBuf  ] = 0;
   buf[*iBuf+1] = 0;
   buf[*iBuf+2] = 0;
@@ -2168,11 +2560,12 @@ wv_writeBuf(void *wsi, unsigned char *buf, int npack, int *iBuf,
   if (wv_sendBinaryData(wsi, buf, *iBuf, callback) < 0)
     fprintf(stderr, "ERROR Sending Binary Data");
   *iBuf = 0;
+  return 0;
 }
 
 
-static void
-wv_writeGPrim(wvGPrim *gp, void *wsi, unsigned char *buf, int *iBuf,
+static int
+wv_writeGPrim(wvGPrim *gp, void *wsi, unsigned char *buf, int bufLen, int *iBuf,
             cy_callback wv_sendBinaryData, 
             void* callback)
 {
@@ -2206,11 +2599,8 @@ wv_writeGPrim(wvGPrim *gp, void *wsi, unsigned char *buf, int *iBuf,
       npack += 3*4*gp->nlIndex + 4;
       vflag |= WV_NORMALS;
     }
-    wv_writeBuf(wsi, buf, npack, iBuf, wv_sendBinaryData, callback);
-    if (npack > BUFLEN) {
-      printf(" Oops! npack = %d  BUFLEN = %d\n", npack, BUFLEN);
-      exit(1);
-    }
+    if (wv_writeBuf(wsi, buf, bufLen, npack, iBuf, wv_sendBinaryData,
+                    callback) < 0) return -3;
 
     n     = *iBuf;
     i4    = i;
@@ -2275,7 +2665,8 @@ wv_writeGPrim(wvGPrim *gp, void *wsi, unsigned char *buf, int *iBuf,
         (gp->stripes[i].pIndice2  != NULL)) {
       npack = 12+gp->nameLen + 2*gp->stripes[i].npIndices;
       if ((gp->stripes[i].npIndices%2) != 0) npack += 2;
-      wv_writeBuf(wsi, buf, npack, iBuf, wv_sendBinaryData, callback);
+      if (wv_writeBuf(wsi, buf, bufLen, npack, iBuf, wv_sendBinaryData,
+                      callback) < 0) return -3;
       n     = *iBuf;
       i4    = i;
       c1[3] = 3;                        /* new data opcode */
@@ -2303,7 +2694,8 @@ wv_writeGPrim(wvGPrim *gp, void *wsi, unsigned char *buf, int *iBuf,
         (gp->stripes[i].lIndice2  != NULL)) {
       npack = 12+gp->nameLen + 2*gp->stripes[i].nlIndices;
       if ((gp->stripes[i].nlIndices%2) != 0) npack += 2;
-      wv_writeBuf(wsi, buf, npack, iBuf, wv_sendBinaryData, callback);
+      if (wv_writeBuf(wsi, buf, bufLen, npack, iBuf, wv_sendBinaryData,
+                      callback) < 0) return -3;
       n     = *iBuf;
       i4    = i;
       c1[3] = 3;                        /* new data opcode */
@@ -2328,6 +2720,91 @@ wv_writeGPrim(wvGPrim *gp, void *wsi, unsigned char *buf, int *iBuf,
     }
 
   }
+  return 0;
+}
+
+
+/* bytes of the messages wv_writeGPrim puts out for stripe i, the largest
+ * of them raises *largest */
+static size_t
+wv_stripeSize(wvGPrim *gp, int i, int *largest)
+{
+  int      npack;
+  size_t   size;
+  wvStripe *stripe = &gp->stripes[i];
+
+  if ((stripe->nsVerts == 0) || (stripe->vertices == NULL)) return 0;
+
+  npack = 12 + gp->nameLen + 3*4*stripe->nsVerts;
+  if ((stripe->nsIndices != 0) && (stripe->sIndice2 != NULL))
+    npack += 2*stripe->nsIndices + 6;
+  if (stripe->colors  != NULL) npack += 3*stripe->nsVerts + 8;
+  if (stripe->normals != NULL) npack += 3*4*stripe->nsVerts + 4;
+  if ((gp->gtype == WV_LINE) && (gp->normals != NULL) && (i == 0))
+    npack += 3*4*gp->nlIndex + 4;
+  if (npack > *largest) *largest = npack;
+  size = npack;
+
+  if ((stripe->npIndices != 0) && (stripe->pIndice2 != NULL)) {
+    npack = 14 + gp->nameLen + 2*stripe->npIndices;
+    if (npack > *largest) *largest = npack;
+    size += npack;
+  }
+  if ((stripe->nlIndices != 0) && (stripe->lIndice2 != NULL)) {
+    npack = 14 + gp->nameLen + 2*stripe->nlIndices;
+    if (npack > *largest) *largest = npack;
+    size += npack;
+  }
+  return size;
+}
+
+
+/* estimates what wv_sendGPrim puts out for the same flag
+ *
+ * where: cntxt   - the wvContext we are using
+ *        flag    - as for wv_sendGPrim
+ *        largest - returns the size of the largest message
+ *
+ * returns the number of bytes, not counting the continue opcodes between
+ * buffers. Both are upper bounds; the GPrims must not change in between,
+ * i.e. it is called between wv_prepareForSends and wv_finishSends
+ */
+size_t
+wv_sendSize(wvContext *cntxt, int flag, int *largest)
+{
+  int     i, j, npack;
+  size_t  size = 0;
+  wvGPrim *gp;
+
+  *largest = 8;
+  if (flag == 1) {
+    *largest = 56;                      /* init message */
+    size     = 56;
+  }
+  if (cntxt->gPrims == NULL) return size;
+  if (cntxt->cleanAll != 0) size += 8;
+
+  for (i = 0; i < cntxt->nGPrim; i++) {
+    gp = &cntxt->gPrims[i];
+    if ((gp->updateFlg == 0) && (flag != -1)) continue;
+    if ((gp->updateFlg == WV_DELETE) && (flag == -1)) continue;
+    if  (gp->updateFlg == WV_DELETE) {
+      npack = 8 + gp->nameLen;
+      if (npack > *largest) *largest = npack;
+      size += npack;
+      continue;
+    }
+    /* the header of a new gPrim, or the headers of its edits */
+    npack = 8 + gp->nameLen + 68;
+    if (npack > *largest) *largest = npack;
+    size += npack;
+    for (j = 0; j < gp->nStripe; j++) {
+      if ((gp->stripes[j].nsVerts == 0) || (gp->stripes[j].vertices == NULL))
+        continue;
+      size += wv_stripeSize(gp, j, largest) + 4*(12 + gp->nameLen);
+    }
+  }
+  return size + 4;                      /* eof opcode */
 }
 
 
@@ -2338,6 +2815,9 @@ wv_writeGPrim(wvGPrim *gp, void *wsi, unsigned char *buf, int *iBuf,
  * where: wsi   - blind pointer that gets passed on to the send function
  *        cntxt - the wvContext we are using
  *        buf   - the allocated buffer to pack the message
+ *        bufLen- its length, at least 4 more than the largest message
+ *                from wv_sendSize, and no less than 56; -3 is returned
+ *                for a message that does not fit
  *        flag  - what to do:
  *                 1 - send init message
  *                 0 - send only gPrim updates
@@ -2347,14 +2827,34 @@ wv_writeGPrim(wvGPrim *gp, void *wsi, unsigned char *buf, int *iBuf,
  *
  */
 int
-wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag, 
-             cy_callback wv_sendBinaryData, void *callback)
+wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int bufLen,
+             int flag, cy_callback wv_sendBinaryData, void *callback)
 {
-  int            i, j, k, iBuf, npack, i4;
+  return wv_sendGPrimList(wsi, cntxt, buf, bufLen, flag, 0, NULL,
+                          wv_sendBinaryData, callback);
+}
+
+
+/*
+ * like wv_sendGPrim, for only the nList gPrims whose indices are in list,
+ * in that order, or for all of them in the order of the table if list is
+ * NULL. Sending the gPrims in several calls between the same
+ * wv_prepareForSends and wv_finishSends sends each of them once, as long
+ * as every gPrim is in one of the lists, and only the first call has
+ * flag 1.
+ */
+int
+wv_sendGPrimList(void *wsi, wvContext *cntxt, unsigned char *buf, int bufLen,
+                 int flag, int nList, /*@null@*/ const int *list,
+                 cy_callback wv_sendBinaryData, void *callback)
+{
+  int            j, k, n, iBuf, npack, i4;
   unsigned short *s2 = (unsigned short *) &i4;
   unsigned char  *c1 = (unsigned char *)  &i4;
   wvGPrim        *gp;
   
+  if ((bufLen < 4) || ((flag == 1) && (bufLen < 56))) return -3;
+
   /* init message */
   if (flag == 1) {
     buf[0] = 0;
@@ -2379,14 +2879,18 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
   }
  
   if (cntxt->gPrims == NULL) return -1;
+  if (list == NULL) nList = cntxt->nGPrim;
+  for (n = 0; n < nList; n++)
+    if ((list != NULL) && ((list[n] < 0) || (list[n] >= cntxt->nGPrim)))
+      return -2;
 
   /* any changes? */
   if ((flag == 0) && (cntxt->cleanAll == 0)) {
-    for (i = 0; i < cntxt->nGPrim; i++) {
-      gp = &cntxt->gPrims[i];
+    for (n = 0; n < nList; n++) {
+      gp = &cntxt->gPrims[(list == NULL) ? n : list[n]];
       if (gp->updateFlg != 0) break;
     }
-    if (i == cntxt->nGPrim) return 0;
+    if (n == nList) return 0;
   }
   
   /* put out the new data*/
@@ -2394,7 +2898,8 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
   iBuf = 0;
   if (cntxt->cleanAll != 0) {
     npack = 8;
-    wv_writeBuf(wsi, buf, npack, &iBuf, wv_sendBinaryData, callback);
+    if (wv_writeBuf(wsi, buf, bufLen, npack, &iBuf, wv_sendBinaryData,
+                    callback) < 0) return -3;
     buf[iBuf  ] = 0;
     buf[iBuf+1] = 0;
     buf[iBuf+2] = 0;
@@ -2407,17 +2912,18 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
     cntxt->cleanAll = 0;
   }
 
-  for (i = 0; i < cntxt->nGPrim; i++) {
-    gp = &cntxt->gPrims[i];
+  for (n = 0; n < nList; n++) {
+    gp = &cntxt->gPrims[(list == NULL) ? n : list[n]];
     if ((gp->updateFlg == 0) && (flag != -1)) continue;  
     if ((gp->updateFlg == WV_DELETE) && (flag == -1)) continue;
 /*  printf(" flag = %d,  %d  gp->updateFlg = %d\n", 
-           flag, i, gp->updateFlg); */
+           flag, n, gp->updateFlg); */
     if  (gp->updateFlg == WV_DELETE) {
     
       /* delete the gPrim */
       npack = 8 + gp->nameLen;
-      wv_writeBuf(wsi, buf, npack, &iBuf, wv_sendBinaryData, callback);
+      if (wv_writeBuf(wsi, buf, bufLen, npack, &iBuf, wv_sendBinaryData,
+                      callback) < 0) return -3;
       buf[iBuf  ] = 0;
       buf[iBuf+1] = 0;
       buf[iBuf+2] = 0;
@@ -2435,7 +2941,8 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
       npack = 8 + gp->nameLen + 16;
       if (gp->gtype > 0) npack += 16;
       if (gp->gtype > 1) npack += 36;
-      wv_writeBuf(wsi, buf, npack, &iBuf, wv_sendBinaryData, callback);
+      if (wv_writeBuf(wsi, buf, bufLen, npack, &iBuf, wv_sendBinaryData,
+                      callback) < 0) return -3;
       i4    = gp->nStripe;
       c1[3] = 1;                        /* new opcode */
       memcpy(&buf[iBuf  ], c1, 4);
@@ -2461,7 +2968,8 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
         memcpy(&buf[iBuf], gp->normal, 12);
         iBuf += 12;
       }
-      wv_writeGPrim(gp, wsi, buf, &iBuf, wv_sendBinaryData, callback); 
+      if (wv_writeGPrim(gp, wsi, buf, bufLen, &iBuf, wv_sendBinaryData,
+                        callback) < 0) return -3;
 
     } else {
     
@@ -2472,7 +2980,8 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
           if ((gp->stripes[j].nsVerts  == 0) || 
               (gp->stripes[j].vertices == NULL)) continue;
           npack = 12 + gp->nameLen + 3*4*gp->stripes[j].nsVerts;
-          wv_writeBuf(wsi, buf, npack, &iBuf, wv_sendBinaryData, callback);
+          if (wv_writeBuf(wsi, buf, bufLen, npack, &iBuf, wv_sendBinaryData,
+                          callback) < 0) return -3;
           i4    = j;
           c1[3] = 4;                        /* edit opcode */
           memcpy(&buf[iBuf   ], c1, 4);
@@ -2494,7 +3003,8 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
               (gp->stripes[j].sIndice2  == NULL)) continue;
           npack = 12 + gp->nameLen + 2*gp->stripes[j].nsIndices;
           if ((gp->stripes[j].nsIndices%2) != 0) npack += 2;
-          wv_writeBuf(wsi, buf, npack, &iBuf, wv_sendBinaryData, callback);
+          if (wv_writeBuf(wsi, buf, bufLen, npack, &iBuf, wv_sendBinaryData,
+                          callback) < 0) return -3;
           i4    = j;
           c1[3] = 4;                        /* edit opcode */
           memcpy(&buf[iBuf   ], c1, 4);
@@ -2521,7 +3031,8 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
           npack = 12 + gp->nameLen + 3*gp->stripes[j].nsVerts;
           if (((3*gp->stripes[j].nsVerts)%4) != 0)
             npack += 4 - (3*gp->stripes[j].nsVerts)%4;
-          wv_writeBuf(wsi, buf, npack, &iBuf, wv_sendBinaryData, callback);
+          if (wv_writeBuf(wsi, buf, bufLen, npack, &iBuf, wv_sendBinaryData,
+                          callback) < 0) return -3;
           i4    = j;
           c1[3] = 4;                        /* edit opcode */
           memcpy(&buf[iBuf   ], c1, 4);
@@ -2548,7 +3059,8 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
             if ((gp->stripes[j].nsVerts  == 0) || 
                 (gp->stripes[j].vertices == NULL)) continue;
             npack = 12 + gp->nameLen + 3*4*gp->stripes[j].nsVerts;
-            wv_writeBuf(wsi, buf, npack, &iBuf, wv_sendBinaryData, callback);
+            if (wv_writeBuf(wsi, buf, bufLen, npack, &iBuf, wv_sendBinaryData,
+                            callback) < 0) return -3;
             i4    = j;
             c1[3] = 4;                      /* edit opcode */
             memcpy(&buf[iBuf   ], c1, 4);
@@ -2566,7 +3078,8 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
         } else if (gp->gtype == WV_LINE) {
           /* line decorations */
           npack = 12 + gp->nameLen + 3*4*gp->nlIndex;
-          wv_writeBuf(wsi, buf, npack, &iBuf, wv_sendBinaryData, callback);
+          if (wv_writeBuf(wsi, buf, bufLen, npack, &iBuf, wv_sendBinaryData,
+                          callback) < 0) return -3;
           i4    = 0;
           c1[3] = 4;                        /* edit opcode */
           memcpy(&buf[iBuf   ], c1, 4);
@@ -2587,7 +3100,8 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
               (gp->stripes[j].pIndice2  == NULL)) continue;
           npack = 12 + gp->nameLen + 2*gp->stripes[j].npIndices;
           if ((gp->stripes[j].npIndices%2) != 0) npack += 2;
-          wv_writeBuf(wsi, buf, npack, &iBuf, wv_sendBinaryData, callback);
+          if (wv_writeBuf(wsi, buf, bufLen, npack, &iBuf, wv_sendBinaryData,
+                          callback) < 0) return -3;
           i4    = j;
           c1[3] = 4;                        /* edit opcode */
           memcpy(&buf[iBuf   ], c1, 4);
@@ -2613,7 +3127,8 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
               (gp->stripes[j].lIndice2  == NULL)) continue;
           npack = 12 + gp->nameLen + 2*gp->stripes[j].nlIndices;
           if ((gp->stripes[j].nlIndices%2) != 0) npack += 2;
-          wv_writeBuf(wsi, buf, npack, &iBuf, wv_sendBinaryData, callback);
+          if (wv_writeBuf(wsi, buf, bufLen, npack, &iBuf, wv_sendBinaryData,
+                          callback) < 0) return -3;
           i4    = j;
           c1[3] = 4;                        /* edit opcode */
           memcpy(&buf[iBuf   ], c1, 4);
@@ -2650,15 +3165,27 @@ wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag,
 }
 
 /* 
- * sets the thread marker and gets ready for sends
+ * sets the thread marker and gets ready for sends, once the open data
+ * transactions and any other thread's sends are done
  */
 void
 wv_prepareForSends(wvContext *cntxt)
 {
+  wvThread self;
+
   if (cntxt == NULL) return;
 
-  while (cntxt->dataAccess != 0) usleep(1000);
-  cntxt->ioAccess = 1;
+  self = wv_thisThread();
+  wv_mutexLock(&cntxt->lock);
+  if ((cntxt->ioAccess == 0) || !wv_sameThread(cntxt->ioThread, self)) {
+    cntxt->ioWaiting += 1;
+    while ((cntxt->dataAccess != 0) || (cntxt->ioAccess != 0))
+      wv_condWait(&cntxt->released, &cntxt->lock);
+    cntxt->ioWaiting -= 1;
+    cntxt->ioAccess   = 1;
+    cntxt->ioThread   = self;
+  }
+  wv_mutexUnlock(&cntxt->lock);
 }
 
 
@@ -2674,8 +3201,11 @@ wv_finishSends(wvContext *cntxt)
 {
   int i, j;
   
+  wv_mutexLock(&cntxt->lock);
   if (cntxt->gPrims == NULL) {
     cntxt->ioAccess = 0;
+    wv_condWakeAll(&cntxt->released);
+    wv_mutexUnlock(&cntxt->lock);
     return;
   }
 
@@ -2693,9 +3223,61 @@ wv_finishSends(wvContext *cntxt)
     cntxt->gPrims[i] = cntxt->gPrims[j];
     i++;
   }
-  cntxt->nGPrim   = i;
+  /* the remaining gPrims have moved */
+  if (i != cntxt->nGPrim) {
+    cntxt->nGPrim = i;
+    wv_rehashGPrims(cntxt);
+  }
   
   cntxt->ioAccess = 0;
+  wv_condWakeAll(&cntxt->released);
+  wv_mutexUnlock(&cntxt->lock);
+}
+
+
+/* frees the stripes of all GPrims once they are sent, to be made again by
+ * wv_restoreStripes when needed
+ *
+ * called between wv_prepareForSends and wv_finishSends, like wv_sendGPrim
+ */
+void
+wv_releaseStripes(wvContext *cntxt)
+{
+  int     i, j;
+  wvGPrim *gp;
+
+  if (cntxt->gPrims == NULL) return;
+  for (i = 0; i < cntxt->nGPrim; i++) {
+    gp = &cntxt->gPrims[i];
+    for (j = 0; j < gp->nStripe; j++)
+      wv_freeStripe(gp->stripes[j], gp->nStripe);
+    wv_free(gp->stripes);
+    gp->stripes = NULL;
+    gp->nStripe = 0;
+  }
+}
+
+
+/* makes the stripes that wv_releaseStripes freed of the GPrims that a
+ * wv_sendGPrim with flag sends, before its wv_sendSize
+ *
+ * returns 0 or the error of wv_makeStripes
+ */
+int
+wv_restoreStripes(wvContext *cntxt, int flag)
+{
+  int     i, stat;
+  wvGPrim *gp;
+
+  if ((flag == 1) || (cntxt->gPrims == NULL)) return 0;
+  for (i = 0; i < cntxt->nGPrim; i++) {
+    gp = &cntxt->gPrims[i];
+    if ((gp->stripes != NULL) || ((gp->updateFlg&WV_DELETE) != 0)) continue;
+    if ((gp->updateFlg == 0) && (flag != -1)) continue;
+    stat = wv_makeStripes(gp, cntxt->bias);
+    if (stat != 0) return stat;
+  }
+  return 0;
 }
 
 void wv_focusVertices(int nVerts, float *vertices, float *focus)
@@ -2797,7 +3379,9 @@ float * wv_getFocus(float * bbox, float *focus){
 
 void wv_setBias(wvContext *cntxt, int bias)
 {
+    wv_lockData(cntxt);
     cntxt->bias = bias;
+    wv_unlockData(cntxt);
 }
 
 int wv_checkConnectivities(int nPoints, int nTriangles, int *pointIndices, int bias){
@@ -13,9 +13,20 @@
 
 #define _WV_H_
 
-
-
-/* IO buffer size */
+#ifdef WIN32
+#include <Windows.h>
+typedef CRITICAL_SECTION   wvMutex;
+typedef CONDITION_VARIABLE wvCond;
+typedef DWORD              wvThread;
+#else
+#include <pthread.h>
+typedef pthread_mutex_t    wvMutex;
+typedef pthread_cond_t     wvCond;
+typedef pthread_t          wvThread;
+#endif
+
+
+/* default IO buffer size */
 #define BUFLEN     3205696
 
 
@@ -52,6 +63,9 @@
 #define WV_DELETE      512
 #define WV_DONE       1024
 
+/* set in the dataType of items from wv_borrowData */
+#define WV_BORROWED   2048
+
 
 /* Data Types */
 
@@ -87,6 +101,7 @@ typedef struct {
 typedef struct {
   int            gtype;         /* graphic primitive type */
   int            updateFlg;     /* update flag */
+  int            borrowed;      /* VBO bits of arrays the caller owns */
   int            nStripe;       /* number of stripes */
   int            attrs;         /* initial plotting attribute bits */
   int            nVerts;        /* number of vertices */
@@ -101,6 +116,7 @@ typedef struct {
   float          fColor[3];     /* triangle foreground color */
   float          bColor[3];     /* triangle background color */
   float          normal[3];     /* constant normal -- planar surfaces only */
+  float          box[6];        /* maxima, then minima of the vertices */
   char           *name;         /* gPrim name (nameLen is length+) */
   float          *vertices;     /* the complete set of vertices (3XnVerts) */
   float          *normals;      /* the complete suite of normals (3XnVerts) */
@@ -113,7 +129,11 @@ typedef struct {
 
 typedef struct {
   int     ioAccess;             /* IO currently has access */
-  int     dataAccess;           /* data routines have access */
+  int     dataAccess;           /* number of open data transactions */
+  int     ioWaiting;            /* number of sends waiting for access */
+  wvThread ioThread;            /* the thread that has IO access */
+  wvMutex lock;                 /* guards the GPrim table and the above */
+  wvCond  released;             /* signalled when access is given back */
   int     bias;                 /* vaule subtracted from all indices */
   float   fov;                  /* angle field of view for perspective */
   float   zNear;                /* Z near value for perspective */
@@ -126,6 +146,9 @@ typedef struct {
   int     cleanAll;		/* flag for complete gPrim delete */
   /*@null@*/
   wvGPrim *gPrims;              /* the graphics primitives */
+  int     mHash;                /* number of slots in nameHash */
+  /*@null@*/
+  int     *nameHash;            /* gPrim indices hashed by name, -1 free */
 } wvContext;
 
                 
@@ -139,23 +162,52 @@ wv_createContext(int bias, float fov, float zNear, float zFar, float *eye,
 int
 wv_setData(int type, int len, void *data, int VBOtype, wvData *dstruct);
 
+int
+wv_borrowData(int len, void *data, int VBOtype, wvData *dstruct);
+
 int
 wv_addGPrim(wvContext *cntxt, char *name, int gtype, int attrs, 
             int nItems, wvData *items);
 
+int
+wv_indexGPrim(wvContext *cntxt, char *name);
+
+int
+wv_modGPrim(wvContext *cntxt, int index, int nItems, wvData *items);
+
 typedef int (*cy_callback) (void *wsi, unsigned char *buf, int ibuf, void *f);
 
 int
-wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int flag, 
-             cy_callback wv_sendBinaryData, void *callback);
+wv_sendGPrim(void *wsi, wvContext *cntxt, unsigned char *buf, int bufLen,
+             int flag, cy_callback wv_sendBinaryData, void *callback);
+
+int
+wv_sendGPrimList(void *wsi, wvContext *cntxt, unsigned char *buf, int bufLen,
+                 int flag, int nList, /*@null@*/ const int *list,
+                 cy_callback wv_sendBinaryData, void *callback);
+
+size_t
+wv_sendSize(wvContext *cntxt, int flag, int *largest);
              
 void
 wv_removeGPrim(wvContext *cntxt, int index);             
 
+int wv_nameGPrim(wvContext *cntxt, int index, char *name, int len);
+
+int wv_setLineWidth(wvContext *cntxt, int index, float width);
+
+void wv_beginData(wvContext *cntxt);
+
+void wv_endData(wvContext *cntxt);
+
 void wv_prepareForSends(wvContext *cntxt);
     
 void wv_finishSends(wvContext *cntxt);
 
+void wv_releaseStripes(wvContext *cntxt);
+
+int wv_restoreStripes(wvContext *cntxt, int flag);
+
 void wv_destroyContext(wvContext **context);
     
 void wv_removeAll(wvContext *cntxt);
@@ -0,0 +1,182 @@
+"""
+Compile STL models into scene containers, see pyV3D.container, and serve
+them to viewers.
+
+usage: wvserver compile [-o OUTPUT] [--weld] [--tolerance T] [--edges E]
+                        [--buffer-size N] SOURCE
+       wvserver serve [--port N] [--address A] [--client DIR] [--stats]
+                      [--view-order] [--workers N] [--cache-dir DIR]
+                      [VIEW_DIR]
+
+compile encodes SOURCE, an STL file or an assembly given as a directory,
+a glob pattern or a .json manifest, once and writes it to OUTPUT, by
+default SOURCE with a .wvs extension. serve answers WebSocket viewers on
+/ws?fname=NAME, where NAME is a file under VIEW_DIR. Containers are mapped
+and their frames sent as they are; STL files and assemblies are loaded
+and encoded as they are opened, with --view-order the GPrims in the view
+of each viewer first, see pyV3D.spatial.
+
+serve --workers N forks N worker processes, one per CPU for 0, that accept
+viewers on the same port. Viewers are dealt to them by the kernel; each
+worker keeps the sessions, one per (fname, obj), of the viewers it
+accepted. The encoded scenes of STL files are shared through a SceneCache
+in --cache-dir, by default a directory of the user's own in the temporary
+directory when there are several workers, so a model is loaded and
+encoded once per host and served by every worker from there. Containers
+are shared by the page cache already. A session is only as live as its
+worker: camera messages and /stats cover the viewers of one worker, and a
+file that changes is encoded again, once, by the worker that gets its
+next viewer.
+"""
+
+import os
+import sys
+import stat
+import errno
+import logging
+import argparse
+import tempfile
+
+from tornado import web
+from tornado.ioloop import IOLoop
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.process import fork_processes, task_id
+
+from pyV3D.handler import (WSHandler, WS_WV_Wrapper, StatsHandler,
+                           BINARY_PROTOCOL)
+from pyV3D.compact import COMPACT_PROTOCOL
+from pyV3D.cache import SceneCache
+from pyV3D.container import ContainerSender, compile_scene
+from pyV3D.assembly import STLAssemblySender
+from pyV3D.stl import STLSender
+from pyV3D.cube import CubeSender
+
+# the first sender that supports what a viewer opens sends it
+SENDERS = [ContainerSender, STLAssemblySender, STLSender, CubeSender]
+
+
+def make_app(view_dir, client_dir=None, collect_stats=False,
+             view_order=False):
+    """Return the tornado Application of serve."""
+    WSHandler.protocols = {BINARY_PROTOCOL: SENDERS,
+                           COMPACT_PROTOCOL: SENDERS}
+    WSHandler.collect_stats = collect_stats
+    WS_WV_Wrapper.send_order = 'view' if view_order else None
+    handlers = [(r'/ws', WSHandler, dict(view_dir=view_dir)),
+                (r'/stats', StatsHandler)]
+    if client_dir is not None:
+        handlers.append((r'/(.*)', web.StaticFileHandler,
+                         dict(path=client_dir, default_filename='index.html')))
+    return web.Application(handlers)
+
+
+def private_cache_dir(parent=None):
+    """Return the default scene cache directory of serve, pyV3D-scenes-UID
+    in parent, the temporary directory by default, creating it so only
+    this user can get at it. Raises OSError if it exists and is anything
+    but a directory of this user's that no one else may use, as others
+    could otherwise plant scenes for the workers to serve.
+    """
+    if parent is None:
+        parent = tempfile.gettempdir()
+    uid = os.getuid()
+    path = os.path.join(parent, 'pyV3D-scenes-%d' % uid)
+    try:
+        os.mkdir(path, 0o700)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    info = os.lstat(path)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != uid or
+            info.st_mode & 0o077):
+        raise OSError("%s is not a directory private to user %d, "
+                      "use --cache-dir" % (path, uid))
+    return path
+
+
+def do_compile(options):
+    output = compile_scene(options.source, options.output,
+                           buffer_size=options.buffer_size,
+                           weld=options.weld, tolerance=options.tolerance,
+                           edges=options.edges)
+    logging.info("wrote %s, %d bytes", output, os.path.getsize(output))
+    return 0
+
+
+def do_serve(options):
+    cache_dir = options.cache_dir
+    if cache_dir is None and options.workers != 1:
+        try:
+            cache_dir = private_cache_dir()
+        except OSError as err:
+            logging.error("no scene cache: %s", err)
+            return 1
+    if cache_dir is not None:
+        WSHandler.scene_cache = SceneCache(cache_dir=cache_dir)
+
+    # the sockets are bound before forking so every worker accepts on them,
+    # and nothing may start a thread or an IOLoop before
+    sockets = bind_sockets(options.port, options.address)
+    if options.workers != 1:
+        try:
+            fork_processes(options.workers)
+        except KeyboardInterrupt:
+            return 0
+    app = make_app(options.view_dir, options.client, options.stats,
+                   options.view_order)
+    HTTPServer(app).add_sockets(sockets)
+    logging.info("serving %s on %s:%d (worker %s)", options.view_dir,
+                 options.address, options.port, task_id())
+    try:
+        IOLoop.current().start()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--log-level', default='info',
+                        choices=['debug', 'info', 'warning', 'error'])
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser('compile', help="write the scene container of "
+                            "an STL file or assembly")
+    p.add_argument('source')
+    p.add_argument('-o', '--output', default=None)
+    p.add_argument('--weld', action='store_true',
+                   help="merge coincident vertices and smooth the normals")
+    p.add_argument('--tolerance', type=float, default=0.0,
+                   help="distance below which vertices are merged")
+    p.add_argument('--edges', default='all',
+                   choices=['all', 'unique', 'feature'])
+    p.add_argument('--buffer-size', type=int, default=None,
+                   help="the most bytes in a frame")
+    p.set_defaults(func=do_compile)
+
+    p = commands.add_parser('serve', help="serve containers and STL files "
+                            "to viewers")
+    p.add_argument('view_dir', nargs='?', default='.')
+    p.add_argument('--port', type=int, default=8000)
+    p.add_argument('--address', default='')
+    p.add_argument('--client', default=None,
+                   help="directory of the viewer pages to serve")
+    p.add_argument('--stats', action='store_true',
+                   help="collect stats, served on /stats")
+    p.add_argument('--view-order', action='store_true',
+                   help="send what is in the view of a viewer first")
+    p.add_argument('--workers', type=int, default=1,
+                   help="number of worker processes, 0 for one per CPU")
+    p.add_argument('--cache-dir', default=None,
+                   help="directory of the encoded scenes the workers share")
+    p.set_defaults(func=do_serve)
+
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=getattr(logging, options.log_level.upper()))
+    return options.func(options)
+
+
+if __name__ == '__main__':
+    sys.exit(main())